@@ -9,125 +9,521 @@ import sqlite3
 import json
 import os
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Tuple, Any
-import statistics
 import math
-from collections import defaultdict
+import time
+import copy
+import bisect
+import functools
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 
 try:
-    import matplotlib.pyplot as plt
+    # Figure se usa sin pyplot: no hay estado global ni ventanas, y
+    # savefig() a PNG renderiza directamente con Agg
     import matplotlib.dates as mdates
     from matplotlib.figure import Figure
+    import numpy as np  # dependencia de matplotlib
     MATPLOTLIB_AVAILABLE = True
 except ImportError:
     MATPLOTLIB_AVAILABLE = False
     print("Matplotlib no instalado. Gráficos no disponibles.")
     print("Instalar con: pip install matplotlib")
 
+# Sentencias preparadas que conserva cada conexión (caché LRU de sqlite3
+# indexada por el texto SQL: las consultas usan siempre texto constante)
+_STATEMENT_CACHE_SIZE = 256
+
+# Umbrales de severidad por tipo de anomalía: (límites ascendentes, niveles).
+# Un valor que supera i límites toma levels[i]; None indica que no hay anomalía
+_SEVERITY_TIERS = {
+    'high_failure_rate': ((10, 25), (None, 'medium', 'high')),   # % fallos última hora
+    'queue_buildup': ((1000, 5000), (None, 'medium', 'high')),   # mensajes pendientes
+    'route_congestion': ((500,), (None, 'medium')),             # mensajes en la ruta
+    'slow_processing': ((10,), (None, 'medium')),               # segundos promedio
+}
+
+def _severity(anomaly_type: str, value: float):
+    """Nivel de severidad del valor según _SEVERITY_TIERS (None si no es anomalía)"""
+    thresholds, levels = _SEVERITY_TIERS[anomaly_type]
+    return levels[bisect.bisect_left(thresholds, value)]
+
+def _utc_cutoff(**delta) -> str:
+    """
+    Devuelve el instante UTC desplazado hacia atrás, en el formato de texto
+    que SQLite compara contra las columnas TIMESTAMP del buffer
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(**delta)
+    return cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
+def _ttl_cached(ttl: float):
+    """
+    Cachea el resultado de un método de análisis durante ``ttl`` segundos,
+    por instancia y por argumentos. Se devuelve una copia para que quien
+    llama pueda modificar el resultado sin alterar la caché
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            cached = self._cache.get(key)
+            now = time.monotonic()
+            if cached is not None and now - cached[0] < ttl:
+                return copy.deepcopy(cached[1])
+            value = method(self, *args, **kwargs)
+            self._cache[key] = (now, value)
+            return copy.deepcopy(value)
+        return wrapper
+    return decorator
+
+# Hoja de estilos del reporte HTML: texto fijo, se escribe tal cual
+_REPORT_CSS = """        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, sans-serif;
+            line-height: 1.6;
+            color: #333;
+            max-width: 1200px;
+            margin: 0 auto;
+            padding: 20px;
+            background: #f5f5f5;
+        }
+        h1 {
+            color: #2c3e50;
+            border-bottom: 3px solid #3498db;
+            padding-bottom: 10px;
+        }
+        h2 {
+            color: #34495e;
+            margin-top: 30px;
+            border-left: 4px solid #3498db;
+            padding-left: 10px;
+        }
+        .card {
+            background: white;
+            border-radius: 8px;
+            padding: 20px;
+            margin: 20px 0;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }
+        .stat-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
+            gap: 20px;
+            margin: 20px 0;
+        }
+        .stat-card {
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            padding: 20px;
+            border-radius: 8px;
+            text-align: center;
+        }
+        .stat-value {
+            font-size: 36px;
+            font-weight: bold;
+            margin: 10px 0;
+        }
+        .stat-label {
+            font-size: 14px;
+            opacity: 0.9;
+        }
+        table {
+            width: 100%;
+            border-collapse: collapse;
+            margin: 20px 0;
+        }
+        th, td {
+            padding: 12px;
+            text-align: left;
+            border-bottom: 1px solid #ddd;
+        }
+        th {
+            background-color: #3498db;
+            color: white;
+        }
+        tr:hover {
+            background-color: #f5f5f5;
+        }
+        .alert {
+            padding: 15px;
+            border-radius: 5px;
+            margin: 10px 0;
+        }
+        .alert-high {
+            background-color: #ffe4e1;
+            border-left: 5px solid #ff6b6b;
+        }
+        .alert-medium {
+            background-color: #fff3cd;
+            border-left: 5px solid #ffc107;
+        }
+        .alert-low {
+            background-color: #d4edda;
+            border-left: 5px solid #28a745;
+        }
+        .progress-bar {
+            background-color: #e0e0e0;
+            border-radius: 10px;
+            height: 20px;
+            overflow: hidden;
+        }
+        .progress-fill {
+            background: linear-gradient(90deg, #4CAF50, #8BC34A);
+            height: 100%;
+            transition: width 0.3s ease;
+        }
+        .timestamp {
+            color: #7f8c8d;
+            font-size: 12px;
+            margin-top: 20px;
+            text-align: center;
+        }
+"""
+
+# Fila de la tabla de predicciones (str.format con las claves de cada predicción)
+_PREDICTION_ROW_TEMPLATE = """
+                <tr>
+                    <td>{time}</td>
+                    <td>{predicted_messages:,}</td>
+                    <td>{range_min:,} - {range_max:,}</td>
+                    <td>{confidence}%</td>
+                </tr>
+"""
+
+@dataclass
+class HourlyStats:
+    """Métricas por hora en columnas: una lista por campo, alineadas por índice"""
+    hour: List[str] = field(default_factory=list)
+    created: List[int] = field(default_factory=list)
+    completed: List[int] = field(default_factory=list)
+    failed: List[int] = field(default_factory=list)
+    avg_proc: List[float] = field(default_factory=list)
+    max_proc: List[float] = field(default_factory=list)
+    success_rate: List[float] = field(default_factory=list)
+    
+    def __len__(self) -> int:
+        return len(self.hour)
+    
+    @classmethod
+    def from_cursor(cls, cursor: sqlite3.Cursor, batch_size: int = 1024) -> 'HourlyStats':
+        """
+        Transpone filas (hour, created, completed, failed, avg, max, success_rate)
+        a columnas, leyendo el cursor por lotes para no materializar todas las filas
+        """
+        stats = cls()
+        columns = (stats.hour, stats.created, stats.completed, stats.failed,
+                   stats.avg_proc, stats.max_proc, stats.success_rate)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return stats
+            for column, values in zip(columns, zip(*batch)):
+                column.extend(values)
+    
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Convierte a la lista de diccionarios que consumen JSON y reportes"""
+        return [
+            {
+                'hour': hour,
+                'created': created,
+                'completed': completed,
+                'failed': failed,
+                'avg_processing_time': avg_proc,
+                'max_processing_time': max_proc,
+                'success_rate': rate
+            }
+            for hour, created, completed, failed, avg_proc, max_proc, rate in zip(
+                self.hour, self.created, self.completed, self.failed,
+                self.avg_proc, self.max_proc, self.success_rate)
+        ]
+
 class BufferAnalytics:
     """Sistema de análisis avanzado para el buffer persistente"""
     
     def __init__(self, db_path: str = "buffer.db"):
         self.db_path = db_path
+        self._cache: Dict[tuple, Tuple[float, Any]] = {}
+        # Conexiones de solo lectura de los hilos de trabajo (ver generate_html_report)
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        # Figuras reutilizadas entre llamadas a plot_metrics
+        self._figures: Dict[str, Tuple[Any, Any]] = {}
         if not os.path.exists(db_path):
             print(f"Error: No se encuentra la base de datos {db_path}")
             sys.exit(1)
+        self._conn = self._open_connection()
+        self._ensure_schema()
+        # A partir de aquí todas las consultas son de solo lectura
+        self._conn.execute("PRAGMA query_only=1")
     
-    def get_connection(self):
-        """Obtiene conexión a la base de datos"""
-        conn = sqlite3.connect(self.db_path)
+    def _open_connection(self) -> sqlite3.Connection:
+        """Abre la conexión compartida con los PRAGMAs de lectura analítica"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=_STATEMENT_CACHE_SIZE)
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._apply_read_pragmas(conn)
         return conn
     
-    def analyze_performance(self, hours: int = 24) -> Dict[str, Any]:
+    @staticmethod
+    def _apply_read_pragmas(conn: sqlite3.Connection):
+        """PRAGMAs de conexión para consultas analíticas"""
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        conn.execute("PRAGMA mmap_size=268435456")
+    
+    def _attach_reader(self):
+        """Abre una conexión de solo lectura para el hilo actual"""
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=_STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        self._apply_read_pragmas(conn)
+        self._local.conn = conn
+        with self._readers_lock:
+            self._readers.append(conn)
+    
+    def _close_readers(self):
+        """Cierra las conexiones abiertas por los hilos de trabajo"""
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+    
+    def _ensure_schema(self):
+        """Crea las columnas derivadas e índices que usan los análisis"""
+        with self.get_connection() as conn:
+            # Epoch entero de created_at: columna virtual (no ocupa espacio en
+            # la tabla) que permite agrupar por hora con aritmética entera
+            # (y lo mismo para processed_at)
+            columns = {row['name'] for row in conn.execute("PRAGMA table_xinfo(messages)")}
+            for column, source in (('created_at_ts', 'created_at'), ('processed_at_ts', 'processed_at')):
+                if column not in columns:
+                    conn.execute(f"""
+                        ALTER TABLE messages ADD COLUMN {column} INTEGER
+                        GENERATED ALWAYS AS (CAST(strftime('%s', {source}) AS INTEGER)) VIRTUAL
+                    """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created_at_ts ON messages(created_at_ts)")
+            # El análisis por hora lee ahora hourly_stats
+            conn.execute("DROP INDEX IF EXISTS idx_messages_created_times")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_status_created ON messages(status, created_at)")
+            # Prefijo de idx_messages_status_created (e idx_pending_queue del buffer)
+            conn.execute("DROP INDEX IF EXISTS idx_messages_status")
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_retry_pending
+                ON messages(retry_count, max_retries)
+                WHERE status = 'pending' OR status = 'processing'
+            """)
+            conn.commit()
+            self._ensure_hourly_rollup(conn)
+    
+    def _ensure_hourly_rollup(self, conn: sqlite3.Connection):
         """
-        Analiza el rendimiento del sistema en las últimas horas
+        Crea la tabla hourly_stats y los triggers que la mantienen al día.
         
-        Returns:
-            Diccionario con métricas de rendimiento
+        Cada fila acumula los mensajes creados en una hora (epoch / 3600):
+        total, completados, fallidos y tiempos de procesamiento. Los DELETE
+        de limpieza no descuentan nada, así las horas antiguas conservan su
+        historial aunque los mensajes completados ya se hayan borrado
         """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'hourly_stats'"
+        ).fetchone()
+        if exists:
+            return
+        
+        def proc_time(ref: str) -> str:
+            return (f"(CASE WHEN {ref}.status = 'completed' AND {ref}.processed_at_ts IS NOT NULL "
+                    f"THEN {ref}.processed_at_ts - {ref}.created_at_ts END)")
+        
+        def merge_max(current: str, candidate: str) -> str:
+            return (f"CASE WHEN {current} IS NULL OR {candidate} > {current} "
+                    f"THEN COALESCE({candidate}, {current}) ELSE {current} END")
+        
+        new_time, old_time = proc_time('NEW'), proc_time('OLD')
+        
+        # Tabla, triggers y carga inicial en la misma transacción para que
+        # ninguna escritura concurrente quede contada dos veces o se pierda
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                CREATE TABLE hourly_stats (
+                    hour INTEGER PRIMARY KEY,
+                    created INTEGER NOT NULL DEFAULT 0,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    proc_count INTEGER NOT NULL DEFAULT 0,
+                    sum_proc_time REAL NOT NULL DEFAULT 0,
+                    max_proc_time REAL
+                )
+            """)
+            conn.execute(f"""
+                CREATE TRIGGER trg_hourly_stats_insert AFTER INSERT ON messages
+                BEGIN
+                    INSERT INTO hourly_stats (hour, created, completed, failed,
+                                              proc_count, sum_proc_time, max_proc_time)
+                    VALUES (NEW.created_at_ts / 3600, 1,
+                            NEW.status = 'completed', NEW.status = 'failed',
+                            {new_time} IS NOT NULL, COALESCE({new_time}, 0), {new_time})
+                    ON CONFLICT(hour) DO UPDATE SET
+                        created = created + 1,
+                        completed = completed + excluded.completed,
+                        failed = failed + excluded.failed,
+                        proc_count = proc_count + excluded.proc_count,
+                        sum_proc_time = sum_proc_time + excluded.sum_proc_time,
+                        max_proc_time = {merge_max('max_proc_time', 'excluded.max_proc_time')};
+                END
+            """)
+            conn.execute(f"""
+                CREATE TRIGGER trg_hourly_stats_status AFTER UPDATE OF status ON messages
+                WHEN OLD.status IS NOT NEW.status
+                BEGIN
+                    UPDATE hourly_stats SET
+                        completed = completed + (NEW.status = 'completed') - (OLD.status = 'completed'),
+                        failed = failed + (NEW.status = 'failed') - (OLD.status = 'failed'),
+                        proc_count = proc_count + ({new_time} IS NOT NULL) - ({old_time} IS NOT NULL),
+                        sum_proc_time = sum_proc_time + COALESCE({new_time}, 0) - COALESCE({old_time}, 0),
+                        max_proc_time = {merge_max('max_proc_time', new_time)}
+                    WHERE hour = NEW.created_at_ts / 3600;
+                END
+            """)
+            conn.execute(f"""
+                INSERT INTO hourly_stats (hour, created, completed, failed,
+                                          proc_count, sum_proc_time, max_proc_time)
+                SELECT 
+                    created_at_ts / 3600,
+                    COUNT(*),
+                    SUM(status = 'completed'),
+                    SUM(status = 'failed'),
+                    COUNT({proc_time('messages')}),
+                    COALESCE(SUM({proc_time('messages')}), 0),
+                    MAX({proc_time('messages')})
+                FROM messages
+                WHERE created_at_ts IS NOT NULL
+                GROUP BY created_at_ts / 3600
+            """)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    @staticmethod
+    def _iter_rows(cursor: sqlite3.Cursor, batch_size: int = 1024):
+        """Recorre el resultado por lotes de fetchmany en lugar de fetchall"""
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield from batch
+    
+    @contextmanager
+    def get_connection(self):
+        """
+        Devuelve la conexión del hilo actual (la de solo lectura en los hilos
+        de trabajo, la compartida en el resto) sin cerrarla al salir del bloque
+        """
+        yield getattr(self._local, 'conn', None) or self._conn
+    
+    def clear_cache(self):
+        """Descarta los resultados cacheados para forzar nuevas consultas"""
+        self._cache.clear()
+    
+    def close(self):
+        """Actualiza las estadísticas del planificador y cierra la conexión"""
+        try:
+            self._conn.execute("PRAGMA query_only=0")
+            self._conn.execute("PRAGMA optimize")
+        finally:
+            self._close_readers()
+            self._conn.close()
+    
+    def _hourly_stats(self, hours: int) -> HourlyStats:
+        """Lee las métricas por hora de las últimas horas en formato columnar"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Obtener métricas por hora
+            # Obtener métricas por hora del acumulado hourly_stats: una fila
+            # por hora en vez de recorrer los mensajes del periodo
+            now_ts = int(datetime.now(timezone.utc).timestamp())
             cursor.execute("""
                 SELECT 
-                    strftime('%Y-%m-%d %H:00', created_at) as hour,
-                    COUNT(*) as messages_created,
-                    SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed,
-                    SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed,
-                    AVG(CASE 
-                        WHEN status = 'completed' AND processed_at IS NOT NULL 
-                        THEN (julianday(processed_at) - julianday(created_at)) * 86400
-                        ELSE NULL 
-                    END) as avg_processing_time_seconds,
-                    MAX(CASE 
-                        WHEN status = 'completed' AND processed_at IS NOT NULL 
-                        THEN (julianday(processed_at) - julianday(created_at)) * 86400
-                        ELSE NULL 
-                    END) as max_processing_time_seconds
-                FROM messages
-                WHERE created_at > datetime('now', ? || ' hours')
-                GROUP BY hour
+                    strftime('%Y-%m-%d %H:00', hour * 3600, 'unixepoch') as hour,
+                    created,
+                    completed,
+                    failed,
+                    COALESCE(sum_proc_time / NULLIF(proc_count, 0), 0) as avg_processing_time_seconds,
+                    COALESCE(max_proc_time, 0) as max_processing_time_seconds,
+                    COALESCE(completed * 100.0 / NULLIF(created, 0), 0) as success_rate
+                FROM hourly_stats
+                WHERE hour > ? AND created > 0
                 ORDER BY hour
-            """, (-hours,))
+            """, ((now_ts - hours * 3600) // 3600,))
             
-            hourly_data = []
-            for row in cursor.fetchall():
-                hourly_data.append({
-                    'hour': row['hour'],
-                    'created': row['messages_created'],
-                    'completed': row['completed'] or 0,
-                    'failed': row['failed'] or 0,
-                    'avg_processing_time': row['avg_processing_time_seconds'] or 0,
-                    'max_processing_time': row['max_processing_time_seconds'] or 0,
-                    'success_rate': (row['completed'] / row['messages_created'] * 100) if row['messages_created'] > 0 else 0
-                })
+            return HourlyStats.from_cursor(cursor)
+    
+    @_ttl_cached(ttl=30)
+    def analyze_performance(self, hours: int = 24) -> Dict[str, Any]:
+        """
+        Analiza el rendimiento del sistema en las últimas horas
+        
+        Returns:
+            Diccionario con métricas de rendimiento
+        """
+        stats = self._hourly_stats(hours)
+        
+        # Calcular estadísticas generales sobre las columnas
+        if stats:
+            n = len(stats)
+            completed = stats.completed
+            total_created = sum(stats.created)
+            total_completed = sum(completed)
+            total_failed = sum(stats.failed)
+            avg_throughput = total_completed / n
             
-            # Calcular estadísticas generales
-            if hourly_data:
-                total_created = sum(h['created'] for h in hourly_data)
-                total_completed = sum(h['completed'] for h in hourly_data)
-                total_failed = sum(h['failed'] for h in hourly_data)
-                avg_throughput = total_completed / len(hourly_data) if hourly_data else 0
-                
-                processing_times = [h['avg_processing_time'] for h in hourly_data if h['avg_processing_time'] > 0]
-                avg_processing_time = statistics.mean(processing_times) if processing_times else 0
-                
-                # Detectar tendencias
-                if len(hourly_data) > 1:
-                    recent_throughput = statistics.mean([h['completed'] for h in hourly_data[-3:]])
-                    older_throughput = statistics.mean([h['completed'] for h in hourly_data[:-3]]) if len(hourly_data) > 3 else recent_throughput
-                    trend = "increasing" if recent_throughput > older_throughput * 1.1 else \
-                           "decreasing" if recent_throughput < older_throughput * 0.9 else "stable"
-                else:
-                    trend = "insufficient_data"
-                
-                return {
-                    'period_hours': hours,
-                    'total_messages': total_created,
-                    'completed_messages': total_completed,
-                    'failed_messages': total_failed,
-                    'success_rate': (total_completed / total_created * 100) if total_created > 0 else 0,
-                    'avg_throughput_per_hour': avg_throughput,
-                    'avg_processing_time_seconds': avg_processing_time,
-                    'trend': trend,
-                    'hourly_data': hourly_data
-                }
+            processing_times = [t for t in stats.avg_proc if t > 0]
+            avg_processing_time = sum(processing_times) / len(processing_times) if processing_times else 0
+            
+            # Detectar tendencias
+            if n > 1:
+                recent = completed[-3:]
+                recent_throughput = sum(recent) / len(recent)
+                older_throughput = sum(completed[:-3]) / (n - 3) if n > 3 else recent_throughput
+                trend = "increasing" if recent_throughput > older_throughput * 1.1 else \
+                       "decreasing" if recent_throughput < older_throughput * 0.9 else "stable"
             else:
-                return {
-                    'period_hours': hours,
-                    'total_messages': 0,
-                    'completed_messages': 0,
-                    'failed_messages': 0,
-                    'success_rate': 0,
-                    'avg_throughput_per_hour': 0,
-                    'avg_processing_time_seconds': 0,
-                    'trend': 'no_data',
-                    'hourly_data': []
-                }
+                trend = "insufficient_data"
+            
+            return {
+                'period_hours': hours,
+                'total_messages': total_created,
+                'completed_messages': total_completed,
+                'failed_messages': total_failed,
+                'success_rate': (total_completed / total_created * 100) if total_created > 0 else 0,
+                'avg_throughput_per_hour': avg_throughput,
+                'avg_processing_time_seconds': avg_processing_time,
+                'trend': trend,
+                'hourly_data': stats.to_records()
+            }
+        else:
+            return {
+                'period_hours': hours,
+                'total_messages': 0,
+                'completed_messages': 0,
+                'failed_messages': 0,
+                'success_rate': 0,
+                'avg_throughput_per_hour': 0,
+                'avg_processing_time_seconds': 0,
+                'trend': 'no_data',
+                'hourly_data': []
+            }
     
+    @_ttl_cached(ttl=30)
     def detect_anomalies(self) -> List[Dict[str, Any]]:
         """
         Detecta anomalías en el sistema
@@ -140,74 +536,83 @@ class BufferAnalytics:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # 1. Mensajes atascados en procesamiento
+            # Indicadores escalares en una sola pasada sobre messages
             cursor.execute("""
-                SELECT COUNT(*) as stuck_count, MIN(created_at) as oldest
-                FROM messages 
-                WHERE status = 'processing' 
-                AND datetime(created_at, '+5 minutes') < datetime('now')
-            """)
+                SELECT 
+                    SUM(CASE WHEN status = 'processing' AND created_at < :stuck_before
+                        THEN 1 ELSE 0 END) as stuck_count,
+                    MIN(CASE WHEN status = 'processing' AND created_at < :stuck_before
+                        THEN created_at END) as oldest_stuck,
+                    SUM(CASE WHEN created_at > :hour_ago THEN 1 ELSE 0 END) as recent_total,
+                    SUM(CASE WHEN created_at > :hour_ago AND status = 'failed'
+                        THEN 1 ELSE 0 END) as recent_failed,
+                    SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending_count,
+                    MIN(CASE WHEN status = 'pending' THEN created_at END) as oldest_pending,
+                    AVG(CASE WHEN status = 'completed' AND processed_at > :hour_ago
+                        THEN processed_at_ts - created_at_ts END) as avg_time,
+                    MAX(CASE WHEN status = 'completed' AND processed_at > :hour_ago
+                        THEN processed_at_ts - created_at_ts END) as max_time
+                FROM messages
+            """, {
+                'stuck_before': _utc_cutoff(minutes=5),
+                'hour_ago': _utc_cutoff(hours=1),
+            })
             row = cursor.fetchone()
-            if row['stuck_count'] > 0:
+            
+            # Mensajes no terminales cerca del límite de reintentos: se cuentan
+            # sobre el índice parcial (solo contiene pending/processing y cubre
+            # ambas columnas). Sin INDEXED BY el planificador prefiere el índice
+            # por status, que obliga a leer cada fila de la tabla
+            cursor.execute("""
+                SELECT COUNT(*) as count FROM messages INDEXED BY idx_messages_retry_pending
+                WHERE (status = 'pending' OR status = 'processing')
+                  AND retry_count + 1 >= max_retries
+            """)
+            high_retry_count = cursor.fetchone()['count']
+            
+            # 1. Mensajes atascados en procesamiento
+            stuck_count = row['stuck_count'] or 0
+            if stuck_count > 0:
                 anomalies.append({
                     'type': 'stuck_messages',
                     'severity': 'high',
-                    'count': row['stuck_count'],
-                    'oldest': row['oldest'],
-                    'message': f"{row['stuck_count']} mensajes atascados en procesamiento"
+                    'count': stuck_count,
+                    'oldest': row['oldest_stuck'],
+                    'message': f"{stuck_count} mensajes atascados en procesamiento"
                 })
             
             # 2. Alta tasa de fallos
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total,
-                    SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed
-                FROM messages
-                WHERE created_at > datetime('now', '-1 hour')
-            """)
-            row = cursor.fetchone()
-            if row['total'] > 0:
-                failure_rate = (row['failed'] / row['total']) * 100
-                if failure_rate > 10:
+            recent_total = row['recent_total'] or 0
+            if recent_total > 0:
+                failure_rate = ((row['recent_failed'] or 0) / recent_total) * 100
+                severity = _severity('high_failure_rate', failure_rate)
+                if severity:
                     anomalies.append({
                         'type': 'high_failure_rate',
-                        'severity': 'high' if failure_rate > 25 else 'medium',
+                        'severity': severity,
                         'rate': failure_rate,
                         'message': f"Alta tasa de fallos: {failure_rate:.1f}% en la última hora"
                     })
             
             # 3. Acumulación de mensajes pendientes
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as pending_count,
-                    MIN(created_at) as oldest_pending
-                FROM messages 
-                WHERE status = 'pending'
-            """)
-            row = cursor.fetchone()
-            if row['pending_count'] > 1000:
+            pending_count = row['pending_count'] or 0
+            severity = _severity('queue_buildup', pending_count)
+            if severity:
                 anomalies.append({
                     'type': 'queue_buildup',
-                    'severity': 'high' if row['pending_count'] > 5000 else 'medium',
-                    'count': row['pending_count'],
+                    'severity': severity,
+                    'count': pending_count,
                     'oldest': row['oldest_pending'],
-                    'message': f"Acumulación de {row['pending_count']} mensajes pendientes"
+                    'message': f"Acumulación de {pending_count} mensajes pendientes"
                 })
             
             # 4. Mensajes con muchos reintentos
-            cursor.execute("""
-                SELECT COUNT(*) as high_retry_count
-                FROM messages 
-                WHERE retry_count >= max_retries - 1
-                AND status NOT IN ('completed', 'failed')
-            """)
-            row = cursor.fetchone()
-            if row['high_retry_count'] > 0:
+            if high_retry_count > 0:
                 anomalies.append({
                     'type': 'high_retry_messages',
                     'severity': 'medium',
-                    'count': row['high_retry_count'],
-                    'message': f"{row['high_retry_count']} mensajes cerca del límite de reintentos"
+                    'count': high_retry_count,
+                    'message': f"{high_retry_count} mensajes cerca del límite de reintentos"
                 })
             
             # 5. Desbalance en rutas
@@ -219,35 +624,29 @@ class BufferAnalytics:
                 FROM messages
                 WHERE status IN ('pending', 'processing')
                 GROUP BY source, destination
-                HAVING count > 100
+                HAVING count > ?
                 ORDER BY count DESC
-            """)
+            """, (_SEVERITY_TIERS['route_congestion'][0][0],))
             
+            # Solo vuelven las rutas que superan el primer umbral
             routes = cursor.fetchall()
             for route in routes:
-                if route['count'] > 500:
+                severity = _severity('route_congestion', route['count'])
+                if severity:
                     anomalies.append({
                         'type': 'route_congestion',
-                        'severity': 'medium',
+                        'severity': severity,
                         'route': f"{route['source']}->{route['destination']}",
                         'count': route['count'],
                         'message': f"Congestión en ruta {route['source']}->{route['destination']}: {route['count']} mensajes"
                     })
             
             # 6. Tiempo de procesamiento anormal
-            cursor.execute("""
-                SELECT 
-                    AVG(julianday(processed_at) - julianday(created_at)) * 86400 as avg_time,
-                    MAX(julianday(processed_at) - julianday(created_at)) * 86400 as max_time
-                FROM messages
-                WHERE status = 'completed'
-                AND processed_at > datetime('now', '-1 hour')
-            """)
-            row = cursor.fetchone()
-            if row['avg_time'] and row['avg_time'] > 10:  # Más de 10 segundos promedio
+            severity = _severity('slow_processing', row['avg_time'] or 0)
+            if severity:
                 anomalies.append({
                     'type': 'slow_processing',
-                    'severity': 'medium',
+                    'severity': severity,
                     'avg_time': row['avg_time'],
                     'max_time': row['max_time'],
                     'message': f"Procesamiento lento: promedio {row['avg_time']:.1f}s, máximo {row['max_time']:.1f}s"
@@ -255,6 +654,7 @@ class BufferAnalytics:
             
         return anomalies
     
+    @_ttl_cached(ttl=300)
     def predict_load(self, next_hours: int = 6) -> Dict[str, Any]:
         """
         Predice la carga futura basándose en patrones históricos
@@ -268,43 +668,62 @@ class BufferAnalytics:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Obtener datos históricos por hora del día y día de la semana
+            # Franjas (día de la semana, hora) que cubre la predicción,
+            # con domingo = 0 como en el histórico. En UTC, como created_at
+            # (CURRENT_TIMESTAMP) y por tanto created_at_ts
+            current_time = datetime.now(timezone.utc)
+            future_times = [current_time + timedelta(hours=h) for h in range(next_hours)]
+            future_keys = [((t.weekday() + 1) % 7, t.hour) for t in future_times]
+            weekly_slots = sorted({dow * 24 + hod for dow, hod in future_keys})
+            
+            # Obtener conteos históricos por franja horaria (epoch / 3600),
+            # solo de las franjas semanales que se van a predecir.
+            # created_at_ts es el epoch UTC de created_at, así que el límite
+            # y las franjas se calculan también en UTC.
+            # El 1970-01-01 fue jueves: (bucket + 96) % 168 = dow * 24 + hod
+            # Las franjas van como un único array JSON para que el texto SQL
+            # no dependa de next_hours y la sentencia preparada se reutilice
+            now_ts = int(datetime.now(timezone.utc).timestamp())
             cursor.execute("""
                 SELECT 
-                    CAST(strftime('%w', created_at) AS INTEGER) as day_of_week,
-                    CAST(strftime('%H', created_at) AS INTEGER) as hour_of_day,
+                    created_at_ts / 3600 as hour_bucket,
                     COUNT(*) as message_count
                 FROM messages
-                WHERE created_at > datetime('now', '-30 days')
-                GROUP BY day_of_week, hour_of_day
-            """)
+                WHERE created_at_ts > ?
+                  AND (created_at_ts / 3600 + 96) % 168 IN (SELECT value FROM json_each(?))
+                GROUP BY hour_bucket
+            """, (now_ts - 30 * 86400, json.dumps(weekly_slots)))
             
-            # Crear matriz de patrones
-            patterns = defaultdict(list)
-            for row in cursor.fetchall():
-                key = (row['day_of_week'], row['hour_of_day'])
-                patterns[key].append(row['message_count'])
+            # Acumular media y varianza por franja en una sola pasada
+            # (algoritmo de Welford): key -> [muestras, media, M2]
+            accumulators: Dict[Tuple[int, int], List[float]] = {}
+            for row in self._iter_rows(cursor):
+                bucket = row['hour_bucket']
+                key = ((bucket // 24 + 4) % 7, bucket % 24)
+                acc = accumulators.get(key)
+                if acc is None:
+                    acc = accumulators[key] = [0, 0.0, 0.0]
+                x = row['message_count']
+                acc[0] += 1
+                delta = x - acc[1]
+                acc[1] += delta / acc[0]
+                acc[2] += delta * (x - acc[1])
             
-            # Calcular promedios y desviación estándar
-            pattern_stats = {}
-            for key, values in patterns.items():
-                if values:
-                    pattern_stats[key] = {
-                        'mean': statistics.mean(values),
-                        'stdev': statistics.stdev(values) if len(values) > 1 else 0,
-                        'samples': len(values)
-                    }
+            # Calcular promedios y desviación estándar muestral
+            pattern_stats = {
+                key: {
+                    'mean': mean,
+                    'stdev': math.sqrt(m2 / (n - 1)) if n > 1 else 0,
+                    'samples': n
+                }
+                for key, (n, mean, m2) in accumulators.items()
+            }
             
             # Generar predicción
             predictions = []
-            current_time = datetime.now()
+            avg_load = None
             
-            for hour_offset in range(next_hours):
-                future_time = current_time + timedelta(hours=hour_offset)
-                dow = future_time.weekday()
-                hod = future_time.hour
-                
-                key = (dow, hod)
+            for future_time, key in zip(future_times, future_keys):
                 if key in pattern_stats:
                     stats = pattern_stats[key]
                     predicted_load = stats['mean']
@@ -318,17 +737,19 @@ class BufferAnalytics:
                         'range_max': int(predicted_load + stats['stdev'])
                     })
                 else:
-                    # Sin datos históricos, usar promedio general
-                    cursor.execute("""
-                        SELECT AVG(message_count) as avg_load
-                        FROM (
-                            SELECT COUNT(*) as message_count
-                            FROM messages
-                            WHERE created_at > datetime('now', '-7 days')
-                            GROUP BY strftime('%Y-%m-%d %H', created_at)
-                        )
-                    """)
-                    avg_load = cursor.fetchone()['avg_load'] or 50
+                    # Sin datos históricos, usar promedio general (se
+                    # calcula una sola vez para todas las franjas sin datos)
+                    if avg_load is None:
+                        cursor.execute("""
+                            SELECT AVG(message_count) as avg_load
+                            FROM (
+                                SELECT COUNT(*) as message_count
+                                FROM messages
+                                WHERE created_at_ts > ?
+                                GROUP BY created_at_ts / 3600
+                            )
+                        """, (now_ts - 7 * 86400,))
+                        avg_load = cursor.fetchone()['avg_load'] or 50
                     
                     predictions.append({
                         'time': future_time.strftime('%Y-%m-%d %H:00'),
@@ -369,132 +790,49 @@ class BufferAnalytics:
         """
         Genera un reporte HTML completo del estado del sistema
         """
-        performance = self.analyze_performance(24)
-        anomalies = self.detect_anomalies()
-        prediction = self.predict_load(6)
-        
-        # Obtener estadísticas actuales
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total,
-                    SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending,
-                    SUM(CASE WHEN status = 'processing' THEN 1 ELSE 0 END) as processing,
-                    SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed,
-                    SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed
-                FROM messages
-            """)
-            current_stats = cursor.fetchone()
+        # Los tres análisis son independientes: cada hilo usa su propia
+        # conexión de solo lectura (WAL admite lectores concurrentes) y
+        # SQLite libera el GIL mientras ejecuta las consultas
+        try:
+            with ThreadPoolExecutor(max_workers=3, initializer=self._attach_reader) as executor:
+                performance_future = executor.submit(self.analyze_performance, 24)
+                anomalies_future = executor.submit(self.detect_anomalies)
+                prediction_future = executor.submit(self.predict_load, 6)
+                
+                # Obtener estadísticas actuales mientras tanto
+                with self.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("""
+                        SELECT 
+                            COUNT(*) as total,
+                            SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending,
+                            SUM(CASE WHEN status = 'processing' THEN 1 ELSE 0 END) as processing,
+                            SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed,
+                            SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed
+                        FROM messages
+                    """)
+                    current_stats = cursor.fetchone()
+                
+                performance = performance_future.result()
+                anomalies = anomalies_future.result()
+                prediction = prediction_future.result()
+        finally:
+            self._close_readers()
         
-        html = f"""
+        # Escribir el reporte por partes directamente en el fichero,
+        # sin construir el documento completo en memoria
+        rows = ''.join(_PREDICTION_ROW_TEMPLATE.format(**pred) for pred in prediction['predictions'])
+        with open(output_file, 'w', encoding='utf-8', buffering=65536) as f:
+            f.write(f"""
 <!DOCTYPE html>
 <html>
 <head>
     <title>Reporte Buffer MQTT-OPCUA - {datetime.now().strftime('%Y-%m-%d %H:%M')}</title>
     <meta charset="UTF-8">
     <style>
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-            background: #f5f5f5;
-        }}
-        h1 {{
-            color: #2c3e50;
-            border-bottom: 3px solid #3498db;
-            padding-bottom: 10px;
-        }}
-        h2 {{
-            color: #34495e;
-            margin-top: 30px;
-            border-left: 4px solid #3498db;
-            padding-left: 10px;
-        }}
-        .card {{
-            background: white;
-            border-radius: 8px;
-            padding: 20px;
-            margin: 20px 0;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }}
-        .stat-grid {{
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin: 20px 0;
-        }}
-        .stat-card {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 20px;
-            border-radius: 8px;
-            text-align: center;
-        }}
-        .stat-value {{
-            font-size: 36px;
-            font-weight: bold;
-            margin: 10px 0;
-        }}
-        .stat-label {{
-            font-size: 14px;
-            opacity: 0.9;
-        }}
-        table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin: 20px 0;
-        }}
-        th, td {{
-            padding: 12px;
-            text-align: left;
-            border-bottom: 1px solid #ddd;
-        }}
-        th {{
-            background-color: #3498db;
-            color: white;
-        }}
-        tr:hover {{
-            background-color: #f5f5f5;
-        }}
-        .alert {{
-            padding: 15px;
-            border-radius: 5px;
-            margin: 10px 0;
-        }}
-        .alert-high {{
-            background-color: #ffe4e1;
-            border-left: 5px solid #ff6b6b;
-        }}
-        .alert-medium {{
-            background-color: #fff3cd;
-            border-left: 5px solid #ffc107;
-        }}
-        .alert-low {{
-            background-color: #d4edda;
-            border-left: 5px solid #28a745;
-        }}
-        .progress-bar {{
-            background-color: #e0e0e0;
-            border-radius: 10px;
-            height: 20px;
-            overflow: hidden;
-        }}
-        .progress-fill {{
-            background: linear-gradient(90deg, #4CAF50, #8BC34A);
-            height: 100%;
-            transition: width 0.3s ease;
-        }}
-        .timestamp {{
-            color: #7f8c8d;
-            font-size: 12px;
-            margin-top: 20px;
-            text-align: center;
-        }}
-    </style>
+""")
+            f.write(_REPORT_CSS)
+            f.write(f"""    </style>
 </head>
 <body>
     <h1>📊 Reporte del Buffer Persistente MQTT-OPCUA</h1>
@@ -553,19 +891,9 @@ class BufferAnalytics:
                 </tr>
             </thead>
             <tbody>
-"""
-        
-        for pred in prediction['predictions']:
-            html += f"""
-                <tr>
-                    <td>{pred['time']}</td>
-                    <td>{pred['predicted_messages']:,}</td>
-                    <td>{pred['range_min']:,} - {pred['range_max']:,}</td>
-                    <td>{pred['confidence']}%</td>
-                </tr>
-"""
-        
-        html += f"""
+""")
+            f.write(rows)
+            f.write(f"""
             </tbody>
         </table>
     </div>
@@ -575,10 +903,7 @@ class BufferAnalytics:
     </div>
 </body>
 </html>
-"""
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(html)
+""")
         
         print(f"✓ Reporte HTML generado: {output_file}")
         return output_file
@@ -588,15 +913,13 @@ class BufferAnalytics:
         if not anomalies:
             return '<p style="color: green;">✓ No se detectaron anomalías</p>'
         
-        html = ""
-        for anomaly in anomalies:
-            severity_class = f"alert-{anomaly['severity']}"
-            html += f'<div class="alert {severity_class}">'
-            html += f"<strong>{anomaly['type'].replace('_', ' ').title()}:</strong> "
-            html += anomaly['message']
-            html += '</div>'
-        
-        return html
+        return ''.join(
+            f"<div class=\"alert alert-{anomaly['severity']}\">"
+            f"<strong>{anomaly['type'].replace('_', ' ').title()}:</strong> "
+            f"{anomaly['message']}"
+            '</div>'
+            for anomaly in anomalies
+        )
     
     def plot_metrics(self, output_dir: str = "metrics"):
         """
@@ -608,20 +931,21 @@ class BufferAnalytics:
         
         os.makedirs(output_dir, exist_ok=True)
         
-        performance = self.analyze_performance(72)  # Últimas 72 horas
+        stats = self._hourly_stats(72)  # Últimas 72 horas
         
-        if not performance['hourly_data']:
+        if not stats:
             print("No hay suficientes datos para generar gráficos")
             return
         
-        # Preparar datos
-        hours = [datetime.strptime(h['hour'], '%Y-%m-%d %H:00') for h in performance['hourly_data']]
-        created = [h['created'] for h in performance['hourly_data']]
-        completed = [h['completed'] for h in performance['hourly_data']]
-        failed = [h['failed'] for h in performance['hourly_data']]
+        # Pasar las columnas a arrays
+        hours = np.array([h.replace(' ', 'T') for h in stats.hour], dtype='datetime64[m]')
+        created = np.array(stats.created, dtype=np.int64)
+        completed = np.array(stats.completed, dtype=np.int64)
+        failed = np.array(stats.failed, dtype=np.int64)
+        processing_times = np.array(stats.avg_proc, dtype=np.float64)
         
         # Gráfico 1: Throughput
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 8))
+        fig, (ax1, ax2) = self._get_figure('throughput', self._build_throughput_figure)
         
         ax1.plot(hours, created, label='Creados', color='blue', linewidth=2)
         ax1.plot(hours, completed, label='Completados', color='green', linewidth=2)
@@ -632,21 +956,19 @@ class BufferAnalytics:
         ax1.legend()
         ax1.grid(True, alpha=0.3)
         ax1.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:00'))
-        plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45)
+        ax1.tick_params(axis='x', labelrotation=45)
         
         # Gráfico 2: Tiempo de procesamiento
-        processing_times = [h['avg_processing_time'] for h in performance['hourly_data']]
         ax2.bar(hours, processing_times, color='orange', alpha=0.7)
         ax2.set_xlabel('Tiempo')
         ax2.set_ylabel('Tiempo promedio (segundos)')
         ax2.set_title('Tiempo de Procesamiento Promedio')
         ax2.grid(True, alpha=0.3)
         ax2.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:00'))
-        plt.setp(ax2.xaxis.get_majorticklabels(), rotation=45)
+        ax2.tick_params(axis='x', labelrotation=45)
         
-        plt.tight_layout()
         output_file = os.path.join(output_dir, 'throughput_metrics.png')
-        plt.savefig(output_file, dpi=100, bbox_inches='tight')
+        fig.savefig(output_file, dpi=100)
         print(f"✓ Gráfico generado: {output_file}")
         
         # Gráfico 3: Distribución de estados (pie chart)
@@ -665,16 +987,41 @@ class BufferAnalytics:
                 counts.append(row['count'])
         
         if statuses:
-            fig, ax = plt.subplots(figsize=(8, 8))
+            fig, ax = self._get_figure('status', self._build_status_figure)
             colors = ['#4CAF50', '#FFC107', '#F44336', '#2196F3', '#9C27B0']
             ax.pie(counts, labels=statuses, colors=colors, autopct='%1.1f%%', startangle=90)
             ax.set_title('Distribución de Estados de Mensajes')
             
             output_file = os.path.join(output_dir, 'status_distribution.png')
-            plt.savefig(output_file, dpi=100, bbox_inches='tight')
+            fig.savefig(output_file, dpi=100)
             print(f"✓ Gráfico generado: {output_file}")
-        
-        plt.close('all')
+    
+    def _get_figure(self, name: str, build):
+        """Devuelve la figura cacheada con sus ejes limpios, creándola la primera vez"""
+        entry = self._figures.get(name)
+        if entry is None:
+            entry = self._figures[name] = build()
+        else:
+            for ax in entry[0].axes:
+                ax.cla()
+        return entry
+    
+    @staticmethod
+    def _build_throughput_figure():
+        """Figura de throughput y tiempo de procesamiento, con márgenes fijos"""
+        fig = Figure(figsize=(12, 8))
+        axes = fig.subplots(2, 1)
+        # Márgenes calculados una vez en lugar de tight_layout/bbox_inches='tight'
+        fig.subplots_adjust(left=0.07, right=0.98, top=0.95, bottom=0.14, hspace=0.6)
+        return fig, axes
+    
+    @staticmethod
+    def _build_status_figure():
+        """Figura de la distribución de estados"""
+        fig = Figure(figsize=(8, 8))
+        ax = fig.subplots()
+        fig.subplots_adjust(left=0.05, right=0.95, top=0.92, bottom=0.05)
+        return fig, ax
 
 def main():
     import argparse
@@ -710,7 +1057,13 @@ def main():
         return
 
     analytics = BufferAnalytics(args.db)
+    try:
+        _run_command(analytics, args)
+    finally:
+        analytics.close()
 
+def _run_command(analytics: BufferAnalytics, args):
+    """Ejecuta el subcomando solicitado sobre la instancia de análisis"""
     if args.command == 'performance':
         result = analytics.analyze_performance(args.hours)
         print("\n=== Rendimiento del Buffer ===")
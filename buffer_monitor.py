@@ -8,25 +8,157 @@ import sqlite3
 import json
 import argparse
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import os
 import sys
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Secuencia ANSI para volver al inicio y borrar la pantalla (sin lanzar
+# un proceso `clear` en cada actualización)
+CLEAR_SEQ = "\x1b[H\x1b[2J" if os.name == "posix" else ""
+
+# Nombres de MessagePriority indexados por su valor entero
+PRIORITY_NAMES = ("LOW", "NORMAL", "HIGH", "CRITICAL")
+
+# Conteos por estado de una iteración de monitor_realtime (mismo orden que _SQL_STATUS)
+Stats = namedtuple('Stats', ['pending', 'processing', 'completed', 'failed', 'expired'])
+
 class BufferMonitor:
     """Monitor para el buffer persistente SQLite"""
     
-    def __init__(self, db_path: str = "buffer.db"):
+    # Consultas del bucle de monitor_realtime: texto constante para que la
+    # caché de sentencias de la conexión las compile una sola vez
+    _SQL_STATUS = """
+        SELECT 
+            COUNT(CASE WHEN status = 'pending' THEN 1 END),
+            COUNT(CASE WHEN status = 'processing' THEN 1 END),
+            COUNT(CASE WHEN status = 'completed' THEN 1 END),
+            COUNT(CASE WHEN status = 'failed' THEN 1 END),
+            COUNT(CASE WHEN status = 'expired' THEN 1 END)
+        FROM messages
+    """
+    _SQL_ROUTES = """
+        SELECT source, destination, COUNT(*) as count 
+        FROM messages 
+        WHERE status IN ('pending', 'processing')
+        GROUP BY source, destination
+    """
+    _SQL_RECENT = """
+        SELECT 
+            CASE WHEN length(topic_or_node) > 42
+                 THEN substr(topic_or_node, 1, 40) || '..' ELSE topic_or_node END as topic,
+            source, destination, created_at
+        FROM messages INDEXED BY idx_cleanup_completed
+        WHERE status = 'completed'
+        ORDER BY processed_at DESC
+        LIMIT 5
+    """
+    # Mensajes atascados: en procesamiento desde antes de un límite que se
+    # calcula en Python (_stuck_threshold), comparable con el índice
+    # (status, priority, created_at)
+    _STUCK_WHERE = "status = 'processing' AND created_at < ?"
+    _STUCK_MINUTES = 5
+    _SQL_STUCK = f"""
+        SELECT COUNT(*) as stuck 
+        FROM messages 
+        WHERE {_STUCK_WHERE}
+    """
+    _SQL_RESET_STUCK = f"""
+        UPDATE messages 
+        SET status = 'pending'
+        WHERE {_STUCK_WHERE}
+    """
+    
+    def __init__(self, db_path: str = "buffer.db", unsafe_fast: bool = False):
+        """
+        Args:
+            db_path: Ruta a la base de datos del buffer
+            unsafe_fast: Usar synchronous=OFF (sin fsync; una caída del
+                sistema puede perder las últimas escrituras de limpieza)
+        """
         self.db_path = db_path
         if not os.path.exists(db_path):
             print(f"Error: No se encuentra la base de datos {db_path}")
             sys.exit(1)
+        # Una sola conexión para toda la vida del monitor: la caché de páginas
+        # se conserva entre actualizaciones de monitor_realtime
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=128)
+        self._conn.row_factory = sqlite3.Row
+        self._configure_connection(unsafe_fast)
+        self._ensure_indexes()
+    
+    def _configure_connection(self, unsafe_fast: bool):
+        """
+        WAL permite leer mientras el bridge escribe; con synchronous=NORMAL
+        solo se sincroniza en los checkpoints
+        """
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={'OFF' if unsafe_fast else 'NORMAL'}")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.execute("PRAGMA cache_size=-65536")
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+    
+    def _ensure_indexes(self):
+        """Crea un índice compuesto por cada patrón de consulta del monitor"""
+        # Pendientes por prioridad/antigüedad y atascados en procesamiento:
+        # los cubre idx_pending_queue del buffer, del que este era prefijo
+        self._conn.execute("DROP INDEX IF EXISTS idx_msg_status_pri_created")
+        # Parciales: últimos completados y limpieza por antigüedad. Solo
+        # cubren las filas que consultan el panel y cleanup, de modo que
+        # los INSERT de mensajes pendientes del bridge no los mantienen
+        self._conn.execute("DROP INDEX IF EXISTS idx_msg_status_processed")
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cleanup_completed
+            ON messages(processed_at) WHERE status = 'completed'
+        """)
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cleanup_expired
+            ON messages(expire_at) WHERE status = 'expired'
+        """)
+        # Últimos fallidos y limpieza por antigüedad
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_failed_at
+            ON failed_messages(failed_at DESC)
+        """)
+        self._conn.commit()
+    
+    def _stuck_threshold(self) -> str:
+        """Límite UTC ('YYYY-MM-DD HH:MM:SS') para considerar un mensaje atascado"""
+        threshold = datetime.now(timezone.utc) - timedelta(minutes=self._STUCK_MINUTES)
+        return threshold.strftime('%Y-%m-%d %H:%M:%S')
     
+    @contextmanager
     def get_connection(self):
-        """Obtiene conexión a la base de datos"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Devuelve la conexión compartida sin cerrarla al salir del bloque"""
+        yield self._conn
+    
+    @contextmanager
+    def with_tuple_factory(self):
+        """
+        Devuelve tuplas en lugar de sqlite3.Row en los cursores creados dentro
+        del bloque (para listados largos que se recorren por posición)
+        """
+        previous = self._conn.row_factory
+        self._conn.row_factory = None
+        try:
+            yield self._conn
+        finally:
+            self._conn.row_factory = previous
+    
+    def close(self):
+        """Cierra la conexión a la base de datos"""
+        self._conn.close()
     
     def show_statistics(self):
         """Muestra estadísticas generales del buffer"""
@@ -37,71 +169,75 @@ class BufferMonitor:
             print("ESTADÍSTICAS DEL BUFFER PERSISTENTE")
             print("="*60)
             
+            # Una sola consulta: conteos por (estado, ruta, prioridad) con los
+            # extremos de pendientes y los expirados, más el total de fallidos.
+            # SQLite no tiene ROLLUP, así que los subtotales se suman aquí
+            cursor.execute("""
+                SELECT 
+                    'messages' as kind, status, source, destination, priority,
+                    COUNT(*) as count,
+                    MIN(CASE WHEN status = 'pending' THEN created_at END) as oldest,
+                    MAX(CASE WHEN status = 'pending' THEN created_at END) as newest,
+                    SUM(CASE WHEN expire_at < CURRENT_TIMESTAMP THEN 1 ELSE 0 END) as expired
+                FROM messages 
+                GROUP BY status, source, destination, priority
+                UNION ALL
+                SELECT 'failed_messages', NULL, NULL, NULL, NULL, COUNT(*), NULL, NULL, NULL
+                FROM failed_messages
+            """)
+            
+            total = 0
+            expired = 0
+            failed = 0
+            oldest = newest = None
+            by_status: Dict[str, int] = {}
+            by_route: Dict[tuple, int] = {}
+            by_priority: Dict[int, int] = {}
+            for row in cursor.fetchall():
+                count = row['count']
+                if row['kind'] == 'failed_messages':
+                    failed = count
+                    continue
+                total += count
+                expired += row['expired']
+                by_status[row['status']] = by_status.get(row['status'], 0) + count
+                route = (row['source'], row['destination'])
+                by_route[route] = by_route.get(route, 0) + count
+                if row['status'] in ('pending', 'processing'):
+                    by_priority[row['priority']] = by_priority.get(row['priority'], 0) + count
+                if row['oldest'] is not None:
+                    oldest = row['oldest'] if oldest is None else min(oldest, row['oldest'])
+                    newest = row['newest'] if newest is None else max(newest, row['newest'])
+            
             # Total de mensajes
-            cursor.execute("SELECT COUNT(*) as total FROM messages")
-            total = cursor.fetchone()['total']
             print(f"\nTotal de mensajes: {total}")
             
             # Mensajes por estado
             print("\nMensajes por estado:")
-            cursor.execute("""
-                SELECT status, COUNT(*) as count 
-                FROM messages 
-                GROUP BY status 
-                ORDER BY count DESC
-            """)
-            for row in cursor.fetchall():
-                print(f"  {row['status']:15s}: {row['count']:6d}")
+            for status, count in sorted(by_status.items(), key=lambda item: -item[1]):
+                print(f"  {status:15s}: {count:6d}")
             
             # Mensajes por ruta
             print("\nMensajes por ruta:")
-            cursor.execute("""
-                SELECT source, destination, COUNT(*) as count 
-                FROM messages 
-                GROUP BY source, destination
-                ORDER BY count DESC
-            """)
-            for row in cursor.fetchall():
-                print(f"  {row['source']:6s} -> {row['destination']:6s}: {row['count']:6d}")
+            for (source, destination), count in sorted(by_route.items(), key=lambda item: -item[1]):
+                print(f"  {source:6s} -> {destination:6s}: {count:6d}")
             
             # Mensajes por prioridad
             print("\nMensajes por prioridad:")
-            cursor.execute("""
-                SELECT priority, COUNT(*) as count 
-                FROM messages 
-                WHERE status IN ('pending', 'processing')
-                GROUP BY priority 
-                ORDER BY priority DESC
-            """)
-            priorities = {0: "LOW", 1: "NORMAL", 2: "HIGH", 3: "CRITICAL"}
-            for row in cursor.fetchall():
-                priority_name = priorities.get(row['priority'], str(row['priority']))
-                print(f"  {priority_name:8s}: {row['count']:6d}")
+            for priority in sorted(by_priority, reverse=True):
+                priority_name = PRIORITY_NAMES[priority] if 0 <= priority < len(PRIORITY_NAMES) else str(priority)
+                print(f"  {priority_name:8s}: {by_priority[priority]:6d}")
             
             # Mensaje más antiguo pendiente
-            cursor.execute("""
-                SELECT MIN(created_at) as oldest, MAX(created_at) as newest
-                FROM messages 
-                WHERE status = 'pending'
-            """)
-            row = cursor.fetchone()
-            if row['oldest']:
-                print(f"\nMensaje pendiente más antiguo: {row['oldest']}")
-                print(f"Mensaje pendiente más reciente: {row['newest']}")
+            if oldest:
+                print(f"\nMensaje pendiente más antiguo: {oldest}")
+                print(f"Mensaje pendiente más reciente: {newest}")
             
             # Mensajes expirados
-            cursor.execute("""
-                SELECT COUNT(*) as expired 
-                FROM messages 
-                WHERE expire_at < CURRENT_TIMESTAMP
-            """)
-            expired = cursor.fetchone()['expired']
             if expired > 0:
                 print(f"\n⚠️  Mensajes expirados: {expired}")
             
             # Mensajes fallidos
-            cursor.execute("SELECT COUNT(*) as failed FROM failed_messages")
-            failed = cursor.fetchone()['failed']
             if failed > 0:
                 print(f"\n❌ Mensajes fallidos totales: {failed}")
             
@@ -109,174 +245,188 @@ class BufferMonitor:
     
     def show_pending_messages(self, limit: int = 20):
         """Muestra los mensajes pendientes"""
-        with self.get_connection() as conn:
+        with self.with_tuple_factory() as conn:
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT id, source, destination, topic_or_node, 
-                       created_at, retry_count, priority
-                FROM messages 
-                WHERE status = 'pending'
-                ORDER BY priority DESC, created_at ASC
-                LIMIT ?
-            """, (limit,))
-            
-            rows = cursor.fetchall()
-            
-            print(f"\nMENSAJES PENDIENTES (mostrando {len(rows)} de máximo {limit})")
-            print("-"*80)
+            # Sondeo por índice: en un buffer vacío se evita la consulta ordenada
+            cursor.execute("SELECT 1 FROM messages WHERE status = 'pending' LIMIT 1")
+            if cursor.fetchone() is None:
+                rows = []
+            else:
+                cursor.execute("""
+                    SELECT id, source, destination,
+                           CASE WHEN length(topic_or_node) > 30
+                                THEN substr(topic_or_node, 1, 28) || '..' ELSE topic_or_node END as topic,
+                           strftime('%Y-%m-%d %H:%M:%S', created_at) as created,
+                           retry_count, priority
+                    FROM messages 
+                    WHERE status = 'pending'
+                    ORDER BY priority DESC, created_at ASC
+                    LIMIT ?
+                """, (limit,))
+                rows = cursor.fetchall()
+            
+            # Acumular la salida y escribirla de una vez
+            lines = []
+            lines.append(f"\nMENSAJES PENDIENTES (mostrando {len(rows)} de máximo {limit})")
+            lines.append("-"*80)
             
             if not rows:
-                print("No hay mensajes pendientes")
+                lines.append("No hay mensajes pendientes")
             else:
-                print(f"{'ID':6s} {'Origen':6s} {'Destino':7s} {'Topic/Nodo':30s} {'Creado':20s} {'Reintentos':10s} {'Prior':5s}")
-                print("-"*80)
+                lines.append(f"{'ID':6s} {'Origen':6s} {'Destino':7s} {'Topic/Nodo':30s} {'Creado':20s} {'Reintentos':10s} {'Prior':5s}")
+                lines.append("-"*80)
                 
-                for row in rows:
-                    topic_node = row['topic_or_node'][:28] + ".." if len(row['topic_or_node']) > 30 else row['topic_or_node']
-                    created = datetime.fromisoformat(row['created_at']).strftime("%Y-%m-%d %H:%M:%S")
-                    
-                    print(f"{row['id']:6d} {row['source']:6s} {row['destination']:7s} "
-                          f"{topic_node:30s} {created:20s} {row['retry_count']:10d} {row['priority']:5d}")
+                for msg_id, source, destination, topic_node, created, retry_count, priority in rows:
+                    lines.append(f"{msg_id:6d} {source:6s} {destination:7s} "
+                                 f"{topic_node:30s} {created:20s} {retry_count:10d} {priority:5d}")
+            
+            sys.stdout.write("\n".join(lines) + "\n")
     
     def show_failed_messages(self, limit: int = 20):
         """Muestra los mensajes fallidos"""
-        with self.get_connection() as conn:
+        with self.with_tuple_factory() as conn:
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT id, source, destination, topic_or_node, 
-                       error_message, failed_at, retry_count
-                FROM failed_messages 
-                ORDER BY failed_at DESC
-                LIMIT ?
-            """, (limit,))
-            
-            rows = cursor.fetchall()
-            
-            print(f"\nMENSAJES FALLIDOS (mostrando {len(rows)} de máximo {limit})")
-            print("-"*100)
+            cursor.execute("SELECT 1 FROM failed_messages LIMIT 1")
+            if cursor.fetchone() is None:
+                rows = []
+            else:
+                cursor.execute("""
+                    SELECT id, source, destination, topic_or_node, 
+                           error_message, failed_at, retry_count
+                    FROM failed_messages 
+                    ORDER BY failed_at DESC
+                    LIMIT ?
+                """, (limit,))
+                rows = cursor.fetchall()
+            
+            # Acumular la salida y escribirla de una vez
+            lines = []
+            lines.append(f"\nMENSAJES FALLIDOS (mostrando {len(rows)} de máximo {limit})")
+            lines.append("-"*100)
             
             if not rows:
-                print("No hay mensajes fallidos")
+                lines.append("No hay mensajes fallidos")
             else:
-                for row in rows:
-                    print(f"\nID: {row['id']}")
-                    print(f"  Ruta: {row['source']} -> {row['destination']}")
-                    print(f"  Topic/Nodo: {row['topic_or_node']}")
-                    print(f"  Error: {row['error_message']}")
-                    print(f"  Fallado: {row['failed_at']}")
-                    print(f"  Reintentos: {row['retry_count']}")
-    
-    def monitor_realtime(self, interval: int = 5):
-        """Monitoreo en tiempo real"""
+                for msg_id, source, destination, topic_or_node, error_message, failed_at, retry_count in rows:
+                    lines.append(f"\nID: {msg_id}")
+                    lines.append(f"  Ruta: {source} -> {destination}")
+                    lines.append(f"  Topic/Nodo: {topic_or_node}")
+                    lines.append(f"  Error: {error_message}")
+                    lines.append(f"  Fallado: {failed_at}")
+                    lines.append(f"  Reintentos: {retry_count}")
+            
+            sys.stdout.write("\n".join(lines) + "\n")
+    
+    def monitor_realtime(self, interval: int = 5, watch: bool = False, max_interval: int = 60):
+        """Monitoreo en tiempo real
+        
+        En modo ``watch`` cada tick solo consulta ``PRAGMA data_version`` y
+        recalcula las estadísticas cuando otra conexión ha confirmado cambios
+        en la base de datos, o cuando han pasado ``max_interval`` segundos
+        desde el último refresco.
+        """
         try:
             print("\nMONITOREO EN TIEMPO REAL")
             print("Presiona Ctrl+C para detener\n")
             
-            prev_stats = {}
+            prev_stats = None
+            last_version = None
+            last_refresh = None
+            elapsed = interval
+            # Un único cursor reutilizado en todas las iteraciones
+            cursor = self._conn.cursor()
             
             while True:
-                os.system('clear' if os.name == 'posix' else 'cls')
+                if watch:
+                    # data_version solo cambia con commits de otras conexiones
+                    version = cursor.execute("PRAGMA data_version").fetchone()[0]
+                    now = time.monotonic()
+                    if (version == last_version
+                            and now - last_refresh < max_interval):
+                        time.sleep(interval)
+                        continue
+                    if last_refresh is not None:
+                        elapsed = now - last_refresh
+                    last_version, last_refresh = version, now
+                
+                if CLEAR_SEQ:
+                    sys.stdout.write(CLEAR_SEQ)
+                else:
+                    os.system('cls')
+                
+                # Salida de la iteración acumulada en una sola escritura
+                lines = []
+                
+                # Header
+                lines.append(f"📊 MONITOR DE BUFFER - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+                lines.append("="*70)
+                
+                # Estadísticas actuales
+                cursor.execute(self._SQL_STATUS)
+                current = Stats(*cursor.fetchone())
+                
+                # Calcular tasas de cambio (la primera iteración compara consigo misma)
+                if prev_stats is None:
+                    prev_stats = current
+                rates = Stats(*((c - p) / elapsed for c, p in zip(current, prev_stats)))
+                
+                # Mostrar estadísticas
+                lines.append(f"\n📨 MENSAJES:")
+                lines.append(f"  Pendientes:  {current.pending:6d} ({rates.pending:+.1f}/s)")
+                lines.append(f"  Procesando:  {current.processing:6d}")
+                lines.append(f"  Completados: {current.completed:6d} ({rates.completed:+.1f}/s)")
+                lines.append(f"  Fallidos:    {current.failed:6d} ({rates.failed:+.1f}/s)")
+                lines.append(f"  Expirados:   {current.expired:6d}")
+                
+                # Throughput
+                if rates.completed > 0:
+                    lines.append(f"\n⚡ THROUGHPUT: {rates.completed:.2f} msg/s")
+                
+                # Rutas activas
+                cursor.execute(self._SQL_ROUTES)
+                
+                routes = cursor.fetchall()
+                if routes:
+                    lines.append("\n🔄 RUTAS ACTIVAS:")
+                    for row in routes:
+                        lines.append(f"  {row['source']:6s} -> {row['destination']:6s}: {row['count']:4d} mensajes")
+                
+                # Mensajes recientes
+                cursor.execute(self._SQL_RECENT)
                 
-                with self.get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Header
-                    print(f"📊 MONITOR DE BUFFER - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                    print("="*70)
-                    
-                    # Estadísticas actuales
-                    cursor.execute("""
-                        SELECT status, COUNT(*) as count 
-                        FROM messages 
-                        GROUP BY status
-                    """)
-                    
-                    status_counts = {row['status']: row['count'] for row in cursor.fetchall()}
-                    
-                    # Calcular tasas de cambio
-                    pending_current = status_counts.get('pending', 0)
-                    completed_current = status_counts.get('completed', 0)
-                    failed_current = status_counts.get('failed', 0)
-                    
-                    pending_prev = prev_stats.get('pending', pending_current)
-                    completed_prev = prev_stats.get('completed', completed_current)
-                    failed_prev = prev_stats.get('failed', failed_current)
-                    
-                    pending_rate = (pending_current - pending_prev) / interval
-                    completed_rate = (completed_current - completed_prev) / interval
-                    failed_rate = (failed_current - failed_prev) / interval
-                    
-                    # Mostrar estadísticas
-                    print(f"\n📨 MENSAJES:")
-                    print(f"  Pendientes:  {pending_current:6d} ({pending_rate:+.1f}/s)")
-                    print(f"  Procesando:  {status_counts.get('processing', 0):6d}")
-                    print(f"  Completados: {completed_current:6d} ({completed_rate:+.1f}/s)")
-                    print(f"  Fallidos:    {failed_current:6d} ({failed_rate:+.1f}/s)")
-                    print(f"  Expirados:   {status_counts.get('expired', 0):6d}")
-                    
-                    # Throughput
-                    if completed_rate > 0:
-                        print(f"\n⚡ THROUGHPUT: {completed_rate:.2f} msg/s")
-                    
-                    # Rutas activas
-                    cursor.execute("""
-                        SELECT source, destination, COUNT(*) as count 
-                        FROM messages 
-                        WHERE status IN ('pending', 'processing')
-                        GROUP BY source, destination
-                    """)
-                    
-                    routes = cursor.fetchall()
-                    if routes:
-                        print("\n🔄 RUTAS ACTIVAS:")
-                        for row in routes:
-                            print(f"  {row['source']:6s} -> {row['destination']:6s}: {row['count']:4d} mensajes")
-                    
-                    # Mensajes recientes
-                    cursor.execute("""
-                        SELECT topic_or_node, source, destination, created_at
-                        FROM messages 
-                        WHERE status = 'completed'
-                        ORDER BY processed_at DESC
-                        LIMIT 5
-                    """)
-                    
-                    recent = cursor.fetchall()
-                    if recent:
-                        print("\n📝 ÚLTIMOS PROCESADOS:")
-                        for row in recent:
-                            topic = row['topic_or_node'][:40] + ".." if len(row['topic_or_node']) > 42 else row['topic_or_node']
-                            print(f"  [{row['source']}->{row['destination']}] {topic}")
-                    
-                    # Alertas
-                    if pending_current > 1000:
-                        print(f"\n⚠️  ALERTA: Alto número de mensajes pendientes ({pending_current})")
-                    
-                    if failed_rate > 1:
-                        print(f"\n⚠️  ALERTA: Alta tasa de fallos ({failed_rate:.1f}/s)")
-                    
-                    cursor.execute("""
-                        SELECT COUNT(*) as stuck 
-                        FROM messages 
-                        WHERE status = 'processing' 
-                        AND datetime(created_at, '+5 minutes') < datetime('now')
-                    """)
-                    
-                    stuck = cursor.fetchone()['stuck']
-                    if stuck > 0:
-                        print(f"\n⚠️  ALERTA: {stuck} mensajes atascados en procesamiento")
-                    
-                    # Guardar estadísticas para siguiente iteración
-                    prev_stats = {
-                        'pending': pending_current,
-                        'completed': completed_current,
-                        'failed': failed_current
-                    }
-                    
-                    print("\n" + "="*70)
-                    print(f"Actualización cada {interval} segundos | Ctrl+C para salir")
+                recent = cursor.fetchall()
+                if recent:
+                    lines.append("\n📝 ÚLTIMOS PROCESADOS:")
+                    for row in recent:
+                        lines.append(f"  [{row['source']}->{row['destination']}] {row['topic']}")
+                
+                # Alertas
+                if current.pending > 1000:
+                    lines.append(f"\n⚠️  ALERTA: Alto número de mensajes pendientes ({current.pending})")
+                
+                if rates.failed > 1:
+                    lines.append(f"\n⚠️  ALERTA: Alta tasa de fallos ({rates.failed:.1f}/s)")
+                
+                cursor.execute(self._SQL_STUCK, (self._stuck_threshold(),))
+                
+                stuck = cursor.fetchone()['stuck']
+                if stuck > 0:
+                    lines.append(f"\n⚠️  ALERTA: {stuck} mensajes atascados en procesamiento")
+                
+                # Guardar estadísticas para siguiente iteración
+                prev_stats = current
+                
+                lines.append("\n" + "="*70)
+                if watch:
+                    lines.append(f"Actualización al detectar cambios (comprobación cada {interval} s, "
+                                 f"máximo {max_interval} s) | Ctrl+C para salir")
+                else:
+                    lines.append(f"Actualización cada {interval} segundos | Ctrl+C para salir")
+                
+                sys.stdout.write("\n".join(lines) + "\n")
+                sys.stdout.flush()
                 
                 time.sleep(interval)
                 
@@ -290,30 +440,40 @@ class BufferMonitor:
             
             print(f"\nLimpiando mensajes completados de más de {days} días...")
             
-            cursor.execute("""
-                DELETE FROM messages 
-                WHERE status = 'completed' 
-                AND processed_at < datetime('now', ? || ' days')
-            """, (-days,))
-            
-            completed_deleted = cursor.rowcount
-            
-            cursor.execute("""
-                DELETE FROM messages 
-                WHERE status = 'expired' 
-                AND expire_at < datetime('now', ? || ' days')
-            """, (-days,))
-            
-            expired_deleted = cursor.rowcount
-            
-            cursor.execute("""
-                DELETE FROM failed_messages 
-                WHERE failed_at < datetime('now', ? || ' days')
-            """, (-days,))
-            
-            failed_deleted = cursor.rowcount
-            
-            conn.commit()
+            # Límite calculado una vez, en el mismo formato UTC que datetime('now')
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+            
+            # Los tres borrados en una única transacción: un solo commit.
+            # Las filas borradas se leen con changes() de SQLite, no con rowcount
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("""
+                    DELETE FROM messages INDEXED BY idx_cleanup_completed
+                    WHERE status = 'completed' 
+                    AND processed_at < ?
+                """, (cutoff,))
+                
+                completed_deleted = cursor.execute("SELECT changes()").fetchone()[0]
+                
+                cursor.execute("""
+                    DELETE FROM messages INDEXED BY idx_cleanup_expired
+                    WHERE status = 'expired' 
+                    AND expire_at < ?
+                """, (cutoff,))
+                
+                expired_deleted = cursor.execute("SELECT changes()").fetchone()[0]
+                
+                cursor.execute("""
+                    DELETE FROM failed_messages 
+                    WHERE failed_at < ?
+                """, (cutoff,))
+                
+                failed_deleted = cursor.execute("SELECT changes()").fetchone()[0]
+                
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
             
             print(f"Eliminados:")
             print(f"  - {completed_deleted} mensajes completados")
@@ -321,18 +481,45 @@ class BufferMonitor:
             print(f"  - {failed_deleted} mensajes fallidos")
             print(f"Total: {completed_deleted + expired_deleted + failed_deleted} mensajes")
     
+    def _bulk_delete_ids(self, table: str, ids) -> int:
+        """
+        Borra por id usando una tabla temporal en lugar de un IN (?, ?, ...)
+        con miles de parámetros. Todo ocurre en una sola transacción
+        
+        Returns:
+            Número de filas eliminadas
+        """
+        if table not in ('messages', 'failed_messages'):
+            raise ValueError(f"Tabla no soportada: {table}")
+        
+        conn = self._conn
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _delids(id INTEGER PRIMARY KEY)")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM temp._delids")
+            conn.executemany("INSERT OR IGNORE INTO temp._delids VALUES (?)", ((i,) for i in ids))
+            deleted = conn.execute(
+                f"DELETE FROM {table} WHERE id IN (SELECT id FROM temp._delids)"
+            ).rowcount
+            conn.execute("DELETE FROM temp._delids")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return deleted
+    
+    def delete_messages(self, ids, table: str = 'messages'):
+        """Elimina mensajes concretos por id"""
+        deleted = self._bulk_delete_ids(table, ids)
+        print(f"✓ {deleted} registros eliminados de {table}")
+    
     def reset_stuck_messages(self):
         """Reinicia mensajes atascados en procesamiento"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
             # Buscar mensajes atascados (más de 5 minutos en procesamiento)
-            cursor.execute("""
-                UPDATE messages 
-                SET status = 'pending'
-                WHERE status = 'processing' 
-                AND datetime(created_at, '+5 minutes') < datetime('now')
-            """)
+            cursor.execute(self._SQL_RESET_STUCK, (self._stuck_threshold(),))
             
             conn.commit()
             
@@ -341,68 +528,95 @@ class BufferMonitor:
             else:
                 print("No hay mensajes atascados")
     
+    def _readonly_query(self, query):
+        """
+        Ejecuta query(conn) sobre una conexión propia de solo lectura, para
+        poder lanzar varias consultas en paralelo (WAL admite lectores
+        concurrentes). La conexión devuelve tuplas
+        """
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            return query(conn)
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _q_status_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+        """Conteos generales por estado"""
+        return dict(conn.execute("""
+            SELECT status, COUNT(*) as count 
+            FROM messages 
+            GROUP BY status
+        """).fetchall())
+    
+    @staticmethod
+    def _q_hourly(conn: sqlite3.Connection) -> list:
+        """Estadísticas por hora (últimas 24 horas)"""
+        rows = conn.execute("""
+            SELECT 
+                strftime('%Y-%m-%d %H:00', created_at) as hour,
+                COUNT(*) as created,
+                SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed,
+                SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed
+            FROM messages
+            WHERE created_at > datetime('now', '-24 hours')
+            GROUP BY hour
+            ORDER BY hour
+        """).fetchall()
+        return [
+            {'hour': hour, 'created': created, 'completed': completed, 'failed': failed}
+            for hour, created, completed, failed in rows
+        ]
+    
+    @staticmethod
+    def _q_top_topics(conn: sqlite3.Connection) -> list:
+        """Top topics/nodes"""
+        rows = conn.execute("""
+            SELECT topic_or_node, COUNT(*) as count 
+            FROM messages 
+            GROUP BY topic_or_node 
+            ORDER BY count DESC 
+            LIMIT 20
+        """).fetchall()
+        return [{'topic': topic, 'count': count} for topic, count in rows]
+    
     def export_statistics(self, output_file: str = "buffer_stats.json"):
         """Exporta estadísticas detalladas"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            stats = {}
-            
-            # Conteos generales
-            cursor.execute("""
-                SELECT status, COUNT(*) as count 
-                FROM messages 
-                GROUP BY status
-            """)
-            stats['status_counts'] = {row['status']: row['count'] for row in cursor.fetchall()}
-            
-            # Estadísticas por hora (últimas 24 horas)
-            cursor.execute("""
-                SELECT 
-                    strftime('%Y-%m-%d %H:00', created_at) as hour,
-                    COUNT(*) as created,
-                    SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed,
-                    SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed
-                FROM messages
-                WHERE created_at > datetime('now', '-24 hours')
-                GROUP BY hour
-                ORDER BY hour
-            """)
-            
-            stats['hourly_stats'] = []
-            for row in cursor.fetchall():
-                stats['hourly_stats'].append({
-                    'hour': row['hour'],
-                    'created': row['created'],
-                    'completed': row['completed'],
-                    'failed': row['failed']
-                })
-            
-            # Top topics/nodes
-            cursor.execute("""
-                SELECT topic_or_node, COUNT(*) as count 
-                FROM messages 
-                GROUP BY topic_or_node 
-                ORDER BY count DESC 
-                LIMIT 20
-            """)
-            
-            stats['top_topics'] = []
-            for row in cursor.fetchall():
-                stats['top_topics'].append({
-                    'topic': row['topic_or_node'],
-                    'count': row['count']
-                })
-            
-            # Guardar a archivo
-            with open(output_file, 'w') as f:
-                json.dump(stats, f, indent=2, default=str)
-            
-            print(f"✓ Estadísticas exportadas a {output_file}")
+        # Las tres consultas son independientes: cada una en su hilo y su conexión
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            status_future = executor.submit(self._readonly_query, self._q_status_counts)
+            hourly_future = executor.submit(self._readonly_query, self._q_hourly)
+            topics_future = executor.submit(self._readonly_query, self._q_top_topics)
+            
+            stats = {
+                'status_counts': status_future.result(),
+                'hourly_stats': hourly_future.result(),
+                'top_topics': topics_future.result()
+            }
+        
+        # Serializar en memoria (orjson si está disponible) y volcar el
+        # documento completo con os.write, sin pasar por el buffer de open()
+        if ORJSON_AVAILABLE:
+            payload = orjson.dumps(stats, default=str, option=orjson.OPT_INDENT_2)
+        else:
+            payload = json.dumps(stats, indent=2, default=str).encode()
+        
+        fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(payload)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        
+        print(f"✓ Estadísticas exportadas a {output_file}")
 
 def main():
     parser = argparse.ArgumentParser(description="Monitor del Buffer Persistente SQLite")
     parser.add_argument('--db', default='buffer.db', help='Ruta a la base de datos SQLite')
+    parser.add_argument('--unsafe-fast', action='store_true',
+                        help='Desactivar fsync (synchronous=OFF): más rápido, pero una caída puede perder escrituras')
     
     subparsers = parser.add_subparsers(dest='command', help='Comandos disponibles')
     
@@ -420,11 +634,21 @@ def main():
     # Comando monitor
     monitor_parser = subparsers.add_parser('monitor', help='Monitoreo en tiempo real')
     monitor_parser.add_argument('--interval', type=int, default=5, help='Intervalo de actualización en segundos')
+    monitor_parser.add_argument('--watch', action='store_true',
+                                help='Recalcular solo cuando cambie la base de datos')
+    monitor_parser.add_argument('--max-interval', type=int, default=60,
+                                help='Segundos máximos entre refrescos en modo --watch')
     
     # Comando cleanup
     cleanup_parser = subparsers.add_parser('cleanup', help='Limpiar mensajes antiguos')
     cleanup_parser.add_argument('--days', type=int, default=7, help='Días de antigüedad')
     
+    # Comando delete
+    delete_parser = subparsers.add_parser('delete', help='Eliminar mensajes por id')
+    delete_parser.add_argument('ids', type=int, nargs='+', help='Ids de los mensajes a eliminar')
+    delete_parser.add_argument('--table', choices=['messages', 'failed_messages'], default='messages',
+                               help='Tabla de la que eliminar')
+    
     # Comando reset
     subparsers.add_parser('reset', help='Reiniciar mensajes atascados')
     
@@ -438,8 +662,14 @@ def main():
         parser.print_help()
         return
     
-    monitor = BufferMonitor(args.db)
-    
+    monitor = BufferMonitor(args.db, unsafe_fast=args.unsafe_fast)
+    try:
+        _run_command(monitor, args)
+    finally:
+        monitor.close()
+
+def _run_command(monitor: BufferMonitor, args):
+    """Ejecuta el subcomando indicado en la línea de comandos"""
     if args.command == 'stats':
         monitor.show_statistics()
     elif args.command == 'pending':
@@ -447,9 +677,11 @@ def main():
     elif args.command == 'failed':
         monitor.show_failed_messages(args.limit)
     elif args.command == 'monitor':
-        monitor.monitor_realtime(args.interval)
+        monitor.monitor_realtime(args.interval, args.watch, args.max_interval)
     elif args.command == 'cleanup':
         monitor.cleanup_old_messages(args.days)
+    elif args.command == 'delete':
+        monitor.delete_messages(args.ids, args.table)
     elif args.command == 'reset':
         monitor.reset_stuck_messages()
     elif args.command == 'export':
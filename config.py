@@ -4,12 +4,24 @@ Configuración del Bridge MQTT-OPCUA con Buffer Persistente SQLite
 """
 
 import logging
-from dataclasses import dataclass, field
+from collections import Counter
+from dataclasses import dataclass, field, fields, is_dataclass
+from operator import attrgetter
 from typing import List, Dict, Any, Optional
 import yaml
+import hashlib
 import os
+import pickle
+import sys
 
-@dataclass
+# Cargador/volcador basados en libyaml cuando PyYAML se compiló con él
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# slots=True (Python 3.10+): instancias sin __dict__ propio
+_DC = dict(slots=True) if sys.version_info >= (3, 10) else {}
+
+@dataclass(**_DC)
 class MQTTConfig:
     """Configuración del cliente MQTT"""
     broker_host: str = "localhost"
@@ -25,8 +37,9 @@ class MQTTConfig:
     client_key: Optional[str] = None
     reconnect_delay: int = 5
     max_reconnect_attempts: int = 10
+    parallel_publishers: int = 1  # Conexiones adicionales para publicar OPC-UA->MQTT
 
-@dataclass
+@dataclass(**_DC)
 class OPCUAConfig:
     """Configuración del servidor OPC-UA"""
     endpoint: str = "opc.tcp://0.0.0.0:4840/bridge/server/"
@@ -39,7 +52,7 @@ class OPCUAConfig:
     session_timeout: int = 3600  # segundos
     max_connections: int = 100
 
-@dataclass
+@dataclass(**_DC)
 class BridgeMapping:
     """Mapeo entre topics MQTT y nodos OPC-UA"""
     mqtt_topic: str
@@ -50,7 +63,7 @@ class BridgeMapping:
     priority: str = "normal"  # low, normal, high, critical
     description: Optional[str] = None
 
-@dataclass
+@dataclass(**_DC)
 class BufferConfig:
     """Configuración del buffer persistente SQLite"""
     enabled: bool = True
@@ -63,6 +76,10 @@ class BufferConfig:
     retry_max_attempts: int = 3
     retry_backoff_seconds: int = 5
     
+    # Conservar los completados 24 h (buffer_monitor / buffer_analytics);
+    # False los borra al completarse y ahorra la escritura del UPDATE
+    retain_completed: bool = True
+    
     # Write-Ahead Logging para mejor performance
     wal_enabled: bool = True
     
@@ -82,7 +99,7 @@ class BufferConfig:
         'low': 1000
     })
 
-@dataclass
+@dataclass(**_DC)
 class OptimizationConfig:
     """Configuración de optimización automática"""
     enabled: bool = True
@@ -99,7 +116,7 @@ class OptimizationConfig:
     pending_threshold_low: int = 100
     failure_rate_threshold: float = 10.0  # porcentaje
 
-@dataclass
+@dataclass(**_DC)
 class MonitoringConfig:
     """Configuración de monitoreo y métricas"""
     enabled: bool = True
@@ -118,7 +135,7 @@ class MonitoringConfig:
     alert_latency_threshold: float = 10.0
     alert_stuck_messages_minutes: int = 5
 
-@dataclass
+@dataclass(**_DC)
 class LoggingConfig:
     """Configuración de logging"""
     level: str = "INFO"  # DEBUG, INFO, WARNING, ERROR, CRITICAL
@@ -136,8 +153,11 @@ class LoggingConfig:
         'buffer': 'INFO',
         'optimizer': 'INFO'
     })
+    
+    # (Logger, nivel) de module_levels ya resuelto por setup_logging
+    _resolved: list = field(default_factory=list, init=False, repr=False, compare=False)
 
-@dataclass
+@dataclass(**_DC)
 class SAPAuthConfig:
     """Autenticación para SAP"""
     type: str = "basic"  # basic, oauth2
@@ -148,13 +168,15 @@ class SAPAuthConfig:
     client_secret: Optional[str] = None
     scope: Optional[str] = None
 
-@dataclass
+@dataclass(**_DC)
 class SAPRetryConfig:
     """Política de reintentos para SAP"""
     max_attempts: int = 3
     backoff_seconds: int = 5
+    # Tope de la espera exponencial entre intentos
+    max_backoff_seconds: int = 60
 
-@dataclass
+@dataclass(**_DC)
 class SAPInboundConfig:
     """Configuración inbound SAP -> Bridge"""
     destination: str = "mqtt"  # mqtt u opcua
@@ -162,13 +184,14 @@ class SAPInboundConfig:
     data_type: str = "JSON"
     transform: Optional[str] = None
 
-@dataclass
+@dataclass(**_DC)
 class SAPOutboundConfig:
     """Configuración outbound Bridge -> SAP"""
     resource_path: str = ""
     transform: Optional[str] = None
+    batch: bool = False  # Agrupar los envíos en una petición OData $batch
 
-@dataclass
+@dataclass(**_DC)
 class SAPMapping:
     """Mapeo entre SAP y MQTT/OPC-UA"""
     mapping_id: str
@@ -182,17 +205,21 @@ class SAPMapping:
     retry: SAPRetryConfig = field(default_factory=SAPRetryConfig)
     query_params: Optional[Dict[str, Any]] = None
 
-@dataclass
+@dataclass(**_DC)
 class SAPConfig:
     """Configuración general de integración con SAP"""
     enabled: bool = False
     endpoint: str = ""
     timeout: int = 15
     poll_interval: int = 20
+    # Lecturas simultáneas a SAP por ciclo de sondeo
+    max_concurrent_fetches: int = 4
+    # Hilos para los envíos a SAP (un grupo por mapeo en paralelo)
+    max_concurrent_pushes: int = 8
     auth: SAPAuthConfig = field(default_factory=SAPAuthConfig)
     mappings: List[SAPMapping] = field(default_factory=list)
 
-@dataclass
+@dataclass(**_DC)
 class BridgeConfig:
     """Configuración general del bridge"""
     mqtt: MQTTConfig
@@ -221,85 +248,155 @@ class BridgeConfig:
     cleanup_interval: int = 300  # Deprecated, usar buffer.cleanup_interval
     worker_threads: int = 4  # Deprecated, usar buffer.worker_threads
 
-def load_config(config_file: str = "bridge_config.yaml") -> BridgeConfig:
-    """Carga la configuración desde un archivo YAML con validación"""
+# Campos escalares de SAPMapping que se copian tal cual del YAML; el id y
+# las secciones anidadas se construyen aparte en _parse_config
+_SAP_MAPPING_FIELDS = frozenset(
+    f.name for f in fields(SAPMapping)
+) - {'mapping_id', 'outbound', 'inbound', 'retry'}
+
+# Secciones de BridgeConfig que se construyen directamente desde su dict,
+# obtenidas de los campos de la dataclass al importar. SAP y los mapeos
+# tienen constructor propio en _parse_config
+_BRIDGE_SECTIONS = tuple(
+    (f.name, f.type) for f in fields(BridgeConfig)
+    if is_dataclass(f.type) and f.name != 'sap'
+)
+_BRIDGE_SECTION_KEYS = frozenset(name for name, _ in _BRIDGE_SECTIONS) | {'mappings', 'sap'}
+
+# Claves antiguas de primer nivel: (clave, sección, campo de la sección)
+_LEGACY_KEYS = (
+    ('buffer_size', 'buffer', 'max_size'),
+    ('persistence_file', 'buffer', 'db_path'),
+    ('message_ttl_minutes', 'buffer', 'ttl_minutes'),
+    ('cleanup_interval', 'buffer', 'cleanup_interval'),
+    ('worker_threads', 'buffer', 'worker_threads'),
+    ('log_level', 'logging', 'level'),
+)
+
+# Caché en disco de la configuración validada. Incrementar la versión al
+# cambiar las dataclasses o el formato invalida las cachés existentes
+_CONFIG_CACHE_SUFFIX = ".cache.pkl"
+_CONFIG_CACHE_VERSION = 9
+
+def load_config(config_file: str = "bridge_config.yaml", use_cache: bool = True) -> BridgeConfig:
+    """
+    Carga la configuración desde un archivo YAML con validación.
+    
+    La configuración ya validada se guarda en ``<config_file>.cache.pkl``
+    y se reutiliza mientras el YAML no cambie (mtime y tamaño) ni la
+    versión de la caché. Si solo cambian mtime o tamaño, el sha256 del
+    contenido decide si la caché sigue siendo válida.
+    """
+    
+    # Un único stat sirve de comprobación de existencia y de clave de caché
+    try:
+        st = os.stat(config_file)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Archivo de configuración no encontrado: {config_file}") from None
+    
+    if not use_cache:
+        return _parse_config(_read_config_bytes(config_file))
+    
+    cache_file = config_file + _CONFIG_CACHE_SUFFIX
+    key = _config_cache_key(st)
+    
+    cached = _read_config_cache(cache_file)
+    if cached is not None and cached[0] == key:
+        return cached[2]
+    
+    raw = _read_config_bytes(config_file)
+    digest = hashlib.sha256(raw).hexdigest()
+    if cached is not None and cached[1] == digest:
+        # Mismo contenido (p. ej. solo se tocó el mtime): ni parseo ni validación
+        bridge_config = cached[2]
+    else:
+        bridge_config = _parse_config(raw)
+    _write_config_cache(cache_file, key, digest, bridge_config)
+    return bridge_config
+
+def _config_cache_key(st: os.stat_result) -> tuple:
+    """Clave rápida de la caché: mtime y tamaño del YAML"""
+    return (st.st_mtime_ns, st.st_size)
+
+def _read_config_bytes(config_file: str) -> bytes:
+    """Contenido del YAML en bruto (libyaml decodifica el UTF-8 directamente)"""
+    with open(config_file, 'rb') as f:
+        return f.read()
+
+def _read_config_cache(cache_file: str) -> Optional[tuple]:
+    """Devuelve (clave, sha256, configuración) si la caché es de esta versión"""
+    try:
+        with open(cache_file, 'rb') as f:
+            version, key, digest, bridge_config = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.getLogger(__name__).debug(f"Caché de configuración ignorada ({cache_file}): {e}")
+        return None
+    
+    if version != _CONFIG_CACHE_VERSION or not isinstance(bridge_config, BridgeConfig):
+        return None
+    return key, digest, bridge_config
+
+def _write_config_cache(cache_file: str, key: tuple, digest: str, bridge_config: BridgeConfig):
+    """Escribe la caché de forma atómica (fichero temporal + os.replace)"""
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((_CONFIG_CACHE_VERSION, key, digest, bridge_config), f, protocol=5)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logging.getLogger(__name__).debug(f"No se pudo escribir la caché de configuración ({cache_file}): {e}")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+def _parse_config(raw: bytes) -> BridgeConfig:
+    """Parsea el YAML, construye las dataclasses y valida la configuración"""
     
-    if not os.path.exists(config_file):
-        raise FileNotFoundError(f"Archivo de configuración no encontrado: {config_file}")
+    config_dict = yaml.load(raw, Loader=_YAML_LOADER)
     
-    with open(config_file, 'r') as f:
-        config_dict = yaml.safe_load(f)
+    _prevalidate(config_dict)
     
-    # Configuración MQTT
-    mqtt_config = MQTTConfig(**config_dict.get('mqtt', {}))
+    # Compatibilidad con configuración antigua: las claves de primer nivel
+    # solo rellenan el campo de la sección si este no está definido
+    for legacy_key, section, name in _LEGACY_KEYS:
+        if legacy_key in config_dict:
+            section_dict = config_dict.setdefault(section, {})
+            if name not in section_dict:
+                section_dict[name] = config_dict[legacy_key]
     
-    # Configuración OPC-UA
-    opcua_config = OPCUAConfig(**config_dict.get('opcua', {}))
+    # Secciones simples (un dict del YAML por dataclass)
+    sections = {name: cls(**config_dict.get(name, {})) for name, cls in _BRIDGE_SECTIONS}
     
     # Mapeos
-    mappings = []
-    for mapping in config_dict.get('mappings', []):
-        mappings.append(BridgeMapping(**mapping))
+    mappings = [BridgeMapping(**mapping) for mapping in config_dict.get('mappings', [])]
     
     # Validar mapeos
     _validate_mappings(mappings)
-    
-    # Configuración del buffer
-    buffer_dict = config_dict.get('buffer', {})
-    # Compatibilidad con configuración antigua
-    if 'buffer_size' in config_dict and 'max_size' not in buffer_dict:
-        buffer_dict['max_size'] = config_dict['buffer_size']
-    if 'persistence_file' in config_dict and 'db_path' not in buffer_dict:
-        buffer_dict['db_path'] = config_dict['persistence_file']
-    if 'message_ttl_minutes' in config_dict and 'ttl_minutes' not in buffer_dict:
-        buffer_dict['ttl_minutes'] = config_dict['message_ttl_minutes']
-    if 'cleanup_interval' in config_dict and 'cleanup_interval' not in buffer_dict:
-        buffer_dict['cleanup_interval'] = config_dict['cleanup_interval']
-    if 'worker_threads' in config_dict and 'worker_threads' not in buffer_dict:
-        buffer_dict['worker_threads'] = config_dict['worker_threads']
-    
-    buffer_config = BufferConfig(**buffer_dict)
-    
-    # Configuración de optimización
-    optimization_config = OptimizationConfig(**config_dict.get('optimization', {}))
-    
-    # Configuración de monitoreo
-    monitoring_config = MonitoringConfig(**config_dict.get('monitoring', {}))
-    
-    # Configuración de logging
-    logging_dict = config_dict.get('logging', {})
-    # Compatibilidad con configuración antigua
-    if 'log_level' in config_dict and 'level' not in logging_dict:
-        logging_dict['level'] = config_dict['log_level']
-    
-    logging_config = LoggingConfig(**logging_dict)
 
     # Configuración SAP
     sap_dict = config_dict.get('sap', {})
     auth_config = SAPAuthConfig(**sap_dict.get('auth', {}))
-    sap_mappings = []
-    for mapping_cfg in sap_dict.get('mappings', []):
-        outbound_cfg = SAPOutboundConfig(**mapping_cfg.get('outbound', {}))
-        inbound_cfg = SAPInboundConfig(**mapping_cfg.get('inbound', {}))
-        retry_cfg = SAPRetryConfig(**mapping_cfg.get('retry', {}))
-        sap_mappings.append(SAPMapping(
+    sap_mappings = [
+        SAPMapping(
             mapping_id=mapping_cfg.get('mapping_id'),
-            mqtt_topic=mapping_cfg.get('mqtt_topic'),
-            opcua_node_id=mapping_cfg.get('opcua_node_id'),
-            direction=mapping_cfg.get('direction', 'bidirectional'),
-            priority=mapping_cfg.get('priority', 'normal'),
-            resource_path=mapping_cfg.get('resource_path', ''),
-            outbound=outbound_cfg,
-            inbound=inbound_cfg,
-            retry=retry_cfg,
-            query_params=mapping_cfg.get('query_params')
-        ))
+            outbound=SAPOutboundConfig(**mapping_cfg.get('outbound', {})),
+            inbound=SAPInboundConfig(**mapping_cfg.get('inbound', {})),
+            retry=SAPRetryConfig(**mapping_cfg.get('retry', {})),
+            **{k: v for k, v in mapping_cfg.items() if k in _SAP_MAPPING_FIELDS}
+        )
+        for mapping_cfg in sap_dict.get('mappings', [])
+    ]
 
     sap_config = SAPConfig(
         enabled=sap_dict.get('enabled', False),
         endpoint=sap_dict.get('endpoint', ''),
         timeout=sap_dict.get('timeout', 15),
         poll_interval=sap_dict.get('poll_interval', 20),
+        max_concurrent_fetches=sap_dict.get('max_concurrent_fetches', 4),
+        max_concurrent_pushes=sap_dict.get('max_concurrent_pushes', 8),
         auth=auth_config,
         mappings=sap_mappings
     )
@@ -308,72 +405,131 @@ def load_config(config_file: str = "bridge_config.yaml") -> BridgeConfig:
 
     # Crear configuración del bridge
     bridge_config = BridgeConfig(
-        mqtt=mqtt_config,
-        opcua=opcua_config,
         mappings=mappings,
-        buffer=buffer_config,
-        optimization=optimization_config,
-        monitoring=monitoring_config,
-        logging=logging_config,
         sap=sap_config,
-        **{k: v for k, v in config_dict.items() 
-           if k not in ['mqtt', 'opcua', 'mappings', 'buffer', 'optimization', 'monitoring', 'logging', 'sap']}
+        **sections,
+        **{k: v for k, v in config_dict.items() if k not in _BRIDGE_SECTION_KEYS}
     )
     
     return bridge_config
 
+# Valores admitidos en la validación de mapeos
+_VALID_DIRECTIONS = frozenset({'mqtt_to_opcua', 'opcua_to_mqtt', 'bidirectional'})
+_VALID_DATA_TYPES = frozenset({'Boolean', 'Int32', 'Float', 'Double', 'String', 'DateTime', 'JSON'})
+_VALID_PRIORITIES = frozenset({'low', 'normal', 'high', 'critical'})
+_VALID_SAP_DIRECTIONS = frozenset({'bridge_to_sap', 'sap_to_bridge', 'bidirectional'})
+_VALID_SAP_DESTINATIONS = frozenset({'mqtt', 'opcua'})
+_SAP_OUTBOUND_DIRECTIONS = frozenset({'bridge_to_sap', 'bidirectional'})
+_SAP_INBOUND_DIRECTIONS = frozenset({'sap_to_bridge', 'bidirectional'})
+
+# Reglas de valores enumerados sobre el dict del YAML:
+# (sección, campo, valor por defecto, valores admitidos, mensaje de error)
+_MAPPING_RULES = (
+    (None, 'direction', None, _VALID_DIRECTIONS, "Dirección inválida '{value}' para {key}"),
+    (None, 'data_type', None, _VALID_DATA_TYPES, "Tipo de dato inválido '{value}' para {key}"),
+    (None, 'priority', 'normal', _VALID_PRIORITIES, "Prioridad inválida '{value}' para {key}"),
+)
+_SAP_MAPPING_RULES = (
+    (None, 'direction', 'bidirectional', _VALID_SAP_DIRECTIONS, "Dirección SAP inválida '{value}' en {key}"),
+    ('inbound', 'destination', 'mqtt', _VALID_SAP_DESTINATIONS, "Destino SAP inválido '{value}' en {key}"),
+    (None, 'priority', 'normal', _VALID_PRIORITIES, "Prioridad SAP inválida '{value}' en {key}"),
+)
+
+def _check_rules(entry: Dict[str, Any], rules: tuple, key: Any):
+    """Aplica una tabla de reglas a un mapeo del YAML e interna los valores válidos"""
+    for section, name, default, valid, message in rules:
+        source = entry if section is None else (entry.get(section) or {})
+        if name not in source:
+            if default is None:
+                # Campo obligatorio: lo señalará el constructor de la dataclass
+                continue
+            value = default
+        else:
+            value = source[name]
+        # Una lista o un dict en lugar del escalar no es hashable: mismo
+        # ValueError que un valor fuera de la tabla
+        if not isinstance(value, str) or value not in valid:
+            raise ValueError(message.format(value=value, key=key))
+        if name in source:
+            # Valor de un conjunto pequeño y fijo: una sola copia por valor
+            source[name] = sys.intern(value)
+
+def _prevalidate(config_dict: Dict[str, Any]):
+    """
+    Valida los valores enumerados directamente sobre el dict del YAML,
+    antes de construir ninguna dataclass.
+    """
+    for mapping in config_dict.get('mappings', []):
+        _check_rules(mapping, _MAPPING_RULES, mapping.get('mqtt_topic'))
+    
+    sap_dict = config_dict.get('sap', {})
+    if not sap_dict.get('enabled', False):
+        return
+    for mapping in sap_dict.get('mappings', []):
+        _check_rules(mapping, _SAP_MAPPING_RULES, mapping.get('mapping_id'))
+
+_get_topic = attrgetter('mqtt_topic')
+_get_node = attrgetter('opcua_node_id')
+
 def _validate_mappings(mappings: List[BridgeMapping]):
-    """Valida los mapeos configurados"""
-    valid_directions = ['mqtt_to_opcua', 'opcua_to_mqtt', 'bidirectional']
-    valid_data_types = ['Boolean', 'Int32', 'Float', 'Double', 'String', 'DateTime', 'JSON']
-    valid_priorities = ['low', 'normal', 'high', 'critical']
-    
-    seen_topics = set()
-    seen_nodes = set()
-    
-    for mapping in mappings:
-        # Validar dirección
-        if mapping.direction not in valid_directions:
-            raise ValueError(f"Dirección inválida '{mapping.direction}' para {mapping.mqtt_topic}")
-        
-        # Validar tipo de dato
-        if mapping.data_type not in valid_data_types:
-            raise ValueError(f"Tipo de dato inválido '{mapping.data_type}' para {mapping.mqtt_topic}")
-        
-        # Validar prioridad
-        if mapping.priority not in valid_priorities:
-            raise ValueError(f"Prioridad inválida '{mapping.priority}' para {mapping.mqtt_topic}")
-        
-        # Detectar duplicados
-        if mapping.mqtt_topic in seen_topics:
-            logging.warning(f"Topic MQTT duplicado: {mapping.mqtt_topic}")
-        seen_topics.add(mapping.mqtt_topic)
-        
-        if mapping.opcua_node_id in seen_nodes:
-            logging.warning(f"Nodo OPC-UA duplicado: {mapping.opcua_node_id}")
-        seen_nodes.add(mapping.opcua_node_id)
+    """
+    Valida los mapeos configurados. Los valores enumerados ya se comprobaron
+    en _prevalidate; aquí solo se detectan duplicados.
+    """
+    # Detectar duplicados en una pasada; solo se formatean los repetidos
+    for topic, count in Counter(map(_get_topic, mappings)).items():
+        if count > 1:
+            logging.warning(f"Topic MQTT duplicado: {topic}")
+    
+    for node_id, count in Counter(map(_get_node, mappings)).items():
+        if count > 1:
+            logging.warning(f"Nodo OPC-UA duplicado: {node_id}")
 
 
 def _validate_sap_config(sap_config: SAPConfig):
-    """Valida la configuración SAP"""
+    """Valida los campos obligatorios de los mapeos SAP (los enumerados, en _prevalidate)"""
     if not sap_config.enabled:
         return
-    valid_directions = {'bridge_to_sap', 'sap_to_bridge', 'bidirectional'}
-    valid_destinations = {'mqtt', 'opcua'}
-    valid_priorities = {'low', 'normal', 'high', 'critical'}
-
     for mapping in sap_config.mappings:
-        if mapping.direction not in valid_directions:
-            raise ValueError(f"Dirección SAP inválida '{mapping.direction}' en {mapping.mapping_id}")
-        if mapping.inbound.destination not in valid_destinations:
-            raise ValueError(f"Destino SAP inválido '{mapping.inbound.destination}' en {mapping.mapping_id}")
-        if mapping.priority not in valid_priorities:
-            raise ValueError(f"Prioridad SAP inválida '{mapping.priority}' en {mapping.mapping_id}")
-        if mapping.direction in ('bridge_to_sap', 'bidirectional') and not (mapping.mqtt_topic or mapping.opcua_node_id):
+        if mapping.direction in _SAP_OUTBOUND_DIRECTIONS and not (mapping.mqtt_topic or mapping.opcua_node_id):
             raise ValueError(f"Mapeo SAP {mapping.mapping_id} requiere mqtt_topic u opcua_node_id")
-        if mapping.direction in ('sap_to_bridge', 'bidirectional') and not mapping.inbound.target:
+        if mapping.direction in _SAP_INBOUND_DIRECTIONS and not mapping.inbound.target:
             raise ValueError(f"Mapeo SAP {mapping.mapping_id} requiere inbound.target")
 
+# Nombre de nivel -> valor numérico de logging, con los alias que logging
+# también define (WARN, FATAL) y NOTSET
+_LEVELS = {
+    name: getattr(logging, name)
+    for name in ("NOTSET", "DEBUG", "INFO", "WARN", "WARNING", "ERROR", "FATAL", "CRITICAL")
+}
+
+def _level_value(name: str) -> int:
+    """Valor numérico de un nivel; el resto de nombres se resuelve como antes con getattr(logging, ...)"""
+    name = name.upper()
+    level = _LEVELS.get(name)
+    return level if level is not None else getattr(logging, name)
+
+# Clases que setup_logging importa bajo demanda, una sola vez
+# (None si el módulo opcional no está instalado)
+_lazy_classes: Dict[str, Any] = {}
+
+def _lazy_class(kind: str):
+    """Devuelve la clase de handler/formatter indicada, importándola la primera vez"""
+    if kind not in _lazy_classes:
+        if kind == 'timed':
+            from logging.handlers import TimedRotatingFileHandler as cls
+        elif kind == 'size':
+            from logging.handlers import RotatingFileHandler as cls
+        elif kind == 'color':
+            try:
+                from colorlog import ColoredFormatter as cls
+            except ImportError:
+                cls = None
+        else:
+            raise ValueError(f"Clase de logging desconocida: {kind}")
+        _lazy_classes[kind] = cls
+    return _lazy_classes[kind]
+
 def setup_logging(config: LoggingConfig = None):
     """Configura el sistema de logging con opciones avanzadas"""
     if config is None:
@@ -382,31 +538,30 @@ def setup_logging(config: LoggingConfig = None):
     # Crear directorio de logs si no existe
     if config.file_enabled:
         log_dir = os.path.dirname(config.file_path)
-        if log_dir and not os.path.exists(log_dir):
-            os.makedirs(log_dir)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
     
-    # Configurar handlers
+    # Configurar handlers (un único Formatter compartido)
     handlers = []
+    formatter = logging.Formatter(config.format)
     
     # Console handler
     if config.console_enabled:
         console_handler = logging.StreamHandler()
-        console_handler.setFormatter(logging.Formatter(config.format))
+        console_handler.setFormatter(formatter)
         handlers.append(console_handler)
     
     # File handler con rotación
     if config.file_enabled:
         if config.file_rotation == 'daily':
-            from logging.handlers import TimedRotatingFileHandler
-            file_handler = TimedRotatingFileHandler(
+            file_handler = _lazy_class('timed')(
                 config.file_path,
                 when='midnight',
                 interval=1,
                 backupCount=config.file_retention_days
             )
         elif config.file_rotation == 'size':
-            from logging.handlers import RotatingFileHandler
-            file_handler = RotatingFileHandler(
+            file_handler = _lazy_class('size')(
                 config.file_path,
                 maxBytes=10*1024*1024,  # 10MB
                 backupCount=5
@@ -414,36 +569,38 @@ def setup_logging(config: LoggingConfig = None):
         else:
             file_handler = logging.FileHandler(config.file_path)
         
-        file_handler.setFormatter(logging.Formatter(config.format))
+        file_handler.setFormatter(formatter)
         handlers.append(file_handler)
     
     # Configurar logger raíz
     logging.basicConfig(
-        level=getattr(logging, config.level),
+        level=_level_value(config.level),
         handlers=handlers
     )
     
     # Configurar niveles por módulo
-    for module, level in config.module_levels.items():
-        logging.getLogger(module).setLevel(getattr(logging, level))
+    if not config._resolved:
+        config._resolved = [
+            (logging.getLogger(module), _level_value(level))
+            for module, level in config.module_levels.items()
+        ]
+    for logger, level in config._resolved:
+        logger.setLevel(level)
     
     # Intentar usar colorlog si está disponible
-    try:
-        import colorlog
-        if config.console_enabled:
-            color_formatter = colorlog.ColoredFormatter(
-                f"%(log_color)s{config.format}",
-                log_colors={
-                    'DEBUG': 'cyan',
-                    'INFO': 'green',
-                    'WARNING': 'yellow',
-                    'ERROR': 'red',
-                    'CRITICAL': 'red,bg_white',
-                }
-            )
-            handlers[0].setFormatter(color_formatter)
-    except ImportError:
-        pass
+    colored_formatter = _lazy_class('color')
+    if colored_formatter is not None and config.console_enabled:
+        color_formatter = colored_formatter(
+            f"%(log_color)s{config.format}",
+            log_colors={
+                'DEBUG': 'cyan',
+                'INFO': 'green',
+                'WARNING': 'yellow',
+                'ERROR': 'red',
+                'CRITICAL': 'red,bg_white',
+            }
+        )
+        handlers[0].setFormatter(color_formatter)
     
     return logging.getLogger(__name__)
 
@@ -451,25 +608,16 @@ def save_config(config: BridgeConfig, config_file: str = "bridge_config.yaml"):
     """Guarda la configuración en un archivo YAML"""
     import dataclasses
     
-    def dataclass_to_dict(obj):
-        """Convierte dataclass a diccionario recursivamente"""
-        if dataclasses.is_dataclass(obj):
-            return {
-                field.name: dataclass_to_dict(getattr(obj, field.name))
-                for field in dataclasses.fields(obj)
-                if not field.name.startswith('_')
-            }
-        elif isinstance(obj, list):
-            return [dataclass_to_dict(item) for item in obj]
-        elif isinstance(obj, dict):
-            return {key: dataclass_to_dict(value) for key, value in obj.items()}
-        else:
-            return obj
-    
-    config_dict = dataclass_to_dict(config)
+    # asdict recorre listas, dicts y dataclasses anidadas; se omiten los
+    # campos privados
+    config_dict = dataclasses.asdict(
+        config,
+        dict_factory=lambda pairs: {key: value for key, value in pairs if not key.startswith('_')}
+    )
     
-    with open(config_file, 'w') as f:
-        yaml.dump(config_dict, f, default_flow_style=False, sort_keys=False)
+    with open(config_file, 'wb') as f:
+        yaml.dump(config_dict, f, Dumper=_YAML_DUMPER, encoding='utf-8',
+                  default_flow_style=False, sort_keys=False)
 
 def generate_default_config(config_file: str = "bridge_config_default.yaml"):
     """Genera un archivo de configuración por defecto con todas las opciones"""
@@ -1,25 +1,63 @@
-"""Hooks opcionales de métricas para SAP."""
+"""Hooks opcionales de métricas para SAP.
 
-try:
-    from prometheus_client import Counter, Histogram
-except ImportError:  # pragma: no cover
-    Counter = Histogram = None  # type: ignore
+Las métricas se crean (y se registran en el REGISTRY de Prometheus) la
+primera vez que se usan; si prometheus_client no está instalado los hooks
+no hacen nada.
+"""
 
-SAP_MESSAGES_PROCESSED = Counter("sap_bridge_processed_total", "Mensajes procesados hacia SAP", ["direction"]) if Counter else None
-SAP_MESSAGES_FAILED = Counter("sap_bridge_failed_total", "Mensajes fallidos hacia SAP", ["direction"]) if Counter else None
-SAP_LATENCY = Histogram("sap_bridge_latency_seconds", "Latencia de operaciones SAP") if Histogram else None
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _metric(kind: str, name: str, description: str, labels: tuple = ()):
+    try:
+        import prometheus_client
+    except ImportError:  # pragma: no cover
+        return None
+    return getattr(prometheus_client, kind)(name, description, labels)
+
+
+def _processed():
+    return _metric("Counter", "sap_bridge_processed_total", "Mensajes procesados hacia SAP", ("direction",))
+
+
+def _failed():
+    return _metric("Counter", "sap_bridge_failed_total", "Mensajes fallidos hacia SAP", ("direction",))
+
+
+def _latency():
+    return _metric("Histogram", "sap_bridge_latency_seconds", "Latencia de operaciones SAP")
+
+
+# Hijos etiquetados por dirección, resueltos una vez: evita labels() (dict
+# + lock) en cada mensaje. El conjunto de direcciones es pequeño y fijo
+_processed_children = {}
+_failed_children = {}
+
+
+def _child(children: dict, factory, direction: str):
+    child = children.get(direction)
+    if child is None:
+        metric = factory()
+        if metric is None:
+            return None
+        child = children[direction] = metric.labels(direction=direction)
+    return child
 
 
 def record_success(direction: str):
-    if SAP_MESSAGES_PROCESSED:
-        SAP_MESSAGES_PROCESSED.labels(direction=direction).inc()
+    child = _child(_processed_children, _processed, direction)
+    if child is not None:
+        child.inc()
 
 
 def record_failure(direction: str):
-    if SAP_MESSAGES_FAILED:
-        SAP_MESSAGES_FAILED.labels(direction=direction).inc()
+    child = _child(_failed_children, _failed, direction)
+    if child is not None:
+        child.inc()
 
 
 def observe_latency(seconds: float):
-    if SAP_LATENCY:
-        SAP_LATENCY.observe(seconds)
+    metric = _latency()
+    if metric is not None:
+        metric.observe(seconds)
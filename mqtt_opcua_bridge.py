@@ -5,59 +5,179 @@ Bridge bidireccional MQTT ↔ OPC-UA con buffer persistente
 
 import asyncio
 import json
+import logging
 import signal
 import sys
 from datetime import datetime
-from typing import Any, Dict, Optional
-from dataclasses import asdict
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 import threading
 import time
+from collections import deque
 
 import paho.mqtt.client as mqtt
 from asyncua import Server, Node, ua
 from asyncua.common.subscription import SubHandler
+from asyncua.common.ua_utils import value_to_datavalue
 
 from config import BridgeConfig, BridgeMapping, load_config, setup_logging
-from persistent_buffer import PersistentBuffer, BufferedMessage, MessagePriority
+from persistent_buffer import PersistentBuffer, BufferedMessage, MessagePriority, MessageStatus
 from sap_bridge.sap_workers import SAPBridgeManager
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _json_dumps(value: Any) -> bytes:
+    """Serializa un valor a JSON en bytes (orjson si está disponible)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value).encode('utf-8')
+
+
+def _json_loads(payload: bytes) -> Any:
+    """Parsea JSON directamente desde los bytes del payload"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def _live_status(live: bool) -> str:
+    """
+    Estado con el que se inserta un mensaje recibido. Si se entrega por la
+    cola en vivo se inserta ya como PROCESSING para que el sondeo del buffer
+    no lo recoja otra vez; tras un reinicio reset_processing_messages lo
+    devuelve a PENDING.
+    """
+    return MessageStatus.PROCESSING.value if live else MessageStatus.PENDING.value
+
+
+_MQTT_TO_OPCUA_DIRECTIONS = ("mqtt_to_opcua", "bidirectional")
+_OPCUA_TO_MQTT_DIRECTIONS = ("opcua_to_mqtt", "bidirectional")
+
+
+def _mapping_id(mapping: BridgeMapping) -> str:
+    return f"{mapping.mqtt_topic}:{mapping.opcua_node_id}"
+
+
+def _index_mappings(mappings: list, key: str, directions: tuple) -> Dict[str, List[BridgeMapping]]:
+    """
+    Indexa los mapeos por topic o nodo (atributo ``key``), filtrando por
+    dirección. Los callbacks buscan en el índice en lugar de recorrer todos
+    los mapeos.
+    """
+    index: Dict[str, List[BridgeMapping]] = {}
+    for mapping in mappings:
+        if mapping.direction in directions:
+            index.setdefault(getattr(mapping, key), []).append(mapping)
+    return index
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+_TRUE_STRINGS = frozenset({"true", "1", "yes", "on"})
+_FALSE_STRINGS = frozenset({"false", "0", "no", "off", ""})
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    if isinstance(value, str):
+        normalized = value.strip().lower()
+        if normalized in _TRUE_STRINGS:
+            return True
+        if normalized in _FALSE_STRINGS:
+            return False
+    return bool(value)
+
+
+# Los conversores escalares devuelven el valor tal cual cuando ya tiene el
+# tipo destino (type() exacto: un bool no pasa como int)
+def _to_int(value: Any) -> int:
+    return value if type(value) is int else int(value)
+
+
+def _to_float(value: Any) -> float:
+    return value if type(value) is float else float(value)
+
+
+def _to_str(value: Any) -> str:
+    return value if type(value) is str else str(value)
+
+
+def _to_datetime(value: Any) -> Any:
+    value_type = type(value)
+    if value_type is str:
+        return datetime.fromisoformat(value)
+    # Timestamps Unix numéricos: conversión directa en C, sin pasar por texto
+    if value_type is int or value_type is float:
+        return datetime.fromtimestamp(value)
+    return value
+
+
+def _to_json_text(value: Any) -> str:
+    return value if isinstance(value, str) else _json_dumps(value).decode('utf-8')
+
+
+# Conversión MQTT -> OPC-UA por tipo de dato; tipos desconocidos pasan sin cambios
+_MQTT_TO_OPCUA: Dict[str, Callable[[Any], Any]] = {
+    "Boolean": _to_bool,
+    "Int32": _to_int,
+    "Float": _to_float,
+    "Double": _to_float,
+    "String": _to_str,
+    "DateTime": _to_datetime,
+    "JSON": _to_json_text,
+}
+
+_VARIANT_TYPES = {
+    "Boolean": ua.VariantType.Boolean,
+    "Int32": ua.VariantType.Int32,
+    "Float": ua.VariantType.Float,
+    "Double": ua.VariantType.Double,
+    "String": ua.VariantType.String,
+    "DateTime": ua.VariantType.DateTime,
+    "JSON": ua.VariantType.String
+}
+
+
+# Tipos escalares que opcua_to_mqtt devuelve tal cual (type() exacto; las
+# subclases siguen por la cadena isinstance)
+_SCALAR_TYPES = frozenset({bool, int, float, str})
+
+# Valores iniciales de los nodos por tipo (inmutables); DateTime se
+# resuelve en _get_initial_value
+_INITIAL_VALUES = {
+    "Boolean": False,
+    "Int32": 0,
+    "Float": 0.0,
+    "Double": 0.0,
+    "String": "",
+    "JSON": "{}"
+}
+
+
 class DataTransformer:
     """Maneja las transformaciones de datos entre MQTT y OPC-UA"""
     
     @staticmethod
     def mqtt_to_opcua(value: Any, data_type: str) -> Any:
         """Convierte valores MQTT a tipos OPC-UA"""
-        if data_type == "Boolean":
-            if isinstance(value, bool):
-                return value
-            if isinstance(value, (int, float)):
-                return value != 0
-            if isinstance(value, str):
-                normalized = value.strip().lower()
-                if normalized in {"true", "1", "yes", "on"}:
-                    return True
-                if normalized in {"false", "0", "no", "off", ""}:
-                    return False
-            return bool(value)
-        elif data_type == "Int32":
-            return int(value)
-        elif data_type == "Float":
-            return float(value)
-        elif data_type == "Double":
-            return float(value)
-        elif data_type == "String":
-            return str(value)
-        elif data_type == "DateTime":
-            return datetime.fromisoformat(value) if isinstance(value, str) else value
-        elif data_type == "JSON":
-            return json.dumps(value) if not isinstance(value, str) else value
-        else:
-            return value
+        return _MQTT_TO_OPCUA.get(data_type, _identity)(value)
     
     @staticmethod
     def opcua_to_mqtt(value: Any, data_type: str) -> Any:
         """Convierte valores OPC-UA a formato MQTT"""
-        if isinstance(value, datetime):
+        # Caso habitual primero: escalares que pasan sin cambios
+        if type(value) in _SCALAR_TYPES:
+            return value
+        elif isinstance(value, datetime):
             return value.isoformat()
         elif isinstance(value, (bool, int, float, str)):
             return value
@@ -66,33 +186,95 @@ class DataTransformer:
         else:
             return str(value)
 
+class _IngressRing:
+    """
+    Anillo de entrada entre el thread de red de paho (productor) y el
+    thread escritor del buffer (consumidor). deque.append/popleft son
+    atómicos en CPython, así que no hace falta lock; el productor solo toca
+    el Event cuando el consumidor está esperando.
+    """
+    
+    def __init__(self, maxlen: int):
+        self._items = deque()
+        self._maxlen = maxlen
+        self._ready = threading.Event()
+    
+    def __len__(self) -> int:
+        return len(self._items)
+    
+    def offer(self, message: BufferedMessage) -> bool:
+        """Encola un mensaje desde el thread productor; False si el anillo está lleno"""
+        if len(self._items) >= self._maxlen:
+            return False
+        self._items.append(message)
+        if not self._ready.is_set():
+            self._ready.set()
+        return True
+    
+    def drain(self, limit: int) -> List[BufferedMessage]:
+        """Extrae hasta ``limit`` mensajes (solo desde el consumidor)"""
+        items = []
+        try:
+            while len(items) < limit:
+                items.append(self._items.popleft())
+        except IndexError:
+            pass
+        return items
+    
+    def wait(self, timeout: float):
+        """Espera a que haya mensajes o venza el timeout"""
+        # clear() antes de comprobar: un offer() posterior vuelve a activar el Event
+        self._ready.clear()
+        if not self._items:
+            self._ready.wait(timeout)
+
+
 class MQTTClient:
     """Cliente MQTT con capacidades de reconexión"""
     
-    def __init__(self, config: BridgeConfig, buffer: PersistentBuffer):
+    # Tope de la espera exponencial entre intentos de reconexión (segundos)
+    _MAX_RECONNECT_DELAY = 60
+    
+    def __init__(self, config: BridgeConfig, buffer: PersistentBuffer,
+                 ingress: Optional[_IngressRing] = None,
+                 logger: Optional[logging.Logger] = None):
         self.config = config.mqtt
         self.bridge_config = config
         self.buffer = buffer
+        self.ingress = ingress
+        self._by_topic = _index_mappings(config.mappings, 'mqtt_topic', _MQTT_TO_OPCUA_DIRECTIONS)
         self.client = mqtt.Client(self.config.client_id)
-        self.logger = setup_logging(config.logging)
+        self.logger = logger or logging.getLogger(__name__)
         self.connected = False
         self.subscribed_topics = set()
         
+        # Clientes de publicación: el principal más parallel_publishers - 1
+        # conexiones propias, cada una con su socket y su thread de red
+        self._publishers = [self.client]
+        for index in range(1, max(1, self.config.parallel_publishers)):
+            publisher = mqtt.Client(f"{self.config.client_id}-pub{index}")
+            self._setup_credentials(publisher)
+            self._publishers.append(publisher)
+        
         self._setup_client()
     
-    def _setup_client(self):
-        """Configura el cliente MQTT"""
+    def _setup_credentials(self, client: mqtt.Client):
+        """Configura autenticación y TLS de un cliente paho"""
         # Configurar autenticación
         if self.config.username and self.config.password:
-            self.client.username_pw_set(self.config.username, self.config.password)
+            client.username_pw_set(self.config.username, self.config.password)
         
         # Configurar TLS/SSL
         if self.config.tls_enabled:
-            self.client.tls_set(
+            client.tls_set(
                 ca_certs=self.config.ca_cert,
                 certfile=self.config.client_cert,
                 keyfile=self.config.client_key
             )
+    
+    def _setup_client(self):
+        """Configura el cliente MQTT"""
+        self._setup_credentials(self.client)
         
         # Configurar callbacks
         self.client.on_connect = self._on_connect
@@ -120,39 +302,56 @@ class MQTTClient:
     def _on_message(self, client, userdata, msg):
         """Callback de mensaje MQTT recibido"""
         try:
-            # Decodificar payload
-            payload = msg.payload.decode('utf-8')
-
-            # Intentar parsear como JSON
+            # Intentar parsear como JSON sobre los bytes; si no lo es, texto
+            # (orjson.JSONDecodeError deriva de json.JSONDecodeError)
             try:
-                value = json.loads(payload)
+                value = _json_loads(msg.payload)
             except json.JSONDecodeError:
-                value = payload
+                value = msg.payload.decode('utf-8')
 
             # Encontrar el mapeo correspondiente
-            for mapping in self.bridge_config.mappings:
-                if mapping.mqtt_topic == msg.topic and mapping.direction in ["mqtt_to_opcua", "bidirectional"]:
-                    # Crear mensaje buffered
-                    buffered_msg = BufferedMessage(
-                        source='mqtt',
-                        destination='opcua',
-                        topic_or_node=msg.topic,
-                        value=value,
-                        data_type=mapping.data_type,
-                        mapping_id=f"{mapping.mqtt_topic}:{mapping.opcua_node_id}",
-                        priority=MessagePriority.NORMAL.value,
-                        metadata={'mapping': asdict(mapping), 'qos': msg.qos}
+            for mapping in self._by_topic.get(msg.topic, ()):
+                # Crear mensaje buffered; el mapeo se resuelve por mapping_id
+                buffered_msg = BufferedMessage(
+                    source='mqtt',
+                    destination='opcua',
+                    topic_or_node=msg.topic,
+                    value=value,
+                    data_type=mapping.data_type,
+                    mapping_id=_mapping_id(mapping),
+                    status=_live_status(self.ingress is not None),
+                    priority=MessagePriority.NORMAL.value,
+                    metadata={'qos': msg.qos}
+                )
+
+                # Preparar el Variant OPC-UA aquí, fuera del loop asyncio; si
+                # la conversión falla se reintenta (y se reporta) al procesar
+                try:
+                    buffered_msg.opcua_variant = ua.Variant(
+                        _MQTT_TO_OPCUA.get(mapping.data_type, _identity)(value),
+                        _VARIANT_TYPES.get(mapping.data_type, ua.VariantType.String)
                     )
+                except Exception:
+                    pass
 
-                    # Agregar al buffer persistente
-                    message_id = self.buffer.add_message(buffered_msg)
-                    if message_id:
-                        self.logger.debug(f"MQTT mensaje recibido y buffereado: {msg.topic} = {value}, ID={message_id}")
-                    else:
-                        self.logger.error(f"Error agregando mensaje al buffer: {msg.topic}")
+                # Entregar al anillo de entrada: la inserción en el buffer la
+                # hace por lotes el thread escritor, sin bloquear el de paho
+                if self.ingress is not None:
+                    if self.ingress.offer(buffered_msg):
+                        continue
+                    # Anillo lleno: inserción directa, la recoge el sondeo del buffer
+                    buffered_msg.status = MessageStatus.PENDING.value
+
+                # Agregar al buffer persistente
+                message_id = self.buffer.add_message(buffered_msg)
+                if message_id:
+                    self.logger.debug("MQTT mensaje recibido y buffereado: %s = %s, ID=%s", msg.topic, value, message_id)
+                else:
+                    self.logger.error(f"Error agregando mensaje al buffer: {msg.topic}")
 
         except Exception as e:
-            self.logger.error(f"Error procesando mensaje MQTT: {e}")
+            # paho descarta en silencio las excepciones de los callbacks
+            self.logger.error(f"Error procesando mensaje MQTT en {msg.topic}: {e}")
     
     def _on_subscribe(self, client, userdata, mid, granted_qos):
         """Callback de suscripción MQTT"""
@@ -168,16 +367,17 @@ class MQTTClient:
                     self.logger.info(f"Suscrito a topic MQTT: {mapping.mqtt_topic}")
     
     def _reconnect(self):
-        """Intenta reconectar al broker MQTT"""
-        delay = getattr(self.config, 'reconnect_delay', self.bridge_config.reconnect_interval)
+        """Intenta reconectar al broker MQTT con espera exponencial entre intentos"""
+        delay = max(1, self.config.reconnect_delay)
         while not self.connected:
             try:
                 self.logger.info("Intentando reconectar al broker MQTT...")
                 self.client.reconnect()
                 break
             except Exception as e:
-                self.logger.error(f"Error de reconexión: {e}")
-                time.sleep(max(1, delay))
+                self.logger.error(f"Error de reconexión (reintento en {delay}s): {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, self._MAX_RECONNECT_DELAY)
     
     def connect(self):
         """Conecta al broker MQTT"""
@@ -188,10 +388,23 @@ class MQTTClient:
                 self.config.keep_alive
             )
             self.client.loop_start()
-            return True
         except Exception as e:
             self.logger.error(f"Error conectando al broker MQTT: {e}")
             return False
+        
+        # Los publicadores adicionales se reconectan solos (loop_start);
+        # mientras no estén conectados sus publicaciones fallan y se reintentan
+        for index, publisher in enumerate(self._publishers[1:], start=1):
+            try:
+                publisher.connect_async(
+                    self.config.broker_host,
+                    self.config.broker_port,
+                    self.config.keep_alive
+                )
+                publisher.loop_start()
+            except Exception as e:
+                self.logger.warning(f"Error conectando publicador MQTT {index}: {e}")
+        return True
     
     def publish(self, topic: str, value: Any, qos: int = None):
         """Publica un mensaje en MQTT"""
@@ -200,21 +413,23 @@ class MQTTClient:
             return False
         
         try:
-            # Serializar el valor
+            # Serializar el valor (paho acepta bytes directamente)
             if isinstance(value, (dict, list)):
-                payload = json.dumps(value)
+                payload = _json_dumps(value)
             else:
                 payload = str(value)
             
-            # Publicar
-            result = self.client.publish(
+            # Publicar; cada topic va siempre por el mismo cliente para
+            # conservar su orden
+            client = self._publishers[hash(topic) % len(self._publishers)]
+            result = client.publish(
                 topic,
                 payload,
                 qos=qos or self.config.qos
             )
             
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                self.logger.debug(f"MQTT publicado: {topic} = {payload}")
+                self.logger.debug("MQTT publicado: %s = %s", topic, payload)
                 return True
             else:
                 self.logger.error(f"Error publicando en MQTT: {result.rc}")
@@ -226,44 +441,125 @@ class MQTTClient:
     
     def disconnect(self):
         """Desconecta del broker MQTT"""
-        self.client.loop_stop()
-        self.client.disconnect()
+        for client in self._publishers:
+            client.loop_stop()
+            client.disconnect()
         self.logger.info("Desconectado del broker MQTT")
 
+# Marcador de "sin valor inicial pendiente" en OPCUASubscriptionHandler
+_NO_VALUE = object()
+
+# Escrituras propias recordadas por nodo a la espera de su notificación, y
+# tiempo tras el que se dan por perdidas (la suscripción publica cada 500 ms)
+_MAX_PENDING_ECHOES = 16
+_ECHO_TTL = 5.0
+
+
 class OPCUASubscriptionHandler(SubHandler):
     """Manejador de suscripciones OPC-UA"""
     
-    def __init__(self, buffer: PersistentBuffer, mappings: list, logger):
+    def __init__(self, buffer: PersistentBuffer, mappings: list, logger,
+                 live_sink: Optional[Callable[[BufferedMessage], None]] = None):
         self.buffer = buffer
         self.mappings = mappings
         self.logger = logger
+        self.live_sink = live_sink
+        self._by_node = _index_mappings(mappings, 'opcua_node_id', _OPCUA_TO_MQTT_DIRECTIONS)
+        # NodeId -> (node_id, mapeos) de los nodos suscritos. Se indexa por
+        # NodeId (hashable) y no por id(node): no todas las versiones de
+        # asyncua entregan el mismo objeto Node que se suscribió
+        self._subscribed_nodes: Dict[ua.NodeId, Tuple[str, List[BridgeMapping]]] = {}
+        # NodeId -> valor del nodo al suscribirse, mientras no llega la
+        # primera notificación: la suscripción la envía siempre al crearse
+        # con el valor actual, que no es un cambio
+        self._awaiting_initial: Dict[ua.NodeId, Any] = {}
+        # NodeId -> (instante, valor) de las escrituras del propio bridge
+        # cuya notificación aún no ha llegado, para no reenviar a MQTT (ni a
+        # SAP) su eco
+        self._bridge_writes: Dict[ua.NodeId, Deque[Tuple[float, Any]]] = {}
+        # NodeId -> último valor conocido del nodo. Escribir el mismo valor
+        # no genera notificación, así que esa escritura no se anota
+        self._last_values: Dict[ua.NodeId, Any] = {}
+    
+    def register_node(self, node: Node, node_id: str, current_value: Any = None):
+        """Registra un nodo suscrito para resolverlo sin formatear su NodeId"""
+        self._subscribed_nodes[node.nodeid] = (node_id, self._by_node.get(node_id, []))
+        self._awaiting_initial[node.nodeid] = current_value
+        self._last_values[node.nodeid] = current_value
+    
+    def note_bridge_write(self, nodeid: ua.NodeId, value: Any):
+        """Anota una escritura del bridge para descartar su notificación"""
+        if nodeid not in self._subscribed_nodes:
+            return
+        if isinstance(value, ua.Variant):
+            value = value.Value
+        if self._last_values.get(nodeid, _NO_VALUE) == value:
+            return
+        self._last_values[nodeid] = value
+        pending = self._bridge_writes.get(nodeid)
+        if pending is None:
+            pending = self._bridge_writes[nodeid] = deque(maxlen=_MAX_PENDING_ECHOES)
+        pending.append((time.monotonic(), value))
+    
+    def _is_echo(self, nodeid: ua.NodeId, val: Any) -> bool:
+        """True si la notificación es el eco de una escritura del bridge (y la consume)"""
+        pending = self._bridge_writes.get(nodeid)
+        if not pending:
+            return False
+        # Escrituras cuya notificación no llegó (p. ej. fallidas): caducan
+        expired_before = time.monotonic() - _ECHO_TTL
+        while pending and pending[0][0] < expired_before:
+            pending.popleft()
+        for index, (_, value) in enumerate(pending):
+            if value == val:
+                # Las anteriores a ella ya no llegarán por separado
+                for _ in range(index + 1):
+                    pending.popleft()
+                return True
+        return False
     
     def datachange_notification(self, node: Node, val, data):
         """Callback cuando cambia un valor en OPC-UA"""
         try:
-            node_id = node.nodeid.to_string()
+            nodeid = node.nodeid
+            if self._awaiting_initial:
+                initial = self._awaiting_initial.pop(nodeid, _NO_VALUE)
+                if initial is not _NO_VALUE and initial == val:
+                    return
+            if self._is_echo(nodeid, val):
+                return
+            self._last_values[nodeid] = val
+            
+            entry = self._subscribed_nodes.get(nodeid)
+            if entry is not None:
+                node_id, mappings = entry
+            else:
+                node_id = nodeid.to_string()
+                mappings = self._by_node.get(node_id, ())
             
             # Encontrar el mapeo correspondiente
-            for mapping in self.mappings:
-                if mapping.opcua_node_id == node_id and mapping.direction in ["opcua_to_mqtt", "bidirectional"]:
-                    # Crear mensaje buffered
-                    buffered_msg = BufferedMessage(
-                        source='opcua',
-                        destination='mqtt',
-                        topic_or_node=node_id,
-                        value=val,
-                        data_type=mapping.data_type,
-                        mapping_id=f"{mapping.mqtt_topic}:{mapping.opcua_node_id}",
-                        priority=MessagePriority.NORMAL.value,
-                        metadata={'mapping': asdict(mapping)}
-                    )
-                    
-                    # Agregar al buffer persistente
-                    message_id = self.buffer.add_message(buffered_msg)
-                    if message_id:
-                        self.logger.debug(f"OPC-UA cambio detectado y buffereado: {node_id} = {val}, ID={message_id}")
-                    else:
-                        self.logger.error(f"Error agregando cambio OPC-UA al buffer: {node_id}")
+            for mapping in mappings:
+                # Crear mensaje buffered; el mapeo se resuelve por mapping_id
+                buffered_msg = BufferedMessage(
+                    source='opcua',
+                    destination='mqtt',
+                    topic_or_node=node_id,
+                    value=val,
+                    data_type=mapping.data_type,
+                    mapping_id=_mapping_id(mapping),
+                    status=_live_status(self.live_sink is not None),
+                    priority=MessagePriority.NORMAL.value
+                )
+                
+                # Agregar al buffer persistente
+                message_id = self.buffer.add_message(buffered_msg)
+                if message_id:
+                    self.logger.debug("OPC-UA cambio detectado y buffereado: %s = %s, ID=%s", node_id, val, message_id)
+                    if self.live_sink:
+                        buffered_msg.id = message_id
+                        self.live_sink(buffered_msg)
+                else:
+                    self.logger.error(f"Error agregando cambio OPC-UA al buffer: {node_id}")
                     
         except Exception as e:
             self.logger.error(f"Error procesando cambio OPC-UA: {e}")
@@ -271,13 +567,17 @@ class OPCUASubscriptionHandler(SubHandler):
 class OPCUAServer:
     """Servidor OPC-UA con nodos dinámicos"""
     
-    def __init__(self, config: BridgeConfig, buffer: PersistentBuffer):
+    def __init__(self, config: BridgeConfig, buffer: PersistentBuffer,
+                 live_sink: Optional[Callable[[BufferedMessage], None]] = None,
+                 logger: Optional[logging.Logger] = None):
         self.config = config.opcua
         self.bridge_config = config
         self.buffer = buffer
-        self.logger = setup_logging(config.logging)
+        self.live_sink = live_sink
+        self.logger = logger or logging.getLogger(__name__)
         self.server = None
         self.nodes = {}
+        self.variant_types = {}
         self.subscription = None
         self.handler = None
         
@@ -341,39 +641,27 @@ class OPCUAServer:
                 if mapping.direction in ["opcua_to_mqtt", "bidirectional"]:
                     await node.set_writable()
                 
-                # Guardar referencia al nodo
+                # Guardar referencia al nodo y su tipo de variante
                 self.nodes[mapping.opcua_node_id] = node
+                self.variant_types[mapping.opcua_node_id] = variant_type
                 
                 self.logger.info(f"Nodo OPC-UA creado: {mapping.opcua_node_id}")
                 
             except Exception as e:
                 self.logger.error(f"Error creando nodo {mapping.opcua_node_id}: {e}")
     
-    def _get_variant_type(self, data_type: str):
+    @staticmethod
+    def _get_variant_type(data_type: str):
         """Obtiene el tipo de variante OPC-UA"""
-        type_mapping = {
-            "Boolean": ua.VariantType.Boolean,
-            "Int32": ua.VariantType.Int32,
-            "Float": ua.VariantType.Float,
-            "Double": ua.VariantType.Double,
-            "String": ua.VariantType.String,
-            "DateTime": ua.VariantType.DateTime,
-            "JSON": ua.VariantType.String
-        }
-        return type_mapping.get(data_type, ua.VariantType.String)
+        return _VARIANT_TYPES.get(data_type, ua.VariantType.String)
     
-    def _get_initial_value(self, data_type: str):
+    @staticmethod
+    def _get_initial_value(data_type: str):
         """Obtiene un valor inicial según el tipo de dato"""
-        initial_values = {
-            "Boolean": False,
-            "Int32": 0,
-            "Float": 0.0,
-            "Double": 0.0,
-            "String": "",
-            "DateTime": datetime.now(),
-            "JSON": "{}"
-        }
-        return initial_values.get(data_type, "")
+        # DateTime toma la hora de creación del nodo, no la de importación
+        if data_type == "DateTime":
+            return datetime.now()
+        return _INITIAL_VALUES.get(data_type, "")
     
     async def _setup_subscriptions(self):
         """Configura las suscripciones a cambios en los nodos"""
@@ -381,7 +669,8 @@ class OPCUAServer:
         self.handler = OPCUASubscriptionHandler(
             self.buffer,
             self.bridge_config.mappings,
-            self.logger
+            self.logger,
+            self.live_sink
         )
         
         # Crear suscripción
@@ -392,6 +681,7 @@ class OPCUAServer:
             if mapping.direction in ["opcua_to_mqtt", "bidirectional"]:
                 if mapping.opcua_node_id in self.nodes:
                     node = self.nodes[mapping.opcua_node_id]
+                    self.handler.register_node(node, mapping.opcua_node_id, await node.read_value())
                     await self.subscription.subscribe_data_change(node)
                     self.logger.info(f"Suscrito a cambios en nodo: {mapping.opcua_node_id}")
     
@@ -400,8 +690,17 @@ class OPCUAServer:
         if node_id in self.nodes:
             try:
                 node = self.nodes[node_id]
-                await node.write_value(value)
-                self.logger.debug(f"Nodo actualizado: {node_id} = {value}")
+                if self.handler is not None:
+                    self.handler.note_bridge_write(node.nodeid, value)
+                # Escritura directa en el espacio de direcciones local, sin
+                # pasar por WriteParameters. Dispara igualmente las
+                # suscripciones. El DataValue es nuevo en cada escritura:
+                # asyncua lo guarda por referencia
+                await self.server.write_attribute_value(
+                    node.nodeid,
+                    value_to_datavalue(value, self.variant_types.get(node_id))
+                )
+                self.logger.debug("Nodo actualizado: %s = %s", node_id, value)
                 return True
             except Exception as e:
                 self.logger.error(f"Error actualizando nodo {node_id}: {e}")
@@ -410,6 +709,61 @@ class OPCUAServer:
             self.logger.warning(f"Nodo no encontrado: {node_id}")
             return False
     
+    async def update_nodes_bulk(self, updates: List[Tuple[str, Any]]) -> List[bool]:
+        """
+        Actualiza varios nodos OPC-UA con una única escritura
+        
+        Args:
+            updates: Lista de (node_id, valor)
+            
+        Returns:
+            Resultado de cada actualización, en el mismo orden
+        """
+        results = [False] * len(updates)
+        write_values = []
+        positions = []
+        
+        for position, (node_id, value) in enumerate(updates):
+            node = self.nodes.get(node_id)
+            if node is None:
+                self.logger.warning(f"Nodo no encontrado: {node_id}")
+                continue
+            
+            # Misma conversión que Node.write_value, con el tipo del nodo
+            write_value = ua.WriteValue()
+            write_value.NodeId = node.nodeid
+            write_value.AttributeId = ua.AttributeIds.Value
+            write_value.Value = value_to_datavalue(value, self.variant_types.get(node_id))
+            write_values.append(write_value)
+            if self.handler is not None:
+                self.handler.note_bridge_write(node.nodeid, value)
+            positions.append(position)
+        
+        if not write_values:
+            return results
+        
+        params = ua.WriteParameters()
+        params.NodesToWrite = write_values
+        
+        try:
+            status_codes = await self.server.get_objects_node().write_params(params)
+        except Exception as e:
+            # Aislar errores: reintentar nodo a nodo
+            self.logger.warning(f"Escritura OPC-UA en bloque fallida, reintentando por nodo: {e}")
+            for position in positions:
+                results[position] = await self.update_node_value(*updates[position])
+            return results
+        
+        for position, status in zip(positions, status_codes):
+            node_id, value = updates[position]
+            if status.is_good():
+                results[position] = True
+                self.logger.debug("Nodo actualizado: %s = %s", node_id, value)
+            else:
+                self.logger.error(f"Error actualizando nodo {node_id}: {status}")
+        
+        return results
+    
     async def start(self):
         """Inicia el servidor OPC-UA"""
         await self.server.start()
@@ -435,7 +789,8 @@ class MQTTOPCUABridge:
             max_size=self.config.buffer_size,
             ttl_minutes=getattr(self.config, 'message_ttl_minutes', 60),
             cleanup_interval=getattr(self.config, 'cleanup_interval', 300),
-            logger=self.logger
+            logger=self.logger,
+            retain_completed=self.config.buffer.retain_completed
         )
 
         self.mqtt_client = None
@@ -443,10 +798,16 @@ class MQTTOPCUABridge:
         self.sap_manager = None
         self.running = False
         self.transformer = DataTransformer()
+        self._mappings_by_id: Dict[str, BridgeMapping] = {
+            _mapping_id(mapping): mapping for mapping in self.config.mappings
+        }
         
-        # Threads de procesamiento
-        self.process_threads = []
-        self.num_workers = getattr(self.config, 'worker_threads', 2)
+        # Cola en memoria para los mensajes recién recibidos; el buffer
+        # queda como registro de durabilidad y recuperación
+        self.live_queue: Optional[asyncio.Queue] = None
+        self.ingress: Optional[_IngressRing] = None
+        self._ingest_thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
         
         # Estadísticas de rendimiento
         self.performance_stats = {
@@ -456,128 +817,230 @@ class MQTTOPCUABridge:
             'last_processed': None
         }
     
-    async def _process_messages(self):
-        """Procesa mensajes del buffer persistente"""
+    # Intervalo máximo entre sondeos del buffer (recuperación y reintentos)
+    _BACKLOG_POLL_INTERVAL = 0.5
+    _BATCH_SIZE = 10
+    # Tope de la cola en vivo; lo que no cabe queda 'pending' para el sondeo
+    _LIVE_QUEUE_MAXSIZE = 10000
+    
+    def _push_live(self, message: BufferedMessage):
+        """Entrega un mensaje a la cola en vivo desde cualquier thread"""
+        self._loop.call_soon_threadsafe(self._deliver_live, [message])
+    
+    _INGRESS_BATCH_SIZE = 100
+    _INGRESS_MAXLEN = 10000
+    
+    def _ingest_worker(self):
+        """
+        Thread escritor: inserta por lotes los mensajes del anillo de entrada
+        (un único commit por lote) y los pasa a la cola en vivo
+        """
         while self.running:
             try:
-                # Obtener batch de mensajes del buffer
-                messages = self.buffer.get_pending_messages(
-                    limit=10,
-                    destination='opcua'
-                )
+                # Todo lo acumulado en un solo lote, con un mínimo de _INGRESS_BATCH_SIZE
+                batch = self.ingress.drain(max(self._INGRESS_BATCH_SIZE, len(self.ingress)))
+                if not batch:
+                    self.ingress.wait(self._BACKLOG_POLL_INTERVAL)
+                    continue
                 
-                for message in messages:
-                    if not self.running:
-                        break
-                    
-                    try:
-                        if message.destination == 'opcua':
-                            # Mensaje para OPC-UA
-                            await self._handle_mqtt_to_opcua_message(message)
-                        
-                        # Marcar como completado
-                        self.buffer.mark_completed(message.id)
-                        self.performance_stats['messages_processed'] += 1
-                        self.performance_stats['last_processed'] = datetime.now()
-                        
-                    except Exception as e:
-                        self.logger.error(f"Error procesando mensaje ID={message.id}: {e}")
-                        self.buffer.mark_failed(message.id, str(e))
-                        self.performance_stats['messages_failed'] += 1
+                # Lo que no cabe en la cola en vivo se inserta como 'pending'
+                # (lectura aproximada: _deliver_live libera lo que aun así sobre)
+                room = max(0, self._LIVE_QUEUE_MAXSIZE - self.live_queue.qsize())
+                for message in batch[room:]:
+                    message.status = MessageStatus.PENDING.value
+                
+                if not self.buffer.add_messages(batch):
+                    self.logger.error(f"Error agregando {len(batch)} mensajes MQTT al buffer")
+                    continue
                 
-                # Procesar mensajes para MQTT en thread separado
-                await self._process_mqtt_messages()
+                if room:
+                    self._loop.call_soon_threadsafe(self._deliver_live, batch[:room])
+                    
+            except Exception as e:
+                self.logger.error(f"Error en thread de ingesta: {e}")
+                time.sleep(1)
+    
+    def _deliver_live(self, batch: List[BufferedMessage]):
+        """Pasa a la cola en vivo un lote ya persistido (en el loop)"""
+        overflow = []
+        for message in batch:
+            try:
+                self.live_queue.put_nowait(message)
+            except asyncio.QueueFull:
+                overflow.append(message.id)
+        
+        if overflow:
+            # Ya están guardados como 'processing': pasan al sondeo del buffer
+            self.buffer.release_messages(overflow)
+            self.logger.warning(f"Cola en vivo llena: {len(overflow)} mensajes quedan para el sondeo del buffer")
+    
+    def _flush_ingress(self):
+        """Persiste lo que quede en el anillo de entrada al detener el bridge"""
+        if self.ingress is None:
+            return
+        remaining = self.ingress.drain(self._INGRESS_MAXLEN)
+        if remaining:
+            for message in remaining:
+                message.status = MessageStatus.PENDING.value
+            self.buffer.add_messages(remaining)
+            self.logger.info(f"Anillo de entrada: {len(remaining)} mensajes guardados en el buffer")
+    
+    async def _next_live_batch(self) -> List[BufferedMessage]:
+        """Espera mensajes en vivo y devuelve hasta _BATCH_SIZE (vacío si no llega ninguno)"""
+        try:
+            first = await asyncio.wait_for(self.live_queue.get(), timeout=self._BACKLOG_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            return []
+        
+        batch = [first]
+        while len(batch) < self._BATCH_SIZE and not self.live_queue.empty():
+            batch.append(self.live_queue.get_nowait())
+        return batch
+    
+    async def _process_messages(self):
+        """Procesa los mensajes en vivo y, periódicamente, el backlog del buffer persistente"""
+        last_poll = 0.0
+        while self.running:
+            try:
+                batch = await self._next_live_batch()
+                if batch and self.running:
+                    to_opcua = [m for m in batch if m.destination == 'opcua']
+                    to_mqtt = [m for m in batch if m.destination == 'mqtt']
+                    if to_opcua:
+                        await self._handle_mqtt_to_opcua_batch(to_opcua)
+                    if to_mqtt:
+                        await self._handle_opcua_to_mqtt_batch(to_mqtt)
                 
-                # Si no hay mensajes, esperar un poco
-                if not messages:
-                    await asyncio.sleep(0.1)
+                # Backlog del buffer: mensajes de antes del arranque y reintentos
+                now = self._loop.time()
+                if not batch or now - last_poll >= self._BACKLOG_POLL_INTERVAL:
+                    last_poll = now
+                    messages = self.buffer.claim_pending_batch(
+                        limit=self._BATCH_SIZE,
+                        destination='opcua'
+                    )
+                    
+                    # Mensajes para OPC-UA: una escritura por batch
+                    if messages and self.running:
+                        await self._handle_mqtt_to_opcua_batch(messages)
+                    
+                    await self._process_mqtt_messages()
                     
             except Exception as e:
                 self.logger.error(f"Error en loop de procesamiento: {e}")
                 await asyncio.sleep(1)
     
     async def _process_mqtt_messages(self):
-        """Procesa mensajes destinados a MQTT"""
-        messages = self.buffer.get_pending_messages(
-            limit=10,
+        """Procesa mensajes del buffer destinados a MQTT"""
+        messages = self.buffer.claim_pending_batch(
+            limit=self._BATCH_SIZE,
             destination='mqtt'
         )
-        
+        await self._handle_opcua_to_mqtt_batch(messages)
+    
+    async def _handle_opcua_to_mqtt_batch(self, messages: List[BufferedMessage]):
+        """Publica en MQTT un batch de mensajes provenientes de OPC-UA"""
+        completed_ids = []
         for message in messages:
             if not self.running:
                 break
             
             try:
                 if message.destination == 'mqtt':
-                    # Mensaje para MQTT - ejecutar en thread separado
-                    await self._handle_opcua_to_mqtt_message(message)
+                    self._handle_opcua_to_mqtt_message(message)
                 
-                # Marcar como completado
-                self.buffer.mark_completed(message.id)
-                self.performance_stats['messages_processed'] += 1
+                completed_ids.append(message.id)
                 
             except Exception as e:
                 self.logger.error(f"Error procesando mensaje MQTT ID={message.id}: {e}")
                 self.buffer.mark_failed(message.id, str(e))
                 self.performance_stats['messages_failed'] += 1
+        
+        # Marcar como completados en una sola transacción
+        if completed_ids:
+            self.buffer.mark_completed_many(completed_ids)
+            self.performance_stats['messages_processed'] += len(completed_ids)
+        
+        # Las publicaciones del batch no ceden el loop; se cede una vez al final
+        await asyncio.sleep(0)
     
-    async def _handle_mqtt_to_opcua_message(self, message: BufferedMessage):
-        """Maneja mensajes provenientes de MQTT hacia OPC-UA"""
-        try:
-            # Recuperar mapeo desde metadata
+    def _resolve_mapping(self, message: BufferedMessage) -> BridgeMapping:
+        """Obtiene el mapeo de un mensaje a partir de su mapping_id"""
+        mapping = self._mappings_by_id.get(message.mapping_id)
+        if mapping is None:
+            # Mensajes de un buffer anterior guardaban el mapeo completo en metadata
             mapping_data = message.metadata.get('mapping')
             if not mapping_data:
                 raise ValueError("No se encontró información de mapeo")
-            
             mapping = BridgeMapping(**mapping_data)
-            
-            # Transformar el valor si es necesario
-            transformed_value = self.transformer.mqtt_to_opcua(message.value, message.data_type)
-            
-            # Actualizar nodo OPC-UA
-            if self.opcua_server:
-                success = await self.opcua_server.update_node_value(
-                    mapping.opcua_node_id,
-                    transformed_value
-                )
+        return mapping
+    
+    def _fail_message(self, message: BufferedMessage, error: Exception):
+        """Registra un mensaje fallido en el buffer y en las estadísticas"""
+        self.logger.error(f"Error procesando mensaje ID={message.id}: {error}")
+        self.buffer.mark_failed(message.id, str(error))
+        self.performance_stats['messages_failed'] += 1
+    
+    async def _handle_mqtt_to_opcua_batch(self, messages: List[BufferedMessage]):
+        """Maneja un batch de mensajes MQTT hacia OPC-UA con una escritura en bloque"""
+        prepared = []
+        for message in messages:
+            try:
+                mapping = self._resolve_mapping(message)
                 
-                if success:
-                    self.logger.info(f"MQTT->OPCUA: {mapping.mqtt_topic} -> {mapping.opcua_node_id} = {transformed_value}")
-                    self._enqueue_sap_message('mqtt', mapping, message.value, message.metadata)
+                # Usar el Variant preparado en la ingesta o transformar el valor
+                variant = message.opcua_variant
+                if variant is not None:
+                    prepared.append((message, mapping, variant.Value, variant))
                 else:
-                    raise Exception(f"Fallo al actualizar nodo OPC-UA {mapping.opcua_node_id}")
+                    transformed_value = self.transformer.mqtt_to_opcua(message.value, message.data_type)
+                    prepared.append((message, mapping, transformed_value, transformed_value))
+            except Exception as e:
+                self.logger.error(f"Error manejando mensaje MQTT->OPCUA: {e}")
+                self._fail_message(message, e)
+        
+        if not prepared:
+            return
+        
+        if not self.opcua_server:
+            for message, _, _, _ in prepared:
+                self._fail_message(message, Exception("Servidor OPC-UA no disponible"))
+            return
+        
+        results = await self.opcua_server.update_nodes_bulk(
+            [(mapping.opcua_node_id, value) for _, mapping, _, value in prepared]
+        )
+        
+        completed_ids = []
+        for (message, mapping, transformed_value, _), success in zip(prepared, results):
+            if success:
+                self.logger.info("MQTT->OPCUA: %s -> %s = %s", mapping.mqtt_topic, mapping.opcua_node_id, transformed_value)
+                self._enqueue_sap_message('mqtt', mapping, message.value, message.metadata)
+                completed_ids.append(message.id)
             else:
-                raise Exception("Servidor OPC-UA no disponible")
-                
-        except Exception as e:
-            self.logger.error(f"Error manejando mensaje MQTT->OPCUA: {e}")
-            raise
+                self._fail_message(message, Exception(f"Fallo al actualizar nodo OPC-UA {mapping.opcua_node_id}"))
+        
+        # Marcar como completados en una sola transacción
+        if completed_ids:
+            self.buffer.mark_completed_many(completed_ids)
+            self.performance_stats['messages_processed'] += len(completed_ids)
+            self.performance_stats['last_processed'] = datetime.now()
     
-    async def _handle_opcua_to_mqtt_message(self, message: BufferedMessage):
+    def _handle_opcua_to_mqtt_message(self, message: BufferedMessage):
         """Maneja cambios provenientes de OPC-UA hacia MQTT"""
         try:
-            # Recuperar mapeo desde metadata
-            mapping_data = message.metadata.get('mapping')
-            if not mapping_data:
-                raise ValueError("No se encontró información de mapeo")
-            
-            mapping = BridgeMapping(**mapping_data)
+            mapping = self._resolve_mapping(message)
             
             # Transformar el valor si es necesario
             transformed_value = self.transformer.opcua_to_mqtt(message.value, message.data_type)
             
             # Publicar en MQTT
             if self.mqtt_client and self.mqtt_client.connected:
-                # Ejecutar en thread separado para no bloquear asyncio
-                success = await asyncio.get_event_loop().run_in_executor(
-                    None,
-                    self.mqtt_client.publish,
-                    mapping.mqtt_topic,
-                    transformed_value
-                )
+                # paho publish no bloquea: solo encola para su thread de red
+                success = self.mqtt_client.publish(mapping.mqtt_topic, transformed_value)
                 
                 if success:
-                    self.logger.info(f"OPCUA->MQTT: {mapping.opcua_node_id} -> {mapping.mqtt_topic} = {transformed_value}")
+                    self.logger.info("OPCUA->MQTT: %s -> %s = %s", mapping.opcua_node_id, mapping.mqtt_topic, transformed_value)
                     self._enqueue_sap_message('opcua', mapping, message.value, message.metadata)
                 else:
                     raise Exception(f"Fallo al publicar en MQTT topic {mapping.mqtt_topic}")
@@ -588,12 +1051,11 @@ class MQTTOPCUABridge:
             self.logger.error(f"Error manejando cambio OPCUA->MQTT: {e}")
             raise
     
-    def _print_statistics(self):
+    async def _stats_loop(self):
         """Imprime estadísticas periódicamente"""
         while self.running:
             try:
-                import time
-                time.sleep(30)  # Cada 30 segundos
+                await asyncio.sleep(30)  # Cada 30 segundos
                 
                 buffer_stats = self.buffer.get_statistics()
                 
@@ -660,14 +1122,20 @@ class MQTTOPCUABridge:
         # Reiniciar mensajes en procesamiento (por si el sistema se reinició)
         self.buffer.reset_processing_messages()
 
+        # Cola de mensajes en vivo, alimentada desde el thread de paho y
+        # desde las suscripciones OPC-UA
+        self._loop = asyncio.get_running_loop()
+        self.live_queue = asyncio.Queue(maxsize=self._LIVE_QUEUE_MAXSIZE)
+        self.ingress = _IngressRing(self._INGRESS_MAXLEN)
+        
         # Iniciar cliente MQTT
-        self.mqtt_client = MQTTClient(self.config, self.buffer)
+        self.mqtt_client = MQTTClient(self.config, self.buffer, ingress=self.ingress, logger=self.logger)
         if not self.mqtt_client.connect():
             self.logger.error("No se pudo conectar al broker MQTT")
             return False
 
         # Iniciar servidor OPC-UA
-        self.opcua_server = OPCUAServer(self.config, self.buffer)
+        self.opcua_server = OPCUAServer(self.config, self.buffer, live_sink=self._push_live, logger=self.logger)
         await self.opcua_server.init()
         await self.opcua_server.start()
 
@@ -676,12 +1144,13 @@ class MQTTOPCUABridge:
             self.sap_manager = SAPBridgeManager(self.config.sap, self.config, self.buffer, self.logger)
             await self.sap_manager.start()
 
-        # Iniciar procesamiento de mensajes
+        # Iniciar el thread escritor del anillo de entrada y el procesamiento
+        self._ingest_thread = threading.Thread(target=self._ingest_worker, name="bridge-ingest", daemon=True)
+        self._ingest_thread.start()
         asyncio.create_task(self._process_messages())
         
-        # Iniciar thread de estadísticas
-        stats_thread = threading.Thread(target=self._print_statistics, daemon=True)
-        stats_thread.start()
+        # Iniciar estadísticas periódicas en el mismo loop
+        asyncio.create_task(self._stats_loop())
         
         self.logger.info("Bridge MQTT-OPCUA iniciado correctamente con buffer persistente SQLite")
         self.logger.info(f"Buffer: {self.buffer.get_pending_count()} mensajes pendientes en el arranque")
@@ -701,6 +1170,9 @@ class MQTTOPCUABridge:
         # Detener cliente MQTT
         if self.mqtt_client:
             self.mqtt_client.disconnect()
+        if self._ingest_thread:
+            await self._loop.run_in_executor(None, self._ingest_thread.join, 2)
+        self._flush_ingress()
         
         # Detener servidor OPC-UA
         if self.opcua_server:
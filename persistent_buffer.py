@@ -8,12 +8,152 @@ import sqlite3
 import json
 import threading
 import queue
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Tuple
-from dataclasses import dataclass, asdict
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
 from enum import Enum
 import logging
+import sys
 from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# __slots__ en BufferedMessage (sin __dict__ por instancia) cuando el
+# intérprete lo admite; dataclass(slots=True) existe desde Python 3.10
+_DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+# Conexiones de solo lectura como máximo (get_statistics, conteos, exportación)
+_READER_POOL_SIZE = 4
+
+# Mensajes como máximo por transacción del hilo de escritura de add_message
+_WRITE_BATCH_SIZE = 256
+
+# Espera máxima de add_message por el ID asignado (segundos)
+_ADD_MESSAGE_TIMEOUT = 30.0
+
+# Ocupación (fracción de max_size) a partir de la cual se adelanta la limpieza
+_CLEANUP_PRESSURE = 0.9
+
+# Separación mínima entre limpiezas adelantadas por ocupación (segundos)
+_MIN_CLEANUP_GAP = 5.0
+
+# UPDATE ... RETURNING está disponible desde SQLite 3.35
+_SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Sentencias preparadas que sqlite3 guarda por conexión (por defecto 128).
+# El margen evita que los UPDATE ... IN (?, ?, ...) de tamaño variable de
+# mark_completed_many desplacen a las sentencias del camino caliente
+_STATEMENT_CACHE_SIZE = 256
+
+# El SQL del camino caliente es texto constante: la caché de sentencias de
+# sqlite3 se indexa por el texto, así que cada llamada reutiliza la
+# sentencia ya preparada en lugar de volver a compilarla
+
+# Columnas de messages en el orden que desempaqueta _row_to_message. Las
+# conexiones devuelven tuplas (sin row_factory): se accede por posición
+_MSG_COLS = (
+    "id, source, destination, topic_or_node, value, data_type, mapping_id, "
+    "status, priority, retry_count, max_retries, created_at, processed_at, "
+    "expire_at, error_message, metadata"
+)
+
+# Columnas exportadas de failed_messages, en el orden del SELECT
+_FAILED_EXPORT_COLS = (
+    'id', 'original_id', 'source', 'destination', 'topic_or_node',
+    'value', 'error_message', 'failed_at', 'retry_count', 'metadata'
+)
+
+# created_at y expire_at se calculan en SQLite (UTC, como CURRENT_TIMESTAMP
+# en las consultas) salvo que el mensaje traiga valores propios
+_INSERT_MESSAGE_SQL = """
+    INSERT INTO messages (
+        source, destination, topic_or_node, value, data_type,
+        mapping_id, status, priority, retry_count, max_retries,
+        created_at, expire_at, metadata
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+              COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, datetime('now', ?)), ?)
+"""
+
+# Solo cambian de estado los mensajes aún activos (pendientes o en
+# proceso): repetir mark_completed/mark_failed sobre un mensaje ya resuelto
+# no lo modifica ni descuenta otra vez _pending_count
+_ACTIVE_STATUS_SQL = "status IN ('pending', 'processing')"
+
+_MARK_COMPLETED_SQL = """
+    UPDATE messages 
+    SET status = ?, processed_at = CURRENT_TIMESTAMP 
+    WHERE id = ? AND """ + _ACTIVE_STATUS_SQL
+
+_DELETE_COMPLETED_SQL = "DELETE FROM messages WHERE id = ? AND " + _ACTIVE_STATUS_SQL
+
+# SET evalúa con los valores previos de la fila: el CASE ve el retry_count
+# anterior al incremento
+_MARK_FAILED_SQL = """
+    UPDATE messages 
+    SET retry_count = retry_count + 1,
+        error_message = ?,
+        status = CASE WHEN retry_count + 1 >= max_retries
+                      THEN ? ELSE ? END
+    WHERE id = ? AND """ + _ACTIVE_STATUS_SQL
+
+_ARCHIVE_FAILED_SQL = """
+    INSERT INTO failed_messages (
+        original_id, source, destination, topic_or_node, 
+        value, error_message, retry_count, metadata
+    )
+    SELECT id, source, destination, topic_or_node,
+           value, error_message, retry_count, metadata
+    FROM messages 
+    WHERE id = ? AND status = ?
+"""
+
+
+@lru_cache(maxsize=None)
+def _pending_select_sql(columns: str, by_source: bool, by_destination: bool) -> str:
+    """SELECT de pendientes (por prioridad y antigüedad) para cada combinación de filtros"""
+    query = f"""
+        SELECT {columns} FROM messages 
+        WHERE status = ? 
+        AND expire_at > CURRENT_TIMESTAMP
+        AND retry_count < max_retries
+    """
+    if by_source:
+        query += " AND source = ?"
+    if by_destination:
+        query += " AND destination = ?"
+    return query + " ORDER BY priority DESC, created_at ASC, id ASC LIMIT ?"
+
+
+@lru_cache(maxsize=None)
+def _claim_sql(by_source: bool, by_destination: bool) -> str:
+    """UPDATE ... RETURNING de reclamación para cada combinación de filtros"""
+    return f"""
+        UPDATE messages 
+        SET status = ? 
+        WHERE id IN ({_pending_select_sql("id", by_source, by_destination)})
+        RETURNING {_MSG_COLS}
+    """
+
+
+def _json_dumps(value: Any) -> str:
+    """Serializa a texto JSON para las columnas value/metadata (orjson si está disponible)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(value)
+
+
+def _json_loads(text: Any) -> Any:
+    """Parsea el texto JSON de una columna; orjson.JSONDecodeError hereda de json.JSONDecodeError"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(text)
+    return json.loads(text)
 
 class MessageStatus(Enum):
     """Estado del mensaje en el buffer"""
@@ -30,7 +170,7 @@ class MessagePriority(Enum):
     HIGH = 2
     CRITICAL = 3
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class BufferedMessage:
     """Mensaje en el buffer persistente"""
     id: Optional[int] = None
@@ -48,7 +188,12 @@ class BufferedMessage:
     processed_at: Optional[datetime] = None
     expire_at: Optional[datetime] = None
     error_message: Optional[str] = None
-    metadata: Optional[Dict] = None
+    # Siempre un dict (vacío si no hay metadatos): los lectores no necesitan
+    # comprobar None
+    metadata: Dict = field(default_factory=dict)
+    # Valor OPC-UA (ua.Variant) preparado en la ingesta; solo en memoria,
+    # no se persiste
+    opcua_variant: Any = field(default=None, repr=False, compare=False)
 
 class PersistentBuffer:
     """
@@ -60,7 +205,8 @@ class PersistentBuffer:
                  max_size: int = 10000,
                  ttl_minutes: int = 60,
                  cleanup_interval: int = 300,
-                 logger: Optional[logging.Logger] = None):
+                 logger: Optional[logging.Logger] = None,
+                 retain_completed: bool = True):
         """
         Inicializa el buffer persistente
         
@@ -70,21 +216,50 @@ class PersistentBuffer:
             ttl_minutes: Tiempo de vida de los mensajes en minutos
             cleanup_interval: Intervalo de limpieza en segundos
             logger: Logger opcional
+            retain_completed: Conservar los completados (24 h) para
+                buffer_monitor y buffer_analytics; si es False se borran
+                al completarse
         """
         self.db_path = db_path
         self.max_size = max_size
         self.ttl_minutes = ttl_minutes
+        self._ttl_modifier = f"+{ttl_minutes} minutes"
         self.cleanup_interval = cleanup_interval
+        self.retain_completed = retain_completed
         self.logger = logger or logging.getLogger(__name__)
         
-        # Thread safety
-        self.lock = threading.RLock()
-        self.connection_pool = {}
+        # Un único escritor (serializado con _write_lock) y un pool de
+        # conexiones de solo lectura: en WAL los lectores no bloquean al escritor
+        self._write_lock = threading.Lock()
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._reader_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._read_only_uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        
+        # Pendientes + procesando, mantenido en memoria para el control de
+        # desbordamiento. Sólo se modifica con la conexión de escritura
+        # tomada y se recalcula en cada limpieza
+        self._pending_count = 0
+        
+        # Callbacks avisados tras cada commit de add_messages con los
+        # destinos del lote; se llaman desde el hilo que escribe
+        self._listeners: List[Callable[[Set[str]], None]] = []
         
         # Inicializar base de datos
         self._init_database()
+        self._refresh_pending_count()
+        
+        # Cola de escritura de add_message: un único hilo agrupa en una
+        # transacción los mensajes de todos los productores
+        self._write_queue: "queue.Queue[Tuple[BufferedMessage, Future]]" = queue.Queue(maxsize=max_size)
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
         
-        # Iniciar thread de limpieza
+        # Iniciar thread de limpieza: se despierta cada cleanup_interval o
+        # antes si el buffer se acerca a max_size
+        self._cleanup_event = threading.Event()
+        self._stopping = threading.Event()
         self.cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
         self.cleanup_thread.start()
         
@@ -96,23 +271,66 @@ class PersistentBuffer:
             'messages_expired': 0
         }
     
-    @contextmanager
-    def _get_connection(self):
-        """Context manager para obtener conexión thread-safe"""
-        thread_id = threading.get_ident()
-        
-        if thread_id not in self.connection_pool:
-            conn = sqlite3.connect(self.db_path, timeout=30.0)
-            conn.row_factory = sqlite3.Row
+    def _open_connection(self, read_only: bool = False) -> sqlite3.Connection:
+        """Abre una conexión con los PRAGMAs del buffer"""
+        if read_only:
+            conn = sqlite3.connect(self._read_only_uri, uri=True, timeout=30.0, check_same_thread=False,
+                                   cached_statements=_STATEMENT_CACHE_SIZE)
+        else:
+            # Las transacciones implícitas del escritor empiezan con BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False,
+                                   isolation_level='IMMEDIATE',
+                                   cached_statements=_STATEMENT_CACHE_SIZE)
             conn.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging
             conn.execute("PRAGMA synchronous=NORMAL")
-            self.connection_pool[thread_id] = conn
-        
-        yield self.connection_pool[thread_id]
+            conn.execute("PRAGMA wal_autocheckpoint=1000")
+        # Ajustes por conexión, solo al crearla. El busy timeout lo fija
+        # timeout=30.0 en connect
+        conn.execute("PRAGMA cache_size=-20000")  # ~20 MB de caché de páginas
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        return conn
+    
+    @contextmanager
+    def _get_write_conn(self):
+        """Context manager de la conexión de escritura única (serializada con _write_lock)"""
+        with self._write_lock:
+            if self._writer_conn is None:
+                self._writer_conn = self._open_connection()
+            conn = self._writer_conn
+            try:
+                yield conn
+            except BaseException:
+                # Conexión compartida: no dejar una transacción a medias
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            else:
+                # Una salida normal sin commit (p. ej. un UPDATE que no tocó
+                # filas) no debe dejar el BEGIN IMMEDIATE abierto: mantendría
+                # bloqueada la base para los demás escritores
+                if conn.in_transaction:
+                    conn.rollback()
+    
+    @contextmanager
+    def _get_read_conn(self):
+        """Context manager de una conexión de solo lectura del pool"""
+        try:
+            conn = self._reader_pool.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                create = self._reader_count < _READER_POOL_SIZE
+                if create:
+                    self._reader_count += 1
+            conn = self._open_connection(read_only=True) if create else self._reader_pool.get()
+        try:
+            yield conn
+        finally:
+            self._reader_pool.put(conn)
     
     def _init_database(self):
         """Inicializa la estructura de la base de datos"""
-        with self._get_connection() as conn:
+        with self._get_write_conn() as conn:
             cursor = conn.cursor()
             
             # Tabla principal de mensajes
@@ -138,15 +356,17 @@ class PersistentBuffer:
             """)
             
             # Índices para mejorar rendimiento
+            # Cola de pendientes: status como prefijo sirve también a las
+            # consultas por estado, y el resto de columnas sigue el ORDER BY
+            # de la reclamación, que así se resuelve sin ordenación temporal
             cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_status 
-                ON messages(status)
+                CREATE INDEX IF NOT EXISTS idx_pending_queue 
+                ON messages(status, priority DESC, created_at ASC, id ASC)
             """)
             
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_priority_created 
-                ON messages(priority DESC, created_at ASC)
-            """)
+            # Sustituidos por idx_pending_queue en bases de datos existentes
+            cursor.execute("DROP INDEX IF EXISTS idx_status")
+            cursor.execute("DROP INDEX IF EXISTS idx_priority_created")
             
             cursor.execute("""
                 CREATE INDEX IF NOT EXISTS idx_source_dest 
@@ -198,59 +418,141 @@ class PersistentBuffer:
         Returns:
             ID del mensaje insertado o None si falla
         """
-        with self.lock:
+        try:
+            return self.add_message_async(message).result(timeout=_ADD_MESSAGE_TIMEOUT)
+        except Exception as e:
+            self.logger.error(f"Error añadiendo mensaje al buffer: {e}")
+            return None
+    
+    def add_message_async(self, message: BufferedMessage) -> Future:
+        """
+        Encola un mensaje para el hilo de escritura sin esperar al commit
+        
+        Args:
+            message: Mensaje a añadir
+            
+        Returns:
+            Future que se resuelve con el ID insertado (None si falla)
+        """
+        future: Future = Future()
+        self._write_queue.put((message, future))
+        return future
+    
+    def _writer_loop(self):
+        """Thread de escritura: vacía la cola de add_message en lotes"""
+        while True:
+            batch = [self._write_queue.get()]
+            while len(batch) < _WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
             try:
-                # Verificar límite de tamaño
-                if self.get_pending_count() >= self.max_size:
-                    self._handle_buffer_overflow()
+                message_ids = self.add_messages([message for message, _ in batch])
+                for index, (_, future) in enumerate(batch):
+                    future.set_result(message_ids[index] if message_ids else None)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+    
+    def add_messages(self, messages: List[BufferedMessage]) -> List[int]:
+        """
+        Añade varios mensajes en una sola transacción (BEGIN IMMEDIATE
+        implícito del escritor y un único commit)
+        
+        Args:
+            messages: Mensajes a añadir; se les asigna el ID insertado
+            
+        Returns:
+            IDs de los mensajes insertados, en el mismo orden (vacío si falla)
+        """
+        if not messages:
+            return []
+        
+        try:
+            # Verificar límite de tamaño una vez por lote
+            if self.get_pending_count() >= self.max_size:
+                self._handle_buffer_overflow()
+            
+            with self._get_write_conn() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(_INSERT_MESSAGE_SQL, [self._message_row(m) for m in messages])
                 
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Preparar datos
-                    if message.created_at is None:
-                        message.created_at = datetime.now()
-                    
-                    if message.expire_at is None:
-                        message.expire_at = datetime.now() + timedelta(minutes=self.ttl_minutes)
-                    
-                    value_json = json.dumps(message.value) if not isinstance(message.value, str) else message.value
-                    metadata_json = json.dumps(message.metadata) if message.metadata else None
-                    
-                    # Insertar mensaje
-                    cursor.execute("""
-                        INSERT INTO messages (
-                            source, destination, topic_or_node, value, data_type,
-                            mapping_id, status, priority, retry_count, max_retries,
-                            created_at, expire_at, metadata
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        message.source,
-                        message.destination,
-                        message.topic_or_node,
-                        value_json,
-                        message.data_type,
-                        message.mapping_id,
-                        message.status,
-                        message.priority,
-                        message.retry_count,
-                        message.max_retries,
-                        message.created_at,
-                        message.expire_at,
-                        metadata_json
-                    ))
-                    
-                    conn.commit()
-                    message_id = cursor.lastrowid
-                    
-                    self.stats['messages_added'] += 1
-                    self.logger.debug(f"Mensaje añadido al buffer: ID={message_id}, {message.source}->{message.destination}")
-                    
-                    return message_id
-                    
+                # Con AUTOINCREMENT y el escritor único los IDs de un
+                # mismo executemany son consecutivos
+                last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+                conn.commit()
+                
+                message_ids = list(range(last_id - len(messages) + 1, last_id + 1))
+                for message, message_id in zip(messages, message_ids):
+                    message.id = message_id
+                
+                self.stats['messages_added'] += len(messages)
+                self._pending_count += len(messages)
+                if (self._pending_count > _CLEANUP_PRESSURE * self.max_size
+                        and not self._cleanup_event.is_set()):
+                    self._cleanup_event.set()
+                self.logger.debug(f"Mensajes añadidos al buffer: {len(messages)}, IDs {message_ids[0]}-{message_ids[-1]}")
+            
+            if self._listeners:
+                self._notify_listeners({message.destination for message in messages})
+            return message_ids
+                
+        except Exception as e:
+            self.logger.error(f"Error añadiendo mensajes al buffer: {e}")
+            return []
+    
+    def add_listener(self, callback: Callable[[Set[str]], None]):
+        """
+        Registra un callback que se llama tras insertar mensajes
+        
+        Args:
+            callback: Recibe el conjunto de destinos del lote insertado. Se
+                ejecuta en el hilo escritor, así que debe ser rápido y no
+                bloquear (p. ej. loop.call_soon_threadsafe)
+        """
+        self._listeners.append(callback)
+    
+    def remove_listener(self, callback: Callable[[Set[str]], None]):
+        """Elimina un callback registrado con add_listener"""
+        try:
+            self._listeners.remove(callback)
+        except ValueError:
+            pass
+    
+    def _notify_listeners(self, destinations: Set[str]):
+        for callback in list(self._listeners):
+            try:
+                callback(destinations)
             except Exception as e:
-                self.logger.error(f"Error añadiendo mensaje al buffer: {e}")
-                return None
+                self.logger.error(f"Error notificando mensajes nuevos: {e}")
+
+    def _message_row(self, message: BufferedMessage) -> tuple:
+        """Prepara los parámetros del INSERT de un mensaje"""
+        value_json = _json_dumps(message.value) if not isinstance(message.value, str) else message.value
+        metadata_json = _json_dumps(message.metadata) if message.metadata else None
+        
+        return (
+            message.source,
+            message.destination,
+            message.topic_or_node,
+            value_json,
+            message.data_type,
+            message.mapping_id,
+            message.status,
+            message.priority,
+            message.retry_count,
+            message.max_retries,
+            message.created_at,
+            message.expire_at,
+            self._ttl_modifier,
+            metadata_json
+        )
     
     def get_next_message(self, source: Optional[str] = None, 
                         destination: Optional[str] = None) -> Optional[BufferedMessage]:
@@ -264,50 +566,8 @@ class PersistentBuffer:
         Returns:
             Siguiente mensaje o None si no hay mensajes
         """
-        with self.lock:
-            try:
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Construir query con filtros opcionales
-                    query = """
-                        SELECT * FROM messages 
-                        WHERE status = ? 
-                        AND expire_at > CURRENT_TIMESTAMP
-                        AND retry_count < max_retries
-                    """
-                    params = [MessageStatus.PENDING.value]
-                    
-                    if source:
-                        query += " AND source = ?"
-                        params.append(source)
-                    
-                    if destination:
-                        query += " AND destination = ?"
-                        params.append(destination)
-                    
-                    query += " ORDER BY priority DESC, created_at ASC LIMIT 1"
-                    
-                    cursor.execute(query, params)
-                    row = cursor.fetchone()
-                    
-                    if row:
-                        # Marcar como procesando
-                        cursor.execute("""
-                            UPDATE messages 
-                            SET status = ? 
-                            WHERE id = ?
-                        """, (MessageStatus.PROCESSING.value, row['id']))
-                        conn.commit()
-                        
-                        # Convertir a BufferedMessage
-                        return self._row_to_message(row)
-                    
-                    return None
-                    
-            except Exception as e:
-                self.logger.error(f"Error obteniendo mensaje del buffer: {e}")
-                return None
+        messages = self.claim_pending_batch(limit=1, destination=destination, source=source)
+        return messages[0] if messages else None
     
     def get_pending_messages(self, limit: int = 100, 
                             source: Optional[str] = None,
@@ -323,49 +583,78 @@ class PersistentBuffer:
         Returns:
             Lista de mensajes pendientes
         """
-        with self.lock:
-            try:
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    query = """
-                        SELECT * FROM messages 
-                        WHERE status = ? 
-                        AND expire_at > CURRENT_TIMESTAMP
-                        AND retry_count < max_retries
-                    """
-                    params = [MessageStatus.PENDING.value]
-                    
-                    if source:
-                        query += " AND source = ?"
-                        params.append(source)
-                    
-                    if destination:
-                        query += " AND destination = ?"
-                        params.append(destination)
-                    
-                    query += " ORDER BY priority DESC, created_at ASC LIMIT ?"
-                    params.append(limit)
-                    
-                    cursor.execute(query, params)
-                    rows = cursor.fetchall()
-                    
-                    # Marcar todos como procesando
-                    if rows:
-                        ids = [row['id'] for row in rows]
-                        placeholders = ','.join('?' * len(ids))
-                        cursor.execute(f"""
-                            UPDATE messages 
-                            SET status = ? 
-                            WHERE id IN ({placeholders})
-                        """, [MessageStatus.PROCESSING.value] + ids)
-                        conn.commit()
-                    
-                    return [self._row_to_message(row) for row in rows]
-                    
-            except Exception as e:
-                self.logger.error(f"Error obteniendo mensajes pendientes: {e}")
-                return []
+        return self.claim_pending_batch(limit=limit, destination=destination, source=source)
+    
+    @staticmethod
+    def _pending_params(source: Optional[str], destination: Optional[str],
+                        limit: int) -> list:
+        """Parámetros de _pending_select_sql / _claim_sql en el mismo orden"""
+        params = [MessageStatus.PENDING.value]
+        if source:
+            params.append(source)
+        if destination:
+            params.append(destination)
+        params.append(limit)
+        return params
+    
+    def claim_pending_batch(self, limit: int = 100,
+                            destination: Optional[str] = None,
+                            source: Optional[str] = None) -> List[BufferedMessage]:
+        """
+        Reclama un lote de mensajes pendientes marcándolos como procesando
+        en una sola sentencia UPDATE ... RETURNING, sin ventana entre la
+        lectura y la escritura
+        
+        Args:
+            limit: Número máximo de mensajes
+            destination: Filtrar por destino
+            source: Filtrar por fuente
+            
+        Returns:
+            Lista de mensajes reclamados, por prioridad y antigüedad
+        """
+        try:
+            with self._get_write_conn() as conn:
+                if not _SUPPORTS_RETURNING:
+                    return self._claim_select_update(conn, limit, source, destination)
+                
+                cursor = conn.execute(
+                    _claim_sql(bool(source), bool(destination)),
+                    [MessageStatus.PROCESSING.value] + self._pending_params(source, destination, limit)
+                )
+                rows = cursor.fetchall()
+                conn.commit()
+                
+                # RETURNING no garantiza orden: se reordena igual que la
+                # subconsulta (priority, created_at, id por posición)
+                rows.sort(key=lambda row: (-row[8], row[11], row[0]))
+                return [self._row_to_message(row) for row in rows]
+                
+        except Exception as e:
+            self.logger.error(f"Error reclamando mensajes pendientes: {e}")
+            return []
+    
+    def _claim_select_update(self, conn: sqlite3.Connection, limit: int,
+                             source: Optional[str],
+                             destination: Optional[str]) -> List[BufferedMessage]:
+        """Reclamación SELECT + UPDATE para SQLite < 3.35 (sin RETURNING)"""
+        rows = conn.execute(
+            _pending_select_sql(_MSG_COLS, bool(source), bool(destination)),
+            self._pending_params(source, destination, limit)
+        ).fetchall()
+        
+        # Marcar todos como procesando
+        if rows:
+            ids = [row[0] for row in rows]
+            placeholders = ','.join('?' * len(ids))
+            conn.execute(f"""
+                UPDATE messages 
+                SET status = ? 
+                WHERE id IN ({placeholders})
+            """, [MessageStatus.PROCESSING.value] + ids)
+            conn.commit()
+        
+        return [self._row_to_message(row) for row in rows]
     
     def mark_completed(self, message_id: int) -> bool:
         """
@@ -377,30 +666,75 @@ class PersistentBuffer:
         Returns:
             True si se actualizó correctamente
         """
-        with self.lock:
-            try:
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    cursor.execute("""
-                        UPDATE messages 
-                        SET status = ?, processed_at = CURRENT_TIMESTAMP 
-                        WHERE id = ?
-                    """, (MessageStatus.COMPLETED.value, message_id))
-                    
-                    conn.commit()
-                    
-                    if cursor.rowcount > 0:
-                        self.stats['messages_processed'] += 1
-                        self.logger.debug(f"Mensaje marcado como completado: ID={message_id}")
-                        return True
-                    
-                    return False
-                    
-            except Exception as e:
-                self.logger.error(f"Error marcando mensaje como completado: {e}")
+        try:
+            with self._get_write_conn() as conn:
+                cursor = conn.cursor()
+                
+                if self.retain_completed:
+                    cursor.execute(_MARK_COMPLETED_SQL, (MessageStatus.COMPLETED.value, message_id))
+                else:
+                    cursor.execute(_DELETE_COMPLETED_SQL, (message_id,))
+                
+                conn.commit()
+                
+                if cursor.rowcount > 0:
+                    self.stats['messages_processed'] += 1
+                    self._pending_count -= 1
+                    self.logger.debug(f"Mensaje marcado como completado: ID={message_id}")
+                    return True
+                
                 return False
-    
+                
+        except Exception as e:
+            self.logger.error(f"Error marcando mensaje como completado: {e}")
+            return False
+
+    def mark_completed_many(self, message_ids: List[int]) -> int:
+        """
+        Marca varios mensajes como completados en una sola transacción
+        
+        Args:
+            message_ids: IDs de los mensajes
+            
+        Returns:
+            Número de mensajes actualizados
+        """
+        if not message_ids:
+            return 0
+        
+        try:
+            with self._get_write_conn() as conn:
+                cursor = conn.cursor()
+                updated = 0
+                
+                # Por bloques para no superar el límite de parámetros de SQLite
+                for start in range(0, len(message_ids), 500):
+                    chunk = message_ids[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    if self.retain_completed:
+                        cursor.execute(f"""
+                            UPDATE messages 
+                            SET status = ?, processed_at = CURRENT_TIMESTAMP 
+                            WHERE id IN ({placeholders}) AND {_ACTIVE_STATUS_SQL}
+                        """, (MessageStatus.COMPLETED.value, *chunk))
+                    else:
+                        cursor.execute(
+                            f"DELETE FROM messages WHERE id IN ({placeholders}) AND {_ACTIVE_STATUS_SQL}",
+                            chunk
+                        )
+                    updated += cursor.rowcount
+                
+                conn.commit()
+                
+                self.stats['messages_processed'] += updated
+                self._pending_count -= updated
+                self.logger.debug(f"Mensajes marcados como completados: {updated}")
+                return updated
+                
+        except Exception as e:
+            self.logger.error(f"Error marcando mensajes como completados: {e}")
+            return 0
+
     def mark_failed(self, message_id: int, error_message: str = None) -> bool:
         """
         Marca un mensaje como fallido y incrementa el contador de reintentos
@@ -412,238 +746,254 @@ class PersistentBuffer:
         Returns:
             True si se actualizó correctamente
         """
-        with self.lock:
-            try:
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Obtener información actual del mensaje
-                    cursor.execute("""
-                        SELECT retry_count, max_retries, source, destination, 
-                               topic_or_node, value, metadata
-                        FROM messages 
-                        WHERE id = ?
-                    """, (message_id,))
-                    
-                    row = cursor.fetchone()
-                    if not row:
-                        return False
-                    
-                    retry_count = row['retry_count'] + 1
-                    
-                    if retry_count >= row['max_retries']:
-                        # Mover a tabla de mensajes fallidos
-                        cursor.execute("""
-                            INSERT INTO failed_messages (
-                                original_id, source, destination, topic_or_node, 
-                                value, error_message, retry_count, metadata
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (
-                            message_id, row['source'], row['destination'],
-                            row['topic_or_node'], row['value'], error_message,
-                            retry_count, row['metadata']
-                        ))
-                        
-                        # Marcar como fallido definitivamente
-                        status = MessageStatus.FAILED.value
-                        self.stats['messages_failed'] += 1
-                    else:
-                        # Volver a estado pendiente para reintentar
-                        status = MessageStatus.PENDING.value
-                    
-                    # Actualizar mensaje
-                    cursor.execute("""
-                        UPDATE messages 
-                        SET status = ?, retry_count = ?, error_message = ?
-                        WHERE id = ?
-                    """, (status, retry_count, error_message, message_id))
-                    
-                    conn.commit()
-                    
-                    self.logger.debug(f"Mensaje marcado como fallido: ID={message_id}, reintentos={retry_count}")
-                    return True
-                    
-            except Exception as e:
-                self.logger.error(f"Error marcando mensaje como fallido: {e}")
-                return False
-    
-    def get_pending_count(self) -> int:
-        """Obtiene el número de mensajes pendientes"""
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT COUNT(*) as count 
-                    FROM messages 
-                    WHERE status IN (?, ?)
-                """, (MessageStatus.PENDING.value, MessageStatus.PROCESSING.value))
+            with self._get_write_conn() as conn:
+                cursor = conn.execute(_MARK_FAILED_SQL, (
+                    error_message, MessageStatus.FAILED.value,
+                    MessageStatus.PENDING.value, message_id
+                ))
+                
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return False
+                
+                # Copiar a la tabla de fallidos si agotó los reintentos
+                cursor = conn.execute(_ARCHIVE_FAILED_SQL, (message_id, MessageStatus.FAILED.value))
+                
+                conn.commit()
+                
+                if cursor.rowcount:
+                    self.stats['messages_failed'] += 1
+                    self._pending_count -= 1
                 
-                row = cursor.fetchone()
-                return row['count'] if row else 0
+                self.logger.debug("Mensaje marcado como fallido: ID=%s", message_id)
+                return True
+                
+        except Exception as e:
+            self.logger.error(f"Error marcando mensaje como fallido: {e}")
+            return False
+    
+    def get_pending_count(self, exact: bool = False) -> int:
+        """
+        Obtiene el número de mensajes pendientes (incluye los que están en
+        procesamiento)
+        
+        Args:
+            exact: Contar en la base de datos en lugar de usar el contador
+                en memoria (diagnóstico)
+        """
+        if not exact:
+            return max(self._pending_count, 0)
+        
+        try:
+            with self._get_read_conn() as conn:
+                return self._count_pending(conn)
                 
         except Exception as e:
             self.logger.error(f"Error obteniendo conteo de pendientes: {e}")
             return 0
     
+    @staticmethod
+    def _count_pending(conn: sqlite3.Connection) -> int:
+        """Cuenta en la base de datos los mensajes pendientes o en procesamiento"""
+        row = conn.execute("""
+            SELECT COUNT(*) as count 
+            FROM messages 
+            WHERE status IN (?, ?)
+        """, (MessageStatus.PENDING.value, MessageStatus.PROCESSING.value)).fetchone()
+        return row[0] if row else 0
+    
+    def _refresh_pending_count(self):
+        """Recalcula el contador de pendientes desde la base de datos"""
+        try:
+            with self._get_write_conn() as conn:
+                self._pending_count = self._count_pending(conn)
+        except Exception as e:
+            self.logger.error(f"Error obteniendo conteo de pendientes: {e}")
+    
     def get_statistics(self) -> Dict[str, Any]:
         """Obtiene estadísticas del buffer"""
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Conteos por estado
-                cursor.execute("""
-                    SELECT status, COUNT(*) as count 
+            with self._get_read_conn() as conn:
+                # Una sola pasada agrupada por estado y ruta; los conteos por
+                # estado, por ruta y el pendiente más antiguo salen de ella
+                cursor = conn.execute("""
+                    SELECT status, source, destination, 
+                           COUNT(*) as count, MIN(created_at) as oldest 
                     FROM messages 
-                    GROUP BY status
+                    GROUP BY status, source, destination
                 """)
-                status_counts = {row['status']: row['count'] for row in cursor.fetchall()}
                 
-                # Conteos por origen/destino
-                cursor.execute("""
-                    SELECT source, destination, COUNT(*) as count 
-                    FROM messages 
-                    WHERE status IN (?, ?)
-                    GROUP BY source, destination
-                """, (MessageStatus.PENDING.value, MessageStatus.PROCESSING.value))
+                active = (MessageStatus.PENDING.value, MessageStatus.PROCESSING.value)
+                status_counts: Dict[str, int] = {}
+                route_totals: Dict[Tuple[str, str], int] = {}
+                oldest_pending = None
+                
+                for status, source, destination, count, oldest in cursor:
+                    status_counts[status] = status_counts.get(status, 0) + count
+                    
+                    if status in active:
+                        route = (source, destination)
+                        route_totals[route] = route_totals.get(route, 0) + count
+                    
+                    if status == MessageStatus.PENDING.value and oldest:
+                        if oldest_pending is None or oldest < oldest_pending:
+                            oldest_pending = oldest
                 
                 route_counts = [
-                    {'source': row['source'], 'destination': row['destination'], 'count': row['count']}
-                    for row in cursor.fetchall()
+                    {'source': source, 'destination': destination, 'count': count}
+                    for (source, destination), count in route_totals.items()
                 ]
-                
-                # Mensajes más antiguos pendientes
-                cursor.execute("""
-                    SELECT MIN(created_at) as oldest 
-                    FROM messages 
-                    WHERE status = ?
-                """, (MessageStatus.PENDING.value,))
-                
-                row = cursor.fetchone()
-                oldest_pending = row['oldest'] if row and row['oldest'] else None
+                pending_count = sum(status_counts.get(status, 0) for status in active)
                 
                 return {
-                    'buffer_size': self.get_pending_count(),
+                    'buffer_size': pending_count,
                     'max_size': self.max_size,
                     'status_counts': status_counts,
                     'route_counts': route_counts,
                     'oldest_pending': oldest_pending,
                     'runtime_stats': self.stats,
-                    'utilization_percent': (self.get_pending_count() / self.max_size) * 100
+                    'utilization_percent': (pending_count / self.max_size) * 100
                 }
                 
         except Exception as e:
             self.logger.error(f"Error obteniendo estadísticas: {e}")
             return {}
     
-    def _row_to_message(self, row: sqlite3.Row) -> BufferedMessage:
+    def _row_to_message(self, row: tuple) -> BufferedMessage:
         """Convierte una fila de la base de datos a BufferedMessage"""
+        # Por posición, en el orden de _MSG_COLS
+        (message_id, source, destination, topic_or_node, raw_value, data_type,
+         mapping_id, status, priority, retry_count, max_retries, created_at,
+         processed_at, expire_at, error_message, raw_metadata) = row
+        
         try:
-            value = json.loads(row['value']) if row['value'] else None
+            value = _json_loads(raw_value) if raw_value else None
         except json.JSONDecodeError:
-            value = row['value']
+            value = raw_value
         
         try:
-            metadata = json.loads(row['metadata']) if row['metadata'] else None
+            metadata = _json_loads(raw_metadata) if raw_metadata else {}
         except (json.JSONDecodeError, TypeError):
-            metadata = None
+            metadata = {}
         
         return BufferedMessage(
-            id=row['id'],
-            source=row['source'],
-            destination=row['destination'],
-            topic_or_node=row['topic_or_node'],
+            id=message_id,
+            source=source,
+            destination=destination,
+            topic_or_node=topic_or_node,
             value=value,
-            data_type=row['data_type'],
-            mapping_id=row['mapping_id'],
-            status=row['status'],
-            priority=row['priority'],
-            retry_count=row['retry_count'],
-            max_retries=row['max_retries'],
-            created_at=row['created_at'],
-            processed_at=row['processed_at'],
-            expire_at=row['expire_at'],
-            error_message=row['error_message'],
+            data_type=data_type,
+            mapping_id=mapping_id,
+            status=status,
+            priority=priority,
+            retry_count=retry_count,
+            max_retries=max_retries,
+            created_at=created_at,
+            processed_at=processed_at,
+            expire_at=expire_at,
+            error_message=error_message,
             metadata=metadata
         )
     
     def _handle_buffer_overflow(self):
         """Maneja el desbordamiento del buffer"""
         try:
-            with self._get_connection() as conn:
+            with self._get_write_conn() as conn:
                 cursor = conn.cursor()
                 
-                # Eliminar mensajes completados más antiguos
+                # Una sola pasada: primero los completados más antiguos y
+                # después los expirados, sin depender de DELETE ... LIMIT
+                # (SQLITE_ENABLE_UPDATE_DELETE_LIMIT)
                 cursor.execute("""
                     DELETE FROM messages 
                     WHERE id IN (
                         SELECT id FROM messages 
-                        WHERE status = ? 
-                        ORDER BY processed_at ASC 
-                        LIMIT 100
+                        WHERE status = ? OR expire_at < CURRENT_TIMESTAMP 
+                        ORDER BY (status = ?) DESC, 
+                                 COALESCE(processed_at, expire_at) ASC 
+                        LIMIT 200
                     )
-                """, (MessageStatus.COMPLETED.value,))
-                
-                if cursor.rowcount < 50:
-                    # Si no hay suficientes completados, eliminar expirados
-                    cursor.execute("""
-                        DELETE FROM messages 
-                        WHERE expire_at < CURRENT_TIMESTAMP 
-                        LIMIT 100
-                    """)
+                """, (MessageStatus.COMPLETED.value, MessageStatus.COMPLETED.value))
                 
                 conn.commit()
                 self.logger.warning(f"Buffer overflow manejado, eliminados {cursor.rowcount} mensajes")
+            
+            # El borrado de expirados puede incluir pendientes
+            self._refresh_pending_count()
+            self._cleanup_event.set()
                 
         except Exception as e:
             self.logger.error(f"Error manejando overflow del buffer: {e}")
     
     def _cleanup_loop(self):
         """Thread de limpieza periódica"""
-        import time
-        
-        while True:
+        while not self._stopping.is_set():
+            self._cleanup_event.wait(timeout=self.cleanup_interval)
+            if self._stopping.is_set():
+                break
+            self._cleanup_event.clear()
+            
             try:
-                time.sleep(self.cleanup_interval)
                 self._cleanup()
             except Exception as e:
                 self.logger.error(f"Error en limpieza periódica: {e}")
+            
+            # Con el buffer lleno cada inserción vuelve a avisar: no
+            # encadenar limpiezas seguidas
+            self._stopping.wait(_MIN_CLEANUP_GAP)
     
     def _cleanup(self):
         """Limpia mensajes antiguos y expirados"""
         try:
-            with self._get_connection() as conn:
+            with self._get_write_conn() as conn:
                 cursor = conn.cursor()
                 
-                # Marcar mensajes expirados
+                # Archivar y eliminar los expirados en la misma pasada; las
+                # filas con estado 'expired' de versiones anteriores se
+                # tratan igual. Las que están en 'processing' se dejan: un
+                # worker las tiene reclamadas y las resolverá (o volverán a
+                # 'pending' con reset_processing_messages)
+                expired_statuses = (
+                    MessageStatus.PENDING.value,
+                    MessageStatus.EXPIRED.value
+                )
+                # Un único instante de corte para las dos sentencias: una fila
+                # que venza entre ambas no se borra sin archivar
+                cutoff = cursor.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+                
                 cursor.execute("""
-                    UPDATE messages 
-                    SET status = ? 
-                    WHERE expire_at < CURRENT_TIMESTAMP 
+                    INSERT INTO failed_messages (
+                        original_id, source, destination, topic_or_node, 
+                        value, error_message, retry_count, metadata
+                    )
+                    SELECT id, source, destination, topic_or_node,
+                           value, ?, retry_count, metadata
+                    FROM messages 
+                    WHERE expire_at < ? 
                     AND status IN (?, ?)
-                """, (
-                    MessageStatus.EXPIRED.value,
-                    MessageStatus.PENDING.value,
-                    MessageStatus.PROCESSING.value
-                ))
+                """, (MessageStatus.EXPIRED.value, cutoff) + expired_statuses)
+                
+                cursor.execute("""
+                    DELETE FROM messages 
+                    WHERE expire_at < ? 
+                    AND status IN (?, ?)
+                """, (cutoff,) + expired_statuses)
                 
                 expired_count = cursor.rowcount
                 if expired_count > 0:
                     self.stats['messages_expired'] += expired_count
                 
-                # Eliminar mensajes completados antiguos (más de 24 horas)
-                cursor.execute("""
-                    DELETE FROM messages 
-                    WHERE status = ? 
-                    AND processed_at < datetime('now', '-1 day')
-                """, (MessageStatus.COMPLETED.value,))
-                
-                # Eliminar mensajes expirados antiguos (más de 7 días)
-                cursor.execute("""
-                    DELETE FROM messages 
-                    WHERE status = ? 
-                    AND expire_at < datetime('now', '-7 days')
-                """, (MessageStatus.EXPIRED.value,))
+                # Eliminar mensajes completados antiguos (más de 24 horas);
+                # sin retain_completed ya se borran al completarse
+                deleted_count = 0
+                if self.retain_completed:
+                    cursor.execute("""
+                        DELETE FROM messages 
+                        WHERE status = ? 
+                        AND processed_at < datetime('now', '-1 day')
+                    """, (MessageStatus.COMPLETED.value,))
+                    deleted_count = cursor.rowcount
                 
                 # Limpiar estadísticas antiguas (más de 30 días)
                 cursor.execute("""
@@ -653,8 +1003,11 @@ class PersistentBuffer:
                 
                 conn.commit()
                 
-                if expired_count > 0 or cursor.rowcount > 0:
-                    self.logger.info(f"Limpieza: {expired_count} expirados, {cursor.rowcount} eliminados")
+                # Corrige la deriva del contador (p. ej. borrados desde buffer_monitor)
+                self._pending_count = self._count_pending(conn)
+                
+                if expired_count > 0 or deleted_count > 0:
+                    self.logger.info(f"Limpieza: {expired_count} expirados, {deleted_count} eliminados")
                     
         except Exception as e:
             self.logger.error(f"Error en limpieza: {e}")
@@ -665,7 +1018,7 @@ class PersistentBuffer:
         Útil al reiniciar el sistema
         """
         try:
-            with self._get_connection() as conn:
+            with self._get_write_conn() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -682,36 +1035,85 @@ class PersistentBuffer:
         except Exception as e:
             self.logger.error(f"Error reiniciando mensajes: {e}")
     
-    def export_failed_messages(self, output_file: str = "failed_messages.json"):
-        """Exporta mensajes fallidos para análisis"""
+    def release_messages(self, message_ids: List[int]) -> int:
+        """
+        Devuelve a 'pending' mensajes concretos en estado 'processing'
+        
+        Args:
+            message_ids: IDs de los mensajes a liberar
+            
+        Returns:
+            Número de mensajes liberados
+        """
+        if not message_ids:
+            return 0
+        
         try:
-            with self._get_connection() as conn:
+            with self._get_write_conn() as conn:
                 cursor = conn.cursor()
+                released = 0
                 
-                cursor.execute("""
-                    SELECT * FROM failed_messages 
+                for start in range(0, len(message_ids), 500):
+                    chunk = message_ids[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    cursor.execute(f"""
+                        UPDATE messages 
+                        SET status = ? 
+                        WHERE id IN ({placeholders}) AND status = ?
+                    """, (MessageStatus.PENDING.value, *chunk, MessageStatus.PROCESSING.value))
+                    released += cursor.rowcount
+                
+                conn.commit()
+                return released
+                
+        except Exception as e:
+            self.logger.error(f"Error liberando mensajes: {e}")
+            return 0
+    
+    def export_failed_messages(self, output_file: str = "failed_messages.json",
+                               since_id: Optional[int] = None,
+                               checkpoint_file: Optional[str] = None):
+        """
+        Exporta mensajes fallidos para análisis
+        
+        Las filas se escriben a medida que se leen del cursor (un objeto JSON
+        por línea dentro del array), sin cargar la tabla entera en memoria.
+        
+        Args:
+            output_file: Fichero JSON de salida
+            since_id: Exportar sólo los fallidos con id mayor que este
+            checkpoint_file: Fichero con el último id exportado; si existe y
+                no se indica since_id se parte de él, y se actualiza al terminar
+        """
+        checkpoint = Path(checkpoint_file) if checkpoint_file else None
+        if since_id is None and checkpoint is not None and checkpoint.exists():
+            since_id = int(checkpoint.read_text().strip() or 0)
+        
+        try:
+            with self._get_read_conn() as conn:
+                cursor = conn.execute(f"""
+                    SELECT {', '.join(_FAILED_EXPORT_COLS)}
+                    FROM failed_messages 
+                    WHERE id > ?
                     ORDER BY failed_at DESC
-                """)
+                """, (since_id or 0,))
+                
+                exported = 0
+                last_id = since_id or 0
+                with open(output_file, 'w', encoding='utf-8') as f:
+                    f.write('[\n')
+                    for row in cursor:
+                        if exported:
+                            f.write(',\n')
+                        f.write(_json_dumps(dict(zip(_FAILED_EXPORT_COLS, row))))
+                        exported += 1
+                        last_id = max(last_id, row[0])
+                    f.write('\n]\n' if exported else ']\n')
                 
-                failed_messages = []
-                for row in cursor.fetchall():
-                    failed_messages.append({
-                        'id': row['id'],
-                        'original_id': row['original_id'],
-                        'source': row['source'],
-                        'destination': row['destination'],
-                        'topic_or_node': row['topic_or_node'],
-                        'value': row['value'],
-                        'error_message': row['error_message'],
-                        'failed_at': row['failed_at'],
-                        'retry_count': row['retry_count'],
-                        'metadata': row['metadata']
-                    })
-                
-                with open(output_file, 'w') as f:
-                    json.dump(failed_messages, f, indent=2, default=str)
-                
-                self.logger.info(f"Exportados {len(failed_messages)} mensajes fallidos a {output_file}")
+                if checkpoint is not None:
+                    checkpoint.write_text(f"{last_id}\n")
+                
+                self.logger.info(f"Exportados {exported} mensajes fallidos a {output_file}")
                 return True
                 
         except Exception as e:
@@ -721,9 +1123,28 @@ class PersistentBuffer:
     def close(self):
         """Cierra las conexiones y limpia recursos"""
         try:
-            for conn in self.connection_pool.values():
-                conn.close()
-            self.connection_pool.clear()
+            # Terminar de escribir lo encolado por add_message_async
+            self._write_queue.join()
+            
+            # Detener el thread de limpieza antes de cerrar el escritor
+            self._stopping.set()
+            self._cleanup_event.set()
+            if self.cleanup_thread.is_alive() and self.cleanup_thread is not threading.current_thread():
+                self.cleanup_thread.join(timeout=30)
+            
+            with self._write_lock:
+                if self._writer_conn is not None:
+                    self._writer_conn.close()
+                    self._writer_conn = None
+            
+            # Las conexiones se vuelven a abrir bajo demanda si se usa el buffer después
+            with self._reader_lock:
+                while True:
+                    try:
+                        self._reader_pool.get_nowait().close()
+                    except queue.Empty:
+                        break
+                    self._reader_count -= 1
             self.logger.info("Buffer persistente cerrado")
         except Exception as e:
             self.logger.error(f"Error cerrando buffer: {e}")
@@ -1,11 +1,78 @@
 """Conector HTTP hacia SAP."""
 
+import dataclasses
+import hashlib
+import json
+import random
+import re
+import threading
 import time
-from typing import Any, Dict, Optional
+import uuid
+from urllib.parse import urlencode
+from typing import Any, Dict, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from config import SAPConfig, SAPMapping
+from config import SAPConfig, SAPMapping, SAPRetryConfig
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Conexiones keep-alive por host y hosts distintos en el pool de la sesión
+_POOL_MAXSIZE = 64
+_POOL_CONNECTIONS = 16
+
+# Tokens OAuth2 compartidos entre conectores con las mismas credenciales,
+# por clave sha256(token_url|client_id|client_secret|scope). Un cerrojo por
+# clave deja una sola obtención en curso aunque varios hilos caduquen a la vez
+_OAUTH_CACHE: Dict[str, Dict[str, Any]] = {}
+_OAUTH_LOCKS: Dict[str, threading.Lock] = {}
+_OAUTH_LOCKS_GUARD = threading.Lock()
+
+
+def _oauth_lock(key: str) -> threading.Lock:
+    with _OAUTH_LOCKS_GUARD:
+        lock = _OAUTH_LOCKS.get(key)
+        if lock is None:
+            lock = _OAUTH_LOCKS[key] = threading.Lock()
+        return lock
+
+
+# Errores de cliente que sí merece la pena reintentar; el resto de 4xx
+# fallarían igual en el siguiente intento
+_RETRYABLE_4XX = frozenset((408, 429))
+
+# Línea de estado de cada respuesta interna de un $batch
+_BATCH_STATUS_RE = re.compile(rb"^HTTP/1\.[01] (\d{3})", re.MULTILINE)
+
+
+def _json_default(value: Any) -> Any:
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+
+def _json_dumps(value: Any) -> bytes:
+    """Serializa el cuerpo de la petición a JSON en bytes (orjson si está disponible).
+
+    Admite dicts y dataclasses; orjson serializa las dataclasses sin pasar
+    por un dict intermedio.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_json_default).encode("utf-8")
+
+
+def _json_loads(payload: bytes) -> Any:
+    """Parsea JSON directamente desde los bytes de la respuesta."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(payload)
+    return json.loads(payload)
 
 
 class SAPConnector:
@@ -15,8 +82,34 @@ class SAPConnector:
         self.config = config
         self.logger = logger.getChild("sap.connector")
         self.session = requests.Session()
-        self._token_info: Optional[Dict[str, Any]] = None
-        if self.config.auth.type.lower() == "basic":
+        # Pool keep-alive propio: reutiliza TCP/TLS entre push y fetch. Los
+        # reintentos los gestiona push, no urllib3
+        adapter = HTTPAdapter(
+            pool_connections=_POOL_CONNECTIONS,
+            pool_maxsize=_POOL_MAXSIZE,
+            max_retries=Retry(total=0),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Connection"] = "keep-alive"
+        creds = self.config.auth
+        self._oauth_key = hashlib.sha256(
+            f"{creds.token_url}|{creds.client_id}|{creds.client_secret}|{creds.scope}".encode()
+        ).hexdigest()
+        # Cuerpo de la petición de token, fijo por credenciales: se codifica
+        # una sola vez
+        self._oauth_body = urlencode({
+            "grant_type": "client_credentials",
+            "client_id": creds.client_id or "",
+            "client_secret": creds.client_secret or "",
+            "scope": creds.scope or "",
+        }).encode()
+        # Tipo de autenticación resuelto una vez; sin OAuth2 las cabeceras
+        # de autenticación son siempre las mismas (vacías)
+        auth_mode = self.config.auth.type.lower()
+        self._oauth2 = auth_mode == "oauth2"
+        self._static_headers: Dict[str, str] = {}
+        if auth_mode == "basic":
             self.session.auth = (
                 self.config.auth.username,
                 self.config.auth.password,
@@ -24,12 +117,13 @@ class SAPConnector:
 
     def push(self, payload: Dict[str, Any], mapping: SAPMapping) -> bool:
         url = self._build_url(mapping.outbound.resource_path or mapping.resource_path)
-        headers = self._build_headers()
+        headers = {**self._build_headers(), "Content-Type": "application/json"}
+        body = _json_dumps(payload)
         for attempt in range(1, mapping.retry.max_attempts + 1):
             try:
                 response = self.session.post(
                     url,
-                    json=payload,
+                    data=body,
                     headers=headers,
                     timeout=self.config.timeout,
                 )
@@ -38,6 +132,9 @@ class SAPConnector:
                 self.logger.warning(
                     "SAP push fallo status=%s body=%s", response.status_code, response.text
                 )
+                if 400 <= response.status_code < 500 and response.status_code not in _RETRYABLE_4XX:
+                    return False
+                delay = self._retry_after(response, self._backoff_delay(mapping.retry, attempt))
             except requests.RequestException as exc:
                 self.logger.error(
                     "SAP push error intento %s/%s: %s",
@@ -45,9 +142,85 @@ class SAPConnector:
                     mapping.retry.max_attempts,
                     exc,
                 )
-            time.sleep(mapping.retry.backoff_seconds)
+                delay = self._backoff_delay(mapping.retry, attempt)
+            if attempt < mapping.retry.max_attempts:
+                time.sleep(delay)
         return False
 
+    def push_batch(self, payloads: List[Dict[str, Any]], mapping: SAPMapping) -> List[bool]:
+        """Envía varios payloads en una petición OData $batch, un changeset por payload.
+
+        Devuelve el resultado de cada payload en el mismo orden. Sin
+        reintentos propios: los fallidos vuelven al buffer con mark_failed.
+        """
+        if not payloads:
+            return []
+        resource = (mapping.outbound.resource_path or mapping.resource_path or '').lstrip('/')
+        boundary = f"batch_{uuid.uuid4().hex}"
+        body = self._build_batch_body(boundary, resource, payloads)
+        headers = {
+            **self._build_headers(),
+            "Content-Type": f"multipart/mixed; boundary={boundary}",
+        }
+        try:
+            response = self.session.post(
+                self._build_url("$batch"),
+                data=body,
+                headers=headers,
+                timeout=self.config.timeout,
+            )
+        except requests.RequestException as exc:
+            self.logger.error("SAP $batch error: %s", exc)
+            return [False] * len(payloads)
+        if response.status_code not in (200, 202):
+            self.logger.warning(
+                "SAP $batch fallo status=%s body=%s", response.status_code, response.text
+            )
+            return [False] * len(payloads)
+        # Una línea de estado por changeset, en el orden de la petición
+        statuses = [int(code) for code in _BATCH_STATUS_RE.findall(response.content)]
+        if len(statuses) != len(payloads):
+            self.logger.warning(
+                "SAP $batch: %s respuestas para %s peticiones", len(statuses), len(payloads)
+            )
+            return [False] * len(payloads)
+        return [200 <= code < 300 for code in statuses]
+
+    @staticmethod
+    def _build_batch_body(boundary: str, resource: str, payloads: List[Dict[str, Any]]) -> bytes:
+        parts = []
+        for index, payload in enumerate(payloads):
+            changeset = f"changeset_{boundary}_{index}"
+            parts.append(
+                (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: multipart/mixed; boundary={changeset}\r\n\r\n"
+                    f"--{changeset}\r\n"
+                    "Content-Type: application/http\r\n"
+                    "Content-Transfer-Encoding: binary\r\n\r\n"
+                    f"POST {resource} HTTP/1.1\r\n"
+                    "Content-Type: application/json\r\n\r\n"
+                ).encode()
+                + _json_dumps(payload)
+                + f"\r\n--{changeset}--\r\n".encode()
+            )
+        parts.append(f"--{boundary}--\r\n".encode())
+        return b"".join(parts)
+
+    @staticmethod
+    def _backoff_delay(retry: SAPRetryConfig, attempt: int) -> float:
+        """Backoff exponencial con jitter completo, acotado por max_backoff_seconds."""
+        ceiling = min(retry.max_backoff_seconds, retry.backoff_seconds * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    @staticmethod
+    def _retry_after(response: requests.Response, default: float) -> float:
+        """Espera indicada por SAP en Retry-After (segundos) o la configurada."""
+        value = response.headers.get("Retry-After")
+        if value and value.isdigit():
+            return float(value)
+        return default
+
     def fetch(self, mapping: SAPMapping) -> Optional[Any]:
         url = self._build_url(mapping.resource_path)
         headers = self._build_headers()
@@ -59,12 +232,16 @@ class SAPConnector:
                 timeout=self.config.timeout,
             )
             if response.status_code == 200:
-                return response.json()
+                return _json_loads(response.content)
             self.logger.warning(
                 "SAP fetch fallo status=%s body=%s", response.status_code, response.text
             )
         except requests.RequestException as exc:
             self.logger.error("SAP fetch error: %s", exc)
+        except ValueError as exc:
+            # Antes lo cubría RequestException: response.json() lanza
+            # requests.JSONDecodeError
+            self.logger.error("SAP fetch respuesta no JSON: %s", exc)
         return None
 
     def _build_url(self, path: str) -> str:
@@ -73,38 +250,49 @@ class SAPConnector:
         return f"{base}/{path}" if path else base
 
     def _build_headers(self) -> Dict[str, str]:
-        if self.config.auth.type.lower() == "oauth2":
-            token = self._get_oauth_token()
-            if token:
-                return {"Authorization": f"Bearer {token}"}
-        return {}
+        """Cabeceras de autenticación; el dict devuelto es compartido y no debe modificarse."""
+        if not self._oauth2:
+            return self._static_headers
+        token_info = _OAUTH_CACHE.get(self._oauth_key)
+        if not token_info or token_info["expires_at"] <= time.time():
+            if not self._get_oauth_token():
+                return self._static_headers
+            token_info = _OAUTH_CACHE[self._oauth_key]
+        return token_info["headers"]
 
     def _get_oauth_token(self) -> Optional[str]:
-        if self._token_info and self._token_info.get("expires_at", 0) > time.time():
-            return self._token_info.get("access_token")
+        token_info = _OAUTH_CACHE.get(self._oauth_key)
+        if token_info and token_info["expires_at"] > time.time():
+            return token_info["access_token"]
         creds = self.config.auth
         if not creds.token_url or not creds.client_id or not creds.client_secret:
             self.logger.error("OAuth2 mal configurado")
             return None
-        try:
-            response = self.session.post(
-                creds.token_url,
-                data={
-                    "grant_type": "client_credentials",
-                    "client_id": creds.client_id,
-                    "client_secret": creds.client_secret,
-                    "scope": creds.scope or "",
-                },
-                timeout=self.config.timeout,
-            )
-            response.raise_for_status()
-            data = response.json()
-            expires_in = data.get("expires_in", 3600)
-            self._token_info = {
-                "access_token": data.get("access_token"),
-                "expires_at": time.time() + max(30, int(expires_in) - 60),
-            }
-            return self._token_info["access_token"]
-        except requests.RequestException as exc:
-            self.logger.error("OAuth2 token error: %s", exc)
+        with _oauth_lock(self._oauth_key):
+            # Otro hilo pudo renovarlo mientras se esperaba el cerrojo
+            token_info = _OAUTH_CACHE.get(self._oauth_key)
+            if token_info and token_info["expires_at"] > time.time():
+                return token_info["access_token"]
+            try:
+                response = self.session.post(
+                    creds.token_url,
+                    data=self._oauth_body,
+                    headers={"Content-Type": "application/x-www-form-urlencoded"},
+                    timeout=self.config.timeout,
+                )
+                response.raise_for_status()
+                data = _json_loads(response.content)
+                expires_in = data.get("expires_in", 3600)
+                access_token = data.get("access_token")
+                _OAUTH_CACHE[self._oauth_key] = {
+                    "access_token": access_token,
+                    # Cabecera ya formateada para _build_headers
+                    "headers": {"Authorization": f"Bearer {access_token}"} if access_token else {},
+                    "expires_at": time.time() + max(30, int(expires_in) - 60),
+                }
+                return _OAUTH_CACHE[self._oauth_key]["access_token"]
+            except requests.RequestException as exc:
+                self.logger.error("OAuth2 token error: %s", exc)
+            except ValueError as exc:
+                self.logger.error("OAuth2 token respuesta no JSON: %s", exc)
         return None
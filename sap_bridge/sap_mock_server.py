@@ -4,6 +4,26 @@ import json
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from typing import Dict, Any
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _json_dumps(value: Any) -> bytes:
+    """Serializa a JSON en bytes (orjson si está disponible)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value)
+    return json.dumps(value).encode()
+
+
+def _json_loads(body: bytes) -> Any:
+    """Parsea JSON desde bytes; orjson.JSONDecodeError hereda de json.JSONDecodeError."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(body)
+    return json.loads(body.decode())
+
 _DATA = {
     "ProductionOrders": [
         {"Order": "001", "Status": "OPEN", "Quantity": 10},
@@ -11,38 +31,41 @@ _DATA = {
     ]
 }
 
+# Respuesta GET ya serializada por recurso; do_POST invalida la del recurso
+_GET_CACHE: Dict[str, bytes] = {}
+_ACCEPTED_BODY = _json_dumps({"status": "accepted"})
+
 
 class MockSAPHandler(BaseHTTPRequestHandler):
     protocol_version = "HTTP/1.1"
 
-    def _set_headers(self, status=200, content_type="application/json"):
+    def _respond(self, status: int, body: bytes, content_type: str = "application/json"):
+        """Envía cabeceras y cuerpo en una sola escritura al socket."""
         self.send_response(status)
         self.send_header("Content-Type", content_type)
-        payload = getattr(self, "_payload", b"")
-        self.send_header("Content-Length", str(len(payload)))
-        self.end_headers()
+        self.send_header("Content-Length", str(len(body)))
+        # Equivale a end_headers() con el cuerpo en el mismo buffer
+        self._headers_buffer.append(b"\r\n" + body)
+        self.flush_headers()
 
     def do_GET(self):  # noqa: N802
         resource = self._extract_resource()
-        payload = _DATA.get(resource, [])
-        body = json.dumps({"value": payload}).encode()
-        self._payload = body
-        self._set_headers()
-        self.wfile.write(body)
+        body = _GET_CACHE.get(resource)
+        if body is None:
+            body = _GET_CACHE[resource] = _json_dumps({"value": _DATA.get(resource, [])})
+        self._respond(200, body)
 
     def do_POST(self):  # noqa: N802
         resource = self._extract_resource()
         length = int(self.headers.get("Content-Length", 0))
         body = self.rfile.read(length) if length else b"{}"
         try:
-            data = json.loads(body.decode())
-        except json.JSONDecodeError:
+            data = _json_loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
             data = {"raw": body.decode(errors="ignore")}
         _DATA.setdefault(resource, []).append(data)
-        response = json.dumps({"status": "accepted"}).encode()
-        self._payload = response
-        self._set_headers(202)
-        self.wfile.write(response)
+        _GET_CACHE.pop(resource, None)
+        self._respond(202, _ACCEPTED_BODY)
 
     def log_message(self, format, *args):  # noqa: A003
         return
@@ -1,12 +1,38 @@
 """Transformaciones entre SAP y el bridge."""
 
-from typing import Any, Dict
-from datetime import datetime
+import time
+from typing import Any, Dict, Iterable
+from datetime import datetime, timezone
 
 from persistent_buffer import BufferedMessage, MessagePriority
 from config import SAPMapping
 from sap_bridge.transform_utils import load_transform
 
+# Nombre de prioridad de la configuración (en minúsculas) -> valor del buffer
+_PRIORITY_VALUES = {priority.name.lower(): priority.value for priority in MessagePriority}
+_DEFAULT_PRIORITY = MessagePriority.NORMAL.value
+
+# Último segundo formateado por _iso_now: (segundo, texto ISO hasta los segundos)
+_iso_now_cache = (None, "")
+
+
+def _iso_now() -> str:
+    """Hora UTC actual como datetime.utcnow().isoformat() (sin zona, con microsegundos).
+
+    Mismo formato que fetched_at ha tenido siempre, sin datetime.utcnow,
+    obsoleto desde Python 3.12. La parte hasta los segundos solo se
+    formatea una vez por segundo; los microsegundos se añaden en cada llamada.
+    """
+    global _iso_now_cache
+    second, nanos = divmod(time.time_ns(), 1_000_000_000)
+    cached_second, text = _iso_now_cache
+    if second != cached_second:
+        text = datetime.fromtimestamp(second, tz=timezone.utc).replace(tzinfo=None).isoformat()
+        _iso_now_cache = (second, text)
+    micros = nanos // 1000
+    # isoformat() omite la fracción cuando los microsegundos son 0
+    return f"{text}.{micros:06d}" if micros else text
+
 
 def _identity_outbound(value: Any, mapping: SAPMapping, message: BufferedMessage) -> Dict[str, Any]:
     if isinstance(value, dict):
@@ -21,12 +47,21 @@ def _identity_inbound(payload: Dict[str, Any], mapping: SAPMapping) -> Any:
 class SAPTransformer:
     """Gestiona transformaciones bidireccionales con SAP."""
 
-    def __init__(self):
+    def __init__(self, mappings: Iterable[SAPMapping] = ()):
         self._outbound_cache = {}
         self._inbound_cache = {}
+        # Resolver al arrancar las transformaciones de los mapeos conocidos:
+        # una ruta inválida falla aquí y no con el primer mensaje
+        for mapping in mappings:
+            self._get_outbound_transform(mapping)
+            self._get_inbound_transform(mapping)
 
     def bridge_to_sap(self, message: BufferedMessage, mapping: SAPMapping) -> Dict[str, Any]:
         transform = self._get_outbound_transform(mapping)
+        if transform is _identity_outbound:
+            # Caso por defecto resuelto aquí, sin la llamada a la función
+            value = message.value
+            return value if isinstance(value, dict) else {"value": value}
         return transform(message.value, mapping, message)
 
     def sap_to_bridge(self, payload: Dict[str, Any], mapping: SAPMapping) -> BufferedMessage:
@@ -35,7 +70,7 @@ class SAPTransformer:
         priority = self._get_priority_value(mapping.priority)
         metadata = {
             "sap_mapping_id": mapping.mapping_id,
-            "fetched_at": datetime.utcnow().isoformat(),
+            "fetched_at": _iso_now(),
         }
         return BufferedMessage(
             source="sap",
@@ -49,24 +84,23 @@ class SAPTransformer:
         )
 
     def _get_outbound_transform(self, mapping: SAPMapping):
-        if mapping.mapping_id not in self._outbound_cache:
-            self._outbound_cache[mapping.mapping_id] = load_transform(
+        transform = self._outbound_cache.get(mapping.mapping_id)
+        if transform is None:
+            transform = self._outbound_cache[mapping.mapping_id] = load_transform(
                 mapping.outbound.transform,
                 _identity_outbound,
             )
-        return self._outbound_cache[mapping.mapping_id]
+        return transform
 
     def _get_inbound_transform(self, mapping: SAPMapping):
-        if mapping.mapping_id not in self._inbound_cache:
-            self._inbound_cache[mapping.mapping_id] = load_transform(
+        transform = self._inbound_cache.get(mapping.mapping_id)
+        if transform is None:
+            transform = self._inbound_cache[mapping.mapping_id] = load_transform(
                 mapping.inbound.transform,
                 _identity_inbound,
             )
-        return self._inbound_cache[mapping.mapping_id]
+        return transform
 
     @staticmethod
     def _get_priority_value(name: str) -> int:
-        try:
-            return MessagePriority[name.upper()].value
-        except KeyError:
-            return MessagePriority.NORMAL.value
+        return _PRIORITY_VALUES.get(name.lower(), _DEFAULT_PRIORITY)
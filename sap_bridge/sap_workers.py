@@ -2,7 +2,8 @@
 
 import asyncio
 import time
-from typing import Any, Iterable, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from config import BridgeConfig, SAPConfig, SAPMapping
 from persistent_buffer import BufferedMessage, PersistentBuffer, MessagePriority
@@ -22,6 +23,11 @@ except Exception:  # pragma: no cover
         return None
 
 
+# Tope de la espera sin mensajes hacia SAP, en múltiplos de poll_interval.
+# Los mensajes nuevos despiertan el worker antes vía PersistentBuffer.add_listener
+_MAX_IDLE_FACTOR = 8
+
+
 class SAPBridgeManager:
     """Coordina la sincronización entre el buffer y SAP."""
 
@@ -31,15 +37,43 @@ class SAPBridgeManager:
         self.buffer = buffer
         self.logger = logger.getChild("sap.manager")
         self.connector = SAPConnector(sap_config, self.logger)
-        self.transformer = SAPTransformer()
+        self.transformer = SAPTransformer(sap_config.mappings)
         self._tasks: List[asyncio.Task] = []
         self._running = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._new_data: Optional[asyncio.Event] = None
+        # Hilos propios para los envíos a SAP (requests es síncrono): no
+        # compiten con el executor por defecto que usan fetch y el buffer
+        self._push_executor: Optional[ThreadPoolExecutor] = None
+        self._index_mappings()
+
+    def _index_mappings(self):
+        """Índices de _get_mapping; volver a llamar si cambian los mapeos."""
+        self._by_id: Dict[str, SAPMapping] = {}
+        # (posición, mapeo): ante topic y nodo de mapeos distintos gana el
+        # primero en la configuración, como en el recorrido lineal
+        self._by_topic: Dict[str, Tuple[int, SAPMapping]] = {}
+        self._by_node: Dict[str, Tuple[int, SAPMapping]] = {}
+        for index, mapping in enumerate(self.config.mappings):
+            self._by_id.setdefault(mapping.mapping_id, mapping)
+            if mapping.direction not in ("bridge_to_sap", "bidirectional"):
+                continue
+            if mapping.mqtt_topic:
+                self._by_topic.setdefault(mapping.mqtt_topic, (index, mapping))
+            if mapping.opcua_node_id:
+                self._by_node.setdefault(mapping.opcua_node_id, (index, mapping))
 
     async def start(self):
         if not self.config.enabled or self._running:
             return
         self._running = True
-        loop = asyncio.get_running_loop()
+        loop = self._loop = asyncio.get_running_loop()
+        self._new_data = asyncio.Event()
+        self._push_executor = ThreadPoolExecutor(
+            max_workers=max(1, self.config.max_concurrent_pushes),
+            thread_name_prefix="sap-push",
+        )
+        self.buffer.add_listener(self._on_buffer_added)
         self._tasks = [
             loop.create_task(self._process_buffer_to_sap(), name="sap-buffer-to-sap"),
             loop.create_task(self._poll_sap_to_buffer(), name="sap-poll"),
@@ -49,85 +83,196 @@ class SAPBridgeManager:
         if not self._running:
             return
         self._running = False
+        self.buffer.remove_listener(self._on_buffer_added)
         for task in self._tasks:
             task.cancel()
         if self._tasks:
             await asyncio.gather(*self._tasks, return_exceptions=True)
         self._tasks.clear()
+        if self._push_executor is not None:
+            self._push_executor.shutdown(wait=False, cancel_futures=True)
+            self._push_executor = None
+
+    def _on_buffer_added(self, destinations):
+        """Llamado desde el hilo escritor del buffer tras cada inserción"""
+        if "sap" in destinations and not self._new_data.is_set():
+            self._loop.call_soon_threadsafe(self._new_data.set)
 
     async def _process_buffer_to_sap(self):
+        # Sin mensajes la espera se duplica hasta el tope; una inserción con
+        # destino SAP la corta y un lote no vacío la devuelve a poll_interval
+        idle = self.config.poll_interval
         while self._running:
-            messages = self.buffer.get_pending_messages(limit=10, destination="sap")
-            if not messages:
+            try:
+                messages = self.buffer.get_pending_messages(limit=10, destination="sap")
+                if not messages:
+                    try:
+                        await asyncio.wait_for(self._new_data.wait(), timeout=idle)
+                    except asyncio.TimeoutError:
+                        idle = min(idle * 2, self.config.poll_interval * _MAX_IDLE_FACTOR)
+                    self._new_data.clear()
+                    continue
+                idle = self.config.poll_interval
+                # Un grupo por mapeo: los grupos se envían en paralelo y cada
+                # uno en orden, así se conserva el orden de los mensajes de un
+                # mismo mapeo. El lote siguiente no se reclama hasta terminar
+                # este. Un grupo que falla no detiene a los demás
+                groups: Dict[Optional[str], List[BufferedMessage]] = {}
+                for message in messages:
+                    mapping_id = message.metadata.get("sap_mapping_id")
+                    groups.setdefault(mapping_id, []).append(message)
+                results = await asyncio.gather(*(
+                    self._push_group(mapping_id, group) for mapping_id, group in groups.items()
+                ), return_exceptions=True)
+                for mapping_id, result in zip(groups, results):
+                    if isinstance(result, Exception):
+                        self.logger.error("Error enviando grupo SAP %s: %s", mapping_id, result)
+            except Exception as exc:  # noqa: BLE001
+                self.logger.error("Error en el envío buffer -> SAP: %s", exc)
                 await asyncio.sleep(self.config.poll_interval)
+
+    async def _push_group(self, mapping_id: Optional[str], messages: List[BufferedMessage]):
+        resolved = []
+        for message in messages:
+            mapping = self._get_mapping(mapping_id, message)
+            if not mapping:
+                self.logger.error("SAP mapping no encontrado para mensaje %s", message.id)
+                self.buffer.mark_failed(message.id, "sap_mapping_missing")
                 continue
-            for message in messages:
-                mapping_id = message.metadata.get("sap_mapping_id") if message.metadata else None
-                mapping = self._get_mapping(mapping_id, message)
-                if not mapping:
-                    self.logger.error("SAP mapping no encontrado para mensaje %s", message.id)
-                    self.buffer.mark_failed(message.id, "sap_mapping_missing")
-                    continue
-                try:
-                    payload = self.transformer.bridge_to_sap(message, mapping)
-                    start = time.monotonic()
-                    if self.connector.push(payload, mapping):
-                        observe_latency(time.monotonic() - start)
-                        self.buffer.mark_completed(message.id)
-                        self.logger.info("Bridge -> SAP completado id=%s", message.id)
-                        record_success("bridge_to_sap")
-                    else:
-                        raise RuntimeError("SAP push failed")
-                except Exception as exc:  # noqa: BLE001
-                    self.logger.error("Error enviando a SAP id=%s: %s", message.id, exc)
-                    self.buffer.mark_failed(message.id, str(exc))
-                    record_failure("bridge_to_sap")
+            resolved.append((message, mapping))
+        
+        # Mensajes de mapeos con outbound.batch: una petición $batch por mapeo
+        batched: Dict[str, List[Any]] = {}
+        for message, mapping in resolved:
+            if mapping.outbound.batch:
+                batched.setdefault(mapping.mapping_id, []).append((message, mapping))
+            else:
+                await self._push_message(message, mapping)
+        for entries in batched.values():
+            await self._push_batch(entries)
+
+    async def _push_message(self, message: BufferedMessage, mapping: SAPMapping):
+        try:
+            payload = self.transformer.bridge_to_sap(message, mapping)
+            start = time.monotonic()
+            # El conector es síncrono (requests): en el pool de envíos para no
+            # bloquear el event loop durante la petición ni sus reintentos
+            if await self._loop.run_in_executor(self._push_executor, self.connector.push, payload, mapping):
+                observe_latency(time.monotonic() - start)
+                self.buffer.mark_completed(message.id)
+                self.logger.info("Bridge -> SAP completado id=%s", message.id)
+                record_success("bridge_to_sap")
+            else:
+                raise RuntimeError("SAP push failed")
+        except Exception as exc:  # noqa: BLE001
+            self.logger.error("Error enviando a SAP id=%s: %s", message.id, exc)
+            self.buffer.mark_failed(message.id, str(exc))
+            record_failure("bridge_to_sap")
+
+    async def _push_batch(self, entries: List[Any]):
+        mapping = entries[0][1]
+        payloads = []
+        sendable = []
+        for message, _ in entries:
+            try:
+                payloads.append(self.transformer.bridge_to_sap(message, mapping))
+                sendable.append(message)
+            except Exception as exc:  # noqa: BLE001
+                self.logger.error("Error enviando a SAP id=%s: %s", message.id, exc)
+                self.buffer.mark_failed(message.id, str(exc))
+                record_failure("bridge_to_sap")
+        if not sendable:
+            return
+        start = time.monotonic()
+        try:
+            results = await self._loop.run_in_executor(
+                self._push_executor, self.connector.push_batch, payloads, mapping
+            )
+        except Exception as exc:  # noqa: BLE001
+            self.logger.error("Error enviando $batch a SAP %s: %s", mapping.mapping_id, exc)
+            for message in sendable:
+                self.buffer.mark_failed(message.id, str(exc))
+                record_failure("bridge_to_sap")
+            return
+        observe_latency(time.monotonic() - start)
+        completed = [message.id for message, ok in zip(sendable, results) if ok]
+        if completed:
+            self.buffer.mark_completed_many(completed)
+            self.logger.info("Bridge -> SAP $batch completados %s/%s", len(completed), len(sendable))
+        for message, ok in zip(sendable, results):
+            if ok:
+                record_success("bridge_to_sap")
+            else:
+                self.buffer.mark_failed(message.id, "SAP $batch part failed")
+                record_failure("bridge_to_sap")
 
     async def _poll_sap_to_buffer(self):
+        # Las lecturas de un ciclo van en paralelo (acotadas por el semáforo)
+        # y cada página se encola y se libera en cuanto llega: como mucho hay
+        # max_concurrent_fetches páginas en memoria a la vez
+        semaphore = asyncio.Semaphore(max(1, self.config.max_concurrent_fetches))
         while self._running:
-            for mapping in self.config.mappings:
-                if mapping.direction not in ("sap_to_bridge", "bidirectional"):
-                    continue
-                try:
-                    start = time.monotonic()
-                    data = self.connector.fetch(mapping)
-                    duration = time.monotonic() - start
-                    if data is None:
-                        record_failure("sap_to_bridge")
-                    else:
-                        observe_latency(duration)
-                        record_success("sap_to_bridge")
-                except Exception as exc:  # noqa: BLE001
-                    self.logger.error("Error obteniendo de SAP %s: %s", mapping.mapping_id, exc)
-                    data = None
-                    record_failure("sap_to_bridge")
-                if data is None:
-                    continue
-                for item in self._iterate_items(data):
-                    buffered = self.transformer.sap_to_bridge(item, mapping)
-                    buffered.metadata = buffered.metadata or {}
-                    buffered.metadata.update({
-                        "sap_mapping_id": mapping.mapping_id,
-                        "origin": "sap",
-                    })
-                    buffered_id = self.buffer.add_message(buffered)
-                    if buffered_id:
-                        self.logger.debug("SAP -> buffer encolado id=%s", buffered_id)
+            fetchable = [
+                mapping for mapping in self.config.mappings
+                if mapping.direction in ("sap_to_bridge", "bidirectional")
+            ]
+            await asyncio.gather(*(
+                self._poll_mapping(mapping, semaphore) for mapping in fetchable
+            ))
             await asyncio.sleep(self.config.poll_interval)
 
+    async def _poll_mapping(self, mapping: SAPMapping, semaphore: asyncio.Semaphore):
+        data = await self._fetch_mapping(mapping, semaphore)
+        if data is None:
+            return
+        to_add = []
+        for item in self._iterate_items(data):
+            buffered = self.transformer.sap_to_bridge(item, mapping)
+            buffered.metadata.update({
+                "sap_mapping_id": mapping.mapping_id,
+                "origin": "sap",
+            })
+            to_add.append(buffered)
+        del data
+        # Una sola transacción por página, fuera del event loop
+        buffered_ids = await asyncio.to_thread(self.buffer.add_messages, to_add)
+        if buffered_ids:
+            self.logger.debug(
+                "SAP -> buffer encolados %s mensajes ids=%s-%s",
+                len(buffered_ids), buffered_ids[0], buffered_ids[-1],
+            )
+
+    async def _fetch_mapping(self, mapping: SAPMapping, semaphore: asyncio.Semaphore) -> Optional[Any]:
+        async with semaphore:
+            try:
+                start = time.monotonic()
+                data = await asyncio.to_thread(self.connector.fetch, mapping)
+                duration = time.monotonic() - start
+            except Exception as exc:  # noqa: BLE001
+                self.logger.error("Error obteniendo de SAP %s: %s", mapping.mapping_id, exc)
+                record_failure("sap_to_bridge")
+                return None
+        if data is None:
+            record_failure("sap_to_bridge")
+        else:
+            observe_latency(duration)
+            record_success("sap_to_bridge")
+        return data
+
     def _get_mapping(self, mapping_id: str, message: BufferedMessage) -> SAPMapping:
         if mapping_id:
-            for mapping in self.config.mappings:
-                if mapping.mapping_id == mapping_id:
-                    return mapping
-        topic = message.metadata.get("bridge_topic") if message.metadata else None
-        node = message.metadata.get("bridge_node") if message.metadata else None
-        for mapping in self.config.mappings:
-            if mapping.direction in ("bridge_to_sap", "bidirectional") and (
-                (topic and mapping.mqtt_topic == topic)
-                or (node and mapping.opcua_node_id == node)
-            ):
+            mapping = self._by_id.get(mapping_id)
+            if mapping:
                 return mapping
+        metadata = message.metadata
+        topic = metadata.get("bridge_topic")
+        node = metadata.get("bridge_node")
+        by_topic = self._by_topic.get(topic) if topic else None
+        by_node = self._by_node.get(node) if node else None
+        if by_topic and by_node:
+            return min(by_topic, by_node, key=lambda entry: entry[0])[1]
+        if by_topic or by_node:
+            return (by_topic or by_node)[1]
         return None
 
     @staticmethod
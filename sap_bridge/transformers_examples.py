@@ -1,19 +1,36 @@
 """Ejemplos de transformaciones SAP."""
 
-from typing import Any, Dict
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Union
 
 from config import SAPMapping
 from persistent_buffer import BufferedMessage
 
+_DC = dict(slots=True) if sys.version_info >= (3, 10) else {}
 
-def production_order_to_sap(value: Any, mapping: SAPMapping, message: BufferedMessage) -> Dict[str, Any]:
+
+@dataclass(**_DC)
+class ProductionOrderSAP:
+    """Orden de producción con los campos que espera SAP.
+
+    SAPConnector serializa la dataclass directamente (orjson), sin dict
+    intermedio por mensaje.
+    """
+    Order: Optional[str] = None
+    Status: Optional[str] = None
+    Quantity: Any = 0
+
+
+def production_order_to_sap(value: Any, mapping: SAPMapping,
+                            message: BufferedMessage) -> Union[ProductionOrderSAP, Dict[str, Any]]:
     """Ejemplo de transformación Bridge -> SAP."""
     if isinstance(value, dict):
-        return {
-            "Order": value.get("order"),
-            "Status": value.get("status"),
-            "Quantity": value.get("quantity", 0),
-        }
+        return ProductionOrderSAP(
+            Order=value.get("order"),
+            Status=value.get("status"),
+            Quantity=value.get("quantity", 0),
+        )
     return {"value": value}
 
 
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from config import BridgeMapping
+from persistent_buffer import PersistentBuffer
+
+try:
+    import mqtt_opcua_bridge as bridge
+except ImportError as exc:  # asyncua sin SubHandler u otras dependencias del bridge
+    pytest.skip(f"mqtt_opcua_bridge no importable: {exc}", allow_module_level=True)
+ua = bridge.ua
+
+
+class _Node:
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+
+
+class _Logger:
+    def debug(self, *args, **kwargs):
+        pass
+
+    def error(self, *args, **kwargs):
+        pass
+
+
+def build_handler(tmp_path, current_value=False):
+    buffer = PersistentBuffer(str(tmp_path / "buffer.db"))
+    mapping = BridgeMapping(
+        mqtt_topic="light/room",
+        opcua_node_id="ns=2;s=Light.Room",
+        data_type="Boolean",
+        direction="bidirectional",
+    )
+    delivered = []
+    handler = bridge.OPCUASubscriptionHandler(
+        buffer, [mapping], _Logger(), live_sink=lambda message: delivered.append(message.value)
+    )
+    node = _Node(ua.NodeId(1, 2))
+    handler.register_node(node, mapping.opcua_node_id, current_value)
+    return buffer, handler, node, delivered
+
+
+def test_ingress_ring_bounds_and_order():
+    ring = bridge._IngressRing(maxlen=3)
+    assert [ring.offer(i) for i in range(4)] == [True, True, True, False]
+    assert ring.drain(2) == [0, 1]
+    assert ring.drain(10) == [2]
+    assert len(ring) == 0
+
+
+def test_ingress_ring_wait_wakes_on_offer():
+    ring = bridge._IngressRing(maxlen=3)
+    threading.Timer(0.05, ring.offer, args=("message",)).start()
+    start = time.monotonic()
+    ring.wait(5.0)
+    assert time.monotonic() - start < 2.0
+    assert ring.drain(1) == ["message"]
+
+
+def test_handler_skips_initial_value_and_own_writes(tmp_path):
+    buffer, handler, node, delivered = build_handler(tmp_path)
+
+    handler.datachange_notification(node, False, None)  # valor inicial
+    handler.note_bridge_write(node.nodeid, True)
+    handler.datachange_notification(node, True, None)  # eco de la escritura
+    handler.datachange_notification(node, False, None)  # cambio externo
+    buffer.close()
+
+    assert delivered == [False]
+
+
+def test_handler_does_not_expect_echo_for_unchanged_write(tmp_path):
+    buffer, handler, node, delivered = build_handler(tmp_path)
+
+    handler.datachange_notification(node, False, None)
+    # Escribir el valor actual no genera notificación
+    handler.note_bridge_write(node.nodeid, False)
+    handler.datachange_notification(node, True, None)
+    handler.datachange_notification(node, False, None)
+    buffer.close()
+
+    assert delivered == [True, False]
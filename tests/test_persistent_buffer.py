@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from persistent_buffer import BufferedMessage, PersistentBuffer
+
+
+def build_message(value):
+    return BufferedMessage(
+        id=None,
+        source="mqtt",
+        destination="opcua",
+        topic_or_node="sensores/temp",
+        value=value,
+        data_type="Double",
+        mapping_id="test",
+        expire_at=datetime.now() + timedelta(days=1),
+    )
+
+
+def test_concurrent_get_next_message_returns_distinct_ids(tmp_path):
+    buffer = PersistentBuffer(str(tmp_path / "buffer.db"))
+    buffer.add_messages([build_message(i) for i in range(200)])
+
+    claimed = [[], []]
+    barrier = threading.Barrier(2)
+
+    def worker(index):
+        barrier.wait()
+        while True:
+            message = buffer.get_next_message()
+            if message is None:
+                break
+            claimed[index].append(message.id)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    buffer.close()
+
+    ids = claimed[0] + claimed[1]
+    assert len(ids) == 200
+    assert len(set(ids)) == 200
+
+
+def test_add_messages_notifies_listeners_with_destinations(tmp_path):
+    buffer = PersistentBuffer(str(tmp_path / "buffer.db"))
+    notified = []
+    buffer.add_listener(notified.append)
+
+    message = build_message(1)
+    message.destination = "sap"
+    buffer.add_messages([build_message(0), message])
+    buffer.remove_listener(notified.append)
+    buffer.add_messages([build_message(2)])
+    buffer.close()
+
+    assert notified == [{"opcua", "sap"}]
+
+
+def test_repeated_marks_do_not_duplicate_or_double_count(tmp_path):
+    buffer = PersistentBuffer(str(tmp_path / "buffer.db"))
+    failed_id, completed_id, _ = buffer.add_messages([build_message(i) for i in range(3)])
+
+    for attempt in range(5):
+        buffer.mark_failed(failed_id, f"e{attempt}")
+    assert buffer.mark_completed(completed_id) is True
+    assert buffer.mark_completed(completed_id) is False
+    assert buffer.mark_completed_many([completed_id]) == 0
+
+    with buffer._get_read_conn() as conn:
+        archived = conn.execute(
+            "SELECT COUNT(*) FROM failed_messages WHERE original_id = ?", (failed_id,)
+        ).fetchone()[0]
+        retry_count = conn.execute(
+            "SELECT retry_count FROM messages WHERE id = ?", (failed_id,)
+        ).fetchone()[0]
+    pending = buffer.get_pending_count()
+    exact = buffer.get_pending_count(exact=True)
+    buffer.close()
+
+    assert archived == 1
+    assert retry_count == 3
+    assert pending == exact == 1
+
+
+def test_mark_failed_unknown_id_releases_write_lock(tmp_path):
+    db_path = str(tmp_path / "buffer.db")
+    buffer = PersistentBuffer(db_path)
+    (message_id,) = buffer.add_messages([build_message(0)])
+
+    assert buffer.mark_failed(message_id + 1000, "missing") is False
+    assert buffer._writer_conn.in_transaction is False
+
+    other = sqlite3.connect(db_path, timeout=0.1)
+    try:
+        other.execute("UPDATE messages SET error_message = 'x' WHERE id = ?", (message_id,))
+        other.commit()
+    finally:
+        other.close()
+    buffer.close()
+
+
+def test_cleanup_archives_expired_pending_and_keeps_processing(tmp_path):
+    buffer = PersistentBuffer(str(tmp_path / "buffer.db"))
+    expired = [build_message(i) for i in range(2)]
+    for message in expired:
+        message.expire_at = datetime.now() - timedelta(days=2)
+    expired[1].status = "processing"
+    pending_id, processing_id = buffer.add_messages(expired)
+
+    buffer._cleanup()
+    completed = buffer.mark_completed(processing_id)
+
+    with buffer._get_read_conn() as conn:
+        archived = [row[0] for row in conn.execute("SELECT original_id FROM failed_messages")]
+        remaining = [row[0] for row in conn.execute("SELECT id FROM messages")]
+    buffer.close()
+
+    assert archived == [pending_id]
+    assert remaining == [processing_id]
+    assert completed is True
+
+
+def test_release_messages_returns_processing_rows_to_pending(tmp_path):
+    buffer = PersistentBuffer(str(tmp_path / "buffer.db"))
+    messages = [build_message(i) for i in range(3)]
+    for message in messages[:2]:
+        message.status = "processing"
+    live_id, other_id, pending_id = buffer.add_messages(messages)
+
+    released = buffer.release_messages([live_id, pending_id])
+    claimed = [message.id for message in buffer.claim_pending_batch(10)]
+    buffer.close()
+
+    assert released == 1
+    assert sorted(claimed) == sorted([live_id, pending_id])
+    assert other_id not in claimed
@@ -48,6 +48,54 @@ def test_fetch_returns_payload():
         assert payload == {"value": []}
 
 
+def test_push_batch_reports_each_part():
+    config = build_config()
+    mapping = SAPMapping(
+        mapping_id="test",
+        resource_path="orders",
+        direction="bridge_to_sap",
+        priority="normal",
+        inbound=SAPInboundConfig(destination="mqtt", target="sap/test", data_type="JSON"),
+        outbound=SAPOutboundConfig(resource_path="orders", batch=True),
+        retry=SAPRetryConfig(max_attempts=1, backoff_seconds=0),
+    )
+    connector = SAPConnector(config, _DummyLogger())
+    response_body = (
+        b"--batchresponse\r\nContent-Type: application/http\r\n\r\n"
+        b"HTTP/1.1 201 Created\r\n\r\n{}\r\n"
+        b"--batchresponse\r\nContent-Type: application/http\r\n\r\n"
+        b"HTTP/1.1 400 Bad Request\r\n\r\n{}\r\n"
+        b"--batchresponse--\r\n"
+    )
+    with requests_mock.Mocker() as m:
+        adapter = m.post("https://sap.example.com/api/$batch", content=response_body, status_code=202)
+        assert connector.push_batch([{"id": 1}, {"id": 2}], mapping) == [True, False]
+        sent = adapter.last_request.body
+        assert sent.count(b"POST orders HTTP/1.1") == 2
+        assert adapter.last_request.headers["Content-Type"].startswith("multipart/mixed; boundary=")
+
+
+def test_push_does_not_retry_client_errors():
+    config = build_config()
+    mapping = SAPMapping(
+        mapping_id="test",
+        resource_path="orders",
+        direction="bridge_to_sap",
+        priority="normal",
+        inbound=SAPInboundConfig(destination="mqtt", target="sap/test", data_type="JSON"),
+        outbound=SAPOutboundConfig(resource_path="orders"),
+        retry=SAPRetryConfig(max_attempts=3, backoff_seconds=0),
+    )
+    connector = SAPConnector(config, _DummyLogger())
+    with requests_mock.Mocker() as m:
+        adapter = m.post("https://sap.example.com/api/orders", status_code=400)
+        assert connector.push({"foo": "bar"}, mapping) is False
+        assert adapter.call_count == 1
+        adapter = m.post("https://sap.example.com/api/orders", status_code=429)
+        assert connector.push({"foo": "bar"}, mapping) is False
+        assert adapter.call_count == 3
+
+
 class _DummyLogger:
     def getChild(self, name):  # noqa: D401
         return self